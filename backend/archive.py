@@ -0,0 +1,188 @@
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from content_store import release_conversation_contents
+from db_routing import use_primary
+from models import db, Agent, ArchivedConversation, Conversation, Message
+from query_budget import exempt_from_query_budget
+from shards import data_binds, locate, use_agent_shard, use_shard
+
+# 压缩级别，6是zlib在速度和压缩率之间的默认折中
+COMPRESSION_LEVEL = 6
+
+
+def _pack(conversation, messages):
+    """将对话和消息序列化为压缩的JSON"""
+    document = {
+        'conversation': {
+            'agent_id': conversation.agent_id,
+            'conversation_id': conversation.conversation_id,
+            'created_at': conversation.created_at.isoformat(),
+            'updated_at': conversation.updated_at.isoformat(),
+        },
+        'messages': [
+            {'role': message.role, 'content': message.content, 'timestamp': message.timestamp.isoformat()}
+            for message in messages
+        ],
+    }
+    return zlib.compress(json.dumps(document, ensure_ascii=False).encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def _unpack(blob):
+    """解压归档内容"""
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def _archive_dir():
+    """归档文件目录，未配置ARCHIVE_DIR时归档内容直接存入数据库"""
+    return current_app.config.get('ARCHIVE_DIR') or os.getenv('ARCHIVE_DIR')
+
+
+def deleted_agent_ids():
+    """已软删除、数据尚未清理完的智能体ID（智能体表在主库上，不能与分片上的对话联表）"""
+    return [row.id for row in db.session.query(Agent.id).filter(Agent.deleted_at.isnot(None))]
+
+
+def idle_conversation_ids(cutoff, limit, deleted_agents=()):
+    """查找最后活动时间早于cutoff的对话
+
+    分叉出的对话和被分叉的对话按内部ID互相引用，恢复时ID会改变，不归档。
+    已软删除的对话和deleted_agents中智能体的对话等待后台删除，归档后再恢复会让它们重新出现，也不归档。
+    """
+    last_activity = db.func.coalesce(db.func.max(Message.timestamp), Conversation.created_at)
+    forks = aliased(Conversation)
+    has_forks = (select(forks.id)
+                 .where(forks.parent_id == Conversation.id, forks.deleted_at.is_(None))
+                 .exists())
+    query = (
+        db.session.query(Conversation.id)
+        .outerjoin(Message, Message.conversation_id == Conversation.id)
+        .filter(Conversation.deleted_at.is_(None), Conversation.parent_id.is_(None), ~has_forks)
+    )
+    if deleted_agents:
+        query = query.filter(Conversation.agent_id.notin_(deleted_agents))
+    rows = query.group_by(Conversation.id).having(last_activity < cutoff).limit(limit).all()
+    return [row.id for row in rows]
+
+
+def archive_conversation(conversation, archive_dir=None):
+    """将单个对话打包进冷存储并删除其热数据行（不提交事务）"""
+    messages = (
+        Message.query.filter_by(conversation_id=conversation.id)
+        .order_by(Message.timestamp.asc(), Message.id.asc())
+        .all()
+    )
+    blob = _pack(conversation, messages)
+    last_activity = messages[-1].timestamp if messages else conversation.created_at
+
+    archived = ArchivedConversation(
+        agent_id=conversation.agent_id,
+        conversation_id=conversation.conversation_id,
+        message_count=len(messages),
+        created_at=conversation.created_at,
+        last_activity_at=last_activity,
+    )
+    if archive_dir:
+        agent_dir = os.path.join(archive_dir, str(conversation.agent_id))
+        os.makedirs(agent_dir, exist_ok=True)
+        archived.storage = 'file'
+        archived.location = os.path.join(agent_dir, f'{conversation.id}.json.zz')
+        with open(archived.location, 'wb') as f:
+            f.write(blob)
+    else:
+        archived.storage = 'db'
+        archived.payload = blob
+    db.session.add(archived)
+
+    release_conversation_contents([conversation.id])
+    Message.query.filter_by(conversation_id=conversation.id).delete(synchronize_session=False)
+    db.session.delete(conversation)
+    return archived
+
+
+def archive_idle_conversations(days, batch_size=100):
+    """在主库和各分片上归档超过days天没有活动的对话，每批提交一次，返回归档的对话数"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    archive_dir = _archive_dir()
+    archived = 0
+    deleted_agents = deleted_agent_ids()
+    # 结束主库上的读事务，归档期间不占着主库
+    db.session.commit()
+    for key in data_binds():
+        use_shard(key)
+        while True:
+            ids = idle_conversation_ids(cutoff, batch_size, deleted_agents)
+            if not ids:
+                break
+            for conversation in Conversation.query.filter(Conversation.id.in_(ids)).all():
+                archive_conversation(conversation, archive_dir)
+            db.session.commit()
+            archived += len(ids)
+    return archived
+
+
+@exempt_from_query_budget
+def rehydrate_conversation(conversation_id, agent_id=None):
+    """将归档的对话恢复为热数据，没有对应归档或智能体已删除时返回None
+
+    指定agent_id时在会话当前的分片上查找（调用方已切换到智能体的分片），否则在各分片中查找。
+    """
+    # 恢复需要写入，当前请求余下的查询都走主库
+    use_primary()
+    if agent_id is not None:
+        archived = ArchivedConversation.query.filter_by(conversation_id=conversation_id, agent_id=agent_id).first()
+    else:
+        archived = locate(ArchivedConversation, conversation_id=conversation_id)
+    if not archived:
+        return None
+    owner = db.session.get(Agent, archived.agent_id)
+    if owner is None or owner.deleted_at is not None:
+        # 智能体已删除，归档等待后台删除，不能恢复
+        return None
+    if agent_id is None:
+        use_agent_shard(owner, write=True)
+
+    # 先删除归档记录，并发的恢复请求中只有一个能删除成功
+    deleted = ArchivedConversation.query.filter_by(id=archived.id).delete(synchronize_session=False)
+    if not deleted:
+        db.session.rollback()
+        return Conversation.query.filter_by(agent_id=archived.agent_id, conversation_id=conversation_id).first()
+
+    # 提交后归档对象会过期，先取出需要的字段
+    storage, location = archived.storage, archived.location
+    if storage == 'file':
+        with open(location, 'rb') as f:
+            document = _unpack(f.read())
+    else:
+        document = _unpack(archived.payload)
+
+    data = document['conversation']
+    conversation = Conversation(
+        agent_id=data['agent_id'],
+        conversation_id=data['conversation_id'],
+        created_at=datetime.fromisoformat(data['created_at']),
+        updated_at=datetime.fromisoformat(data['updated_at']),
+    )
+    db.session.add(conversation)
+    db.session.flush()
+    # 逐条创建消息对象，启用去重时内容会重新写入去重存储
+    db.session.add_all([
+        Message(
+            conversation_id=conversation.id,
+            role=message['role'],
+            content=message['content'],
+            timestamp=datetime.fromisoformat(message['timestamp']),
+        )
+        for message in document['messages']
+    ])
+    db.session.commit()
+
+    if storage == 'file':
+        os.remove(location)
+    return conversation
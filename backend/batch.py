@@ -0,0 +1,127 @@
+from flask import current_app, request
+
+from db_routing import RoutingSession
+from models import db
+from search import apply_deferred_changes
+from shards import shards_enabled
+
+# 批处理允许的子请求方法
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+# 从批处理请求转发给子请求的请求头（用户识别、限流和认证）
+FORWARDED_HEADERS = ('Authorization', 'Cookie', 'X-User-Id', 'X-Client-Id')
+# 子请求响应中保留的响应头
+RESPONSE_HEADERS = ('Location', 'Retry-After')
+
+
+class BatchError(Exception):
+    """批处理请求本身无效"""
+
+
+def load_batch_config(app, environ):
+    """从环境变量读取批处理配置"""
+    app.config['BATCH_MAX_REQUESTS'] = int(environ.get('BATCH_MAX_REQUESTS', '20'))
+
+
+class BatchSession(RoutingSession):
+    """事务批处理的会话：所有语句都在批处理的连接上执行，子请求中的commit只释放保存点"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        return self.bind
+
+
+def _normalize(item, transactional):
+    """校验子请求，返回(id, 方法, 路径, 请求体, 请求头)"""
+    if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+        raise BatchError('Each request needs a path')
+    method = str(item.get('method', 'GET')).upper()
+    if method not in BATCH_METHODS:
+        raise BatchError(f'Unsupported method {method}')
+    path = item['path']
+    if not path.startswith('/api/'):
+        path = '/api' + (path if path.startswith('/') else '/' + path)
+    if path.split('?')[0].rstrip('/') == '/api/batch':
+        raise BatchError('Batch requests cannot be nested')
+    if transactional and path.startswith('/api/chat/'):
+        # 对话会等待模型，放在事务中会长时间持有写锁
+        raise BatchError('Chat requests cannot run in a transactional batch')
+    return item.get('id'), method, path, item.get('body'), item.get('headers') or {}
+
+
+def _dispatch(method, path, body, headers, session):
+    """在独立的应用上下文中执行一个子请求（g、限流、查询预算互不影响），返回响应"""
+    app = current_app._get_current_object()
+    names = FORWARDED_HEADERS + (current_app.config.get('RATE_LIMIT_USER_HEADER') or '',)
+    forwarded = {name: request.headers[name] for name in names if name and name in request.headers}
+    forwarded.update(headers)
+    with app.app_context():
+        if session is not None:
+            # 子请求中的db.session使用批处理的会话
+            db.session.registry.set(session)
+        with app.test_request_context(path, method=method, json=body, headers=forwarded,
+                                      environ_base={'REMOTE_ADDR': request.remote_addr}):
+            try:
+                return app.full_dispatch_request()
+            except Exception as e:
+                app.logger.exception('Batch sub-request %s %s failed', method, path)
+                response = app.response_class(status=500)
+                response.set_data(app.json.dumps({'error': str(e)}))
+                response.mimetype = 'application/json'
+                return response
+
+
+def _result(request_id, response):
+    result = {'id': request_id, 'status': response.status_code}
+    headers = {name: response.headers[name] for name in RESPONSE_HEADERS if name in response.headers}
+    if headers:
+        result['headers'] = headers
+    body = response.get_json(silent=True)
+    result['body'] = body if body is not None else response.get_data(as_text=True)
+    return result
+
+
+def run_batch(items, transactional=False):
+    """按顺序执行子请求，返回(各子请求的结果, 是否提交)
+
+    非事务模式下每个子请求各自提交，失败不影响其他子请求。事务模式下所有子请求在同一个数据库事务中执行，
+    任一子请求返回4xx/5xx时回滚全部修改，其后的子请求不再执行（状态为424）。
+    """
+    if not isinstance(items, list) or not items:
+        raise BatchError('requests must be a non-empty list')
+    if len(items) > current_app.config['BATCH_MAX_REQUESTS']:
+        raise BatchError(f'At most {current_app.config["BATCH_MAX_REQUESTS"]} requests per batch')
+    if transactional and shards_enabled():
+        # 智能体的日志和统计在各分片上，无法与主库的修改放在同一个事务中
+        raise BatchError('Transactional batches are not available when sharding is enabled')
+    normalized = [_normalize(item, transactional) for item in items]
+
+    if not transactional:
+        return [_result(request_id, _dispatch(method, path, body, headers, None))
+                for request_id, method, path, body, headers in normalized], True
+
+    results = []
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    session = BatchSession(db=db, bind=connection, join_transaction_mode='create_savepoint',
+                           info={'deferred_commit': True})
+    failed = False
+    try:
+        for request_id, method, path, body, headers in normalized:
+            if failed:
+                results.append({'id': request_id, 'status': 424, 'body': {'error': 'Skipped after a failed request'}})
+                continue
+            result = _result(request_id, _dispatch(method, path, body, headers, session))
+            results.append(result)
+            failed = result['status'] >= 400
+        session.close()
+        if failed:
+            transaction.rollback()
+        else:
+            transaction.commit()
+            apply_deferred_changes(session)
+    except BaseException:
+        session.close()
+        transaction.rollback()
+        raise
+    finally:
+        connection.close()
+    return results, not failed
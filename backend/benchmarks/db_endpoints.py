@@ -0,0 +1,200 @@
+"""数据库密集接口基准：在大数据量上测量日志按级别过滤、消息深分页、对话列表和角色列表的耗时
+
+默认在临时SQLite数据库上用seed生成 --scale 规模的数据后测量；也可以用 --database-uri 指向已经用
+`flask --app app seed-data` 生成过数据的SQLite或MySQL数据库，在同一份数据上比较表结构和查询的修改。
+请求通过进程内的测试客户端发出，不经过网络；每个用例输出总耗时、SQL耗时和语句数（JSON）。
+
+用法（在backend目录下执行）：
+    python -m benchmarks.db_endpoints --scale small --repeat 20 --output before.json
+    python -m benchmarks.db_endpoints --database-uri mysql+pymysql://root:@localhost/agent_bench
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from benchmarks.loadtest import git_revision, percentile
+from models import db, AgentLog, AgentStats, Conversation, Message, Role
+from shards import data_binds, use_shard
+
+CASES = ['logs_rare_level', 'logs_common_level_deep', 'agent_logs_level', 'messages_first_page',
+         'messages_last_page', 'conversations_first_page', 'conversations_last_page', 'roles']
+
+
+class SQLTimer:
+    """统计当前请求执行的SQL语句数和耗时（测试客户端在同一线程中处理请求）"""
+
+    def __init__(self, engines):
+        self.statements = 0
+        self.seconds = 0.0
+        self._started = None
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before)
+            event.listen(engine, 'after_cursor_execute', self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        self._started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+        self.seconds += time.perf_counter() - self._started
+
+    def reset(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+def build_app(database_uri, scale, seed):
+    """创建应用；没有指定数据库时在临时SQLite数据库上生成数据"""
+    from app import create_app
+    from commands import init_db
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_uri, 'QUERY_BUDGET_MODE': 'off'})
+    if scale:
+        import seed as seed_data
+
+        with app.app_context():
+            init_db()
+            seed_data.generate(dict(seed_data.SCALES[scale]), seed=seed)
+    return app
+
+
+def last_page(total, per_page):
+    return max(1, (total + per_page - 1) // per_page)
+
+
+def find_cases(deep_page):
+    """按现有数据选出每个用例的请求：对话最多的智能体、消息最多的对话等（启用分片时在主库和各分片中选）"""
+    heavy = conversation = None
+    info_logs = 0
+    for key in data_binds():
+        use_shard(key)
+        row = (db.session.query(AgentStats.agent_id, AgentStats.conversation_count)
+               .order_by(AgentStats.conversation_count.desc()).first())
+        if row is not None and (heavy is None or row.conversation_count > heavy.conversation_count):
+            heavy = row
+        row = (db.session.query(Conversation.conversation_id, Conversation.message_count)
+               .filter(Conversation.deleted_at.is_(None)).order_by(Conversation.message_count.desc()).first())
+        if row is not None and (conversation is None or row.message_count > conversation.message_count):
+            conversation = row
+        info_logs += db.session.query(db.func.sum(AgentStats.info_log_count)).scalar() or 0
+    use_shard(None)
+    if heavy is None or conversation is None:
+        raise SystemExit('The database has no agents or conversations, run `flask --app app seed-data` first')
+    return {
+        'logs_rare_level': ('/api/logs/', {'level': 'error', 'page': 1, 'per_page': 20}),
+        'logs_common_level_deep': ('/api/logs/', {'level': 'info', 'per_page': 20,
+                                                  'page': min(deep_page, last_page(info_logs, 20))}),
+        'agent_logs_level': (f'/api/logs/agents/{heavy.agent_id}/logs', {'level': 'warning', 'page': 1,
+                                                                        'per_page': 20}),
+        'messages_first_page': (f'/api/chat/conversations/{conversation.conversation_id}/messages',
+                                {'page': 1, 'per_page': 20}),
+        'messages_last_page': (f'/api/chat/conversations/{conversation.conversation_id}/messages',
+                               {'page': last_page(conversation.message_count, 20), 'per_page': 20}),
+        'conversations_first_page': (f'/api/chat/agents/{heavy.agent_id}/conversations',
+                                     {'page': 1, 'per_page': 10}),
+        'conversations_last_page': (f'/api/chat/agents/{heavy.agent_id}/conversations',
+                                    {'page': last_page(heavy.conversation_count, 10), 'per_page': 10}),
+        'roles': ('/api/roles/', {'page': 1, 'per_page': 10}),
+    }
+
+
+def run_case(client, timer, path, params, repeat):
+    """先请求一次（冷缓存），再重复repeat次，返回统计结果"""
+    latencies, sql_latencies, statuses = [], [], {}
+    first_ms = None
+    statements = None
+    for i in range(repeat + 1):
+        timer.reset()
+        started = time.perf_counter()
+        response = client.get(path, query_string=params)
+        elapsed = (time.perf_counter() - started) * 1000
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        if i == 0:
+            first_ms = elapsed
+            continue
+        latencies.append(elapsed)
+        sql_latencies.append(timer.seconds * 1000)
+        statements = timer.statements
+    latencies.sort()
+    sql_latencies.sort()
+    return {
+        'path': path,
+        'params': params,
+        'statuses': statuses,
+        'statements': statements,
+        'first_ms': round(first_ms, 2),
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies), 2) if latencies else None,
+            'p50': round(percentile(latencies, 0.50), 2) if latencies else None,
+            'p95': round(percentile(latencies, 0.95), 2) if latencies else None,
+            'max': round(latencies[-1], 2) if latencies else None,
+        },
+        'sql_ms_p50': round(percentile(sql_latencies, 0.50), 2) if sql_latencies else None,
+    }
+
+
+def row_counts():
+    """主要表的行数（分片表为主库和各分片之和），记录在结果中便于确认比较的是同一份数据"""
+    counts = {model.__tablename__: 0 for model in (Conversation, Message, AgentLog, Role)}
+    for key in data_binds():
+        use_shard(key)
+        for model in (Conversation, Message, AgentLog):
+            counts[model.__tablename__] += db.session.query(db.func.count(model.id)).scalar()
+    use_shard(None)
+    counts['role'] = db.session.query(db.func.count(Role.id)).scalar()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库密集接口基准')
+    parser.add_argument('--database-uri', help='已生成数据的数据库，不指定时在临时SQLite数据库上生成 --scale 规模的数据')
+    parser.add_argument('--scale', default='small', choices=['small', 'medium', 'production'],
+                        help='临时数据库的数据规模，默认small')
+    parser.add_argument('--seed', type=int, default=1, help='生成数据的随机数种子')
+    parser.add_argument('--cases', default=','.join(CASES), help=f'逗号分隔，可选 {",".join(CASES)}')
+    parser.add_argument('--repeat', type=int, default=20, help='每个用例的重复次数（不含第一次冷请求）')
+    parser.add_argument('--deep-page', type=int, default=500, help='日志深分页用例的页码，默认500')
+    parser.add_argument('--output', help='结果JSON的输出文件')
+    args = parser.parse_args()
+
+    cases = [name.strip() for name in args.cases.split(',') if name.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f'unknown cases: {", ".join(sorted(unknown))}')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.database_uri:
+            app = build_app(args.database_uri, None, None)
+        else:
+            app = build_app('sqlite:///' + os.path.join(tmp, 'bench.sqlite3'), args.scale, args.seed)
+        with app.app_context():
+            timer = SQLTimer(db.engines.values())
+            targets = find_cases(args.deep_page)
+            result = {
+                'revision': git_revision(),
+                'database': db.engine.dialect.name,
+                'scale': None if args.database_uri else args.scale,
+                'rows': row_counts(),
+                'repeat': args.repeat,
+            }
+            engines = list(db.engines.values())
+        # 在应用上下文之外发出请求，每个请求使用新的会话
+        client = app.test_client()
+        result['cases'] = {name: run_case(client, timer, *targets[name], args.repeat) for name in cases}
+        for engine in engines:
+            engine.dispose()
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""压测工具：对对话、对话历史、日志浏览和CRUD接口施加并发负载
+
+默认在临时SQLite数据库上启动一个进程内的应用和模型桩服务，无需真实模型；
+也可以用 --target 指向已经运行的服务（例如 flask --app app serve）。
+结果以JSON格式输出，便于在版本之间比较。
+
+用法（在backend目录下执行）：
+    python -m benchmarks.loadtest --scenarios chat,history,logs,crud --concurrency 16 --requests 500 --output result.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.stub_model import add_stub_arguments, settings_from_args, start_stub
+
+SCENARIOS = ['chat', 'history', 'logs', 'crud']
+
+
+class Context:
+    """压测过程中共享的目标地址和测试数据"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.agent_id = None
+        self.conversation_id = None
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        # 每个线程使用独立的连接会话
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def url(self, path):
+        return f'{self.base_url}/api{path}'
+
+
+def start_local_app(db_path):
+    """在后台线程中启动进程内应用，返回基础URL"""
+    import logging
+
+    from werkzeug.serving import make_server
+
+    from app import create_app
+    from commands import init_db
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path})
+    with app.app_context():
+        init_db()
+    # 压测时不输出访问日志
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def setup(ctx, model_endpoint):
+    """创建压测用的模型、智能体和一段对话"""
+    suffix = f'{os.getpid()}-{int(time.time() * 1000)}'
+    response = ctx.session.post(ctx.url('/models/'), json={
+        'name': f'loadtest-model-{suffix}',
+        'api_endpoint': model_endpoint,
+        'model_name': 'stub',
+    })
+    response.raise_for_status()
+    model_id = response.json()['model']['id']
+
+    response = ctx.session.post(ctx.url('/agents/'), json={'name': f'loadtest-agent-{suffix}', 'model_id': model_id})
+    response.raise_for_status()
+    ctx.agent_id = response.json()['agent']['id']
+
+    # 预热对话时忽略桩服务注入的错误，直到积累足够的轮数
+    conversation_id = None
+    turns = 0
+    for attempt in range(100):
+        body = {'message': f'warm-up turn {turns}'}
+        if conversation_id:
+            body['conversation_id'] = conversation_id
+        response = ctx.session.post(ctx.url(f'/chat/agents/{ctx.agent_id}/chat'), json=body)
+        if response.ok:
+            conversation_id = response.json()['conversation_id']
+            turns += 1
+            if turns == 10:
+                break
+    if not conversation_id:
+        response.raise_for_status()
+    ctx.conversation_id = conversation_id
+
+
+def scenario_chat(ctx, i):
+    """每次请求开启一段新对话"""
+    return [ctx.session.post(ctx.url(f'/chat/agents/{ctx.agent_id}/chat'), json={'message': f'prompt {i}'})]
+
+
+def scenario_history(ctx, i):
+    """翻阅对话消息和智能体的对话列表"""
+    if i % 2:
+        return [ctx.session.get(ctx.url(f'/chat/conversations/{ctx.conversation_id}/messages'),
+                                params={'page': 1, 'per_page': 20})]
+    return [ctx.session.get(ctx.url(f'/chat/agents/{ctx.agent_id}/conversations'),
+                            params={'page': i % 5 + 1, 'per_page': 10})]
+
+
+def scenario_logs(ctx, i):
+    """浏览全部日志和单个智能体的日志，交替按级别过滤"""
+    params = {'page': i % 5 + 1, 'per_page': 20}
+    if i % 3 == 0:
+        params['level'] = 'info'
+    if i % 2:
+        return [ctx.session.get(ctx.url('/logs/'), params=params)]
+    return [ctx.session.get(ctx.url(f'/logs/agents/{ctx.agent_id}/logs'), params=params)]
+
+
+def scenario_crud(ctx, i):
+    """创建、读取、更新、删除一个角色"""
+    responses = []
+    name = f'loadtest-role-{os.getpid()}-{threading.get_ident()}-{i}'
+    response = ctx.session.post(ctx.url('/roles/'), json={'name': name})
+    responses.append(response)
+    if response.status_code >= 400:
+        return responses
+    role_id = response.json()['role']['id']
+    responses.append(ctx.session.get(ctx.url(f'/roles/{role_id}')))
+    responses.append(ctx.session.put(ctx.url(f'/roles/{role_id}'), json={'description': 'updated'}))
+    responses.append(ctx.session.delete(ctx.url(f'/roles/{role_id}')))
+    return responses
+
+
+def percentile(sorted_values, fraction):
+    """最近秩法计算百分位数"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(ctx, name, concurrency, total):
+    """以固定并发执行total次场景迭代，返回统计结果"""
+    scenario = globals()[f'scenario_{name}']
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    def iteration(i):
+        try:
+            responses = scenario(ctx, i)
+        except requests.RequestException as e:
+            with lock:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return
+        with lock:
+            for response in responses:
+                # elapsed为从发出请求到收到响应头的时间
+                latencies.append(response.elapsed.total_seconds() * 1000)
+                if response.status_code >= 400:
+                    errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(iteration, range(total)))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'iterations': total,
+        'requests': len(latencies),
+        'errors': sum(errors.values()),
+        'errors_by_type': errors,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 2) if duration else None,
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies), 2) if latencies else None,
+            'p50': round(percentile(latencies, 0.50), 2) if latencies else None,
+            'p95': round(percentile(latencies, 0.95), 2) if latencies else None,
+            'p99': round(percentile(latencies, 0.99), 2) if latencies else None,
+            'max': round(latencies[-1], 2) if latencies else None,
+        },
+    }
+
+
+def git_revision():
+    """当前代码版本，便于对比不同版本的结果"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='接口压测')
+    parser.add_argument('--target', help='已运行服务的基础URL，例如 http://127.0.0.1:5003；不指定时启动进程内应用')
+    parser.add_argument('--model-endpoint', help='模型API端点，不指定时启动本地模型桩服务')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'逗号分隔，可选 {",".join(SCENARIOS)}')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发数')
+    parser.add_argument('--requests', type=int, default=200, help='每个场景的迭代次数')
+    parser.add_argument('--output', help='结果JSON的输出文件')
+    add_stub_arguments(parser, prefix='stub-')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    model_endpoint = args.model_endpoint
+    if not model_endpoint:
+        _, stub_url = start_stub(settings=settings_from_args(args, prefix='stub-'))
+        model_endpoint = f'{stub_url}/v1/chat/completions'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_url = args.target or start_local_app(os.path.join(tmp, 'loadtest.sqlite3'))
+        ctx = Context(base_url)
+        setup(ctx, model_endpoint)
+
+        result = {
+            'revision': git_revision(),
+            'target': args.target or 'in-process',
+            'concurrency': args.concurrency,
+            'requests_per_scenario': args.requests,
+            'stub': None if args.model_endpoint else vars(settings_from_args(args, prefix='stub-')),
+            'scenarios': {name: run_scenario(ctx, name, args.concurrency, args.requests) for name in scenarios},
+        }
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""智能体运行时基准：向若干运行中的智能体投递任务，测量运行时处理队列的吞吐量
+
+在临时SQLite数据库上创建智能体，模型指向本地模型桩服务，无需真实模型。
+运行过程中会把一个智能体暂停再恢复，验证运行时跟随状态变化。
+
+用法（在backend目录下执行）：
+    python -m benchmarks.runtime --agents 4 --tasks 400 --workers 16 --stub-latency-ms 100
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.stub_model import add_stub_arguments, settings_from_args, start_stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description='智能体运行时基准')
+    parser.add_argument('--agents', type=int, default=4, help='运行中的智能体数')
+    parser.add_argument('--tasks', type=int, default=200, help='投递的任务总数')
+    parser.add_argument('--workers', type=int, default=8, help='运行时工作线程数')
+    parser.add_argument('--timeout', type=float, default=300, help='等待队列清空的最长秒数')
+    add_stub_arguments(parser, prefix='stub-')
+    args = parser.parse_args()
+
+    from app import create_app
+    from commands import init_db
+    from models import db, Agent, AgentTask, Model
+    from runtime import AgentRuntime, enqueue_task
+
+    _, stub_url = start_stub(settings=settings_from_args(args, prefix='stub-'))
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'runtime.sqlite3'),
+            'RUNTIME_POLL_SECONDS': 0.2,
+            'RUNTIME_HEARTBEAT_SECONDS': 1,
+            'RUNTIME_RETRY_BACKOFF_SECONDS': 0.5,
+        })
+        with app.app_context():
+            init_db()
+            model = Model(name='stub', api_endpoint=f'{stub_url}/v1/chat/completions', model_name='stub')
+            db.session.add(model)
+            db.session.flush()
+            agents = [Agent(name=f'runtime-agent-{i}', model_id=model.id, status='running')
+                      for i in range(args.agents)]
+            db.session.add_all(agents)
+            db.session.commit()
+            agent_ids = [agent.id for agent in agents]
+            for i in range(args.tasks):
+                enqueue_task(agent_ids[i % len(agent_ids)], f'task {i}', priority=i % 3)
+
+        runtime = AgentRuntime(app, workers=args.workers)
+        started = time.perf_counter()
+        runtime.start()
+
+        # 暂停第一个智能体一段时间，再恢复
+        with app.app_context():
+            db.session.get(Agent, agent_ids[0]).status = 'paused'
+            db.session.commit()
+        time.sleep(1)
+        with app.app_context():
+            paused_done = AgentTask.query.filter_by(agent_id=agent_ids[0], status='done').count()
+            db.session.get(Agent, agent_ids[0]).status = 'running'
+            db.session.commit()
+
+        deadline = time.time() + args.timeout
+        while time.time() < deadline:
+            with app.app_context():
+                remaining = AgentTask.query.filter(AgentTask.status.in_(['pending', 'leased'])).count()
+            if not remaining:
+                break
+            time.sleep(0.2)
+        duration = time.perf_counter() - started
+        runtime.stop(timeout=10)
+
+        with app.app_context():
+            counts = dict(db.session.query(AgentTask.status, db.func.count(AgentTask.id))
+                          .group_by(AgentTask.status).all())
+        result = {
+            'agents': args.agents,
+            'tasks': args.tasks,
+            'workers': args.workers,
+            'stub': vars(settings_from_args(args, prefix='stub-')),
+            'duration_s': round(duration, 3),
+            'throughput_tasks_per_s': round(counts.get('done', 0) / duration, 2),
+            'tasks_by_status': counts,
+            'paused_agent_done_during_pause': paused_done,
+            'per_agent': {loop.agent_id: {'completed': loop.tasks_completed, 'failed': loop.tasks_failed}
+                          for loop in runtime.loops.values()},
+        }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
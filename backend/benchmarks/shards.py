@@ -0,0 +1,120 @@
+"""分片写入基准：对比不分片、1个分片和N个分片时对话写入的吞吐量
+
+每个线程代表一个智能体的客户端，在智能体所在的分片上连续写入对话轮次（读取历史、用户消息、助手消息和日志），
+写入经过ORM和会话事件（统计计数在同一事务中维护），与对话接口的数据写路径相同，不调用模型。
+数据库为临时SQLite文件，主库和每个分片各一个文件；SQLite同一文件同时只有一个写事务，
+分片后不同分片上的写入可以并行。
+
+用法（在backend目录下执行）：
+    python -m benchmarks.shards --shards 0,1,4 --threads 8 --turns 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from sqlalchemy.exc import OperationalError
+
+from models import db, Agent, AgentLog, Conversation, Message, Model
+from shards import shard_binds, shard_label, use_shard
+
+
+def build_app(tmp, shards):
+    """创建应用并在主库和shards个分片上建表"""
+    from app import create_app
+    from commands import init_db
+
+    binds = shard_binds(['sqlite:///' + os.path.join(tmp, f'shard_{index}.sqlite3') for index in range(shards)])
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'primary.sqlite3'),
+                      'SQLALCHEMY_BINDS': binds, 'DB_SHARD_KEYS': list(binds), 'QUERY_BUDGET_MODE': 'off'})
+    with app.app_context():
+        init_db()
+    return app
+
+
+def create_agents(app, count):
+    """创建count个智能体，返回[(agent_id, 所在分片)]"""
+    with app.app_context():
+        model = Model(name='bench', api_endpoint='http://localhost', model_name='bench')
+        db.session.add(model)
+        db.session.commit()
+        agents = [Agent(name=f'bench-{index}', model_id=model.id) for index in range(count)]
+        db.session.add_all(agents)
+        db.session.commit()
+        return [(agent.id, agent.shard) for agent in agents]
+
+
+def chat_turns(app, agent_id, shard, turns, stats, lock):
+    """模拟一个客户端连续对话，写入都在智能体所在的分片上"""
+    with app.app_context():
+        use_shard(shard)
+        conversation = Conversation(agent_id=agent_id, conversation_id=str(uuid.uuid4()))
+        db.session.add(conversation)
+        db.session.commit()
+        for turn in range(turns):
+            try:
+                history = Message.query.filter_by(conversation_id=conversation.id).all()
+                db.session.add(Message(conversation_id=conversation.id, role='user', content=f'question {turn}'))
+                db.session.commit()
+                db.session.add(Message(conversation_id=conversation.id, role='assistant',
+                                       content=f'answer {turn} after {len(history)} messages'))
+                db.session.add(AgentLog(agent_id=agent_id, level='info', message=f'turn {turn}'))
+                db.session.commit()
+                with lock:
+                    stats['turns'] += 1
+            except OperationalError as e:
+                db.session.rollback()
+                with lock:
+                    stats['errors'] += 1
+                    stats['last_error'] = str(e.orig)
+
+
+def run(shards, threads, turns):
+    """在临时数据库上运行一轮基准，返回统计结果"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = build_app(tmp, shards)
+        agents = create_agents(app, threads)
+        stats = {'turns': 0, 'errors': 0, 'last_error': None}
+        lock = threading.Lock()
+        workers = [
+            threading.Thread(target=chat_turns, args=(app, agent_id, shard, turns, stats, lock))
+            for agent_id, shard in agents
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+    return {
+        'shards': shards,
+        'threads': threads,
+        'agents_per_shard': dict(Counter(shard_label(shard) for _, shard in agents)),
+        'turns': stats['turns'],
+        'errors': stats['errors'],
+        'last_error': stats['last_error'],
+        'seconds': round(elapsed, 3),
+        'turns_per_second': round(stats['turns'] / elapsed, 1) if elapsed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分片写入基准')
+    parser.add_argument('--shards', default='0,1,4', help='逗号分隔的分片数，0为不分片，默认0,1,4')
+    parser.add_argument('--threads', type=int, default=8, help='并发线程数（每个线程一个智能体）')
+    parser.add_argument('--turns', type=int, default=50, help='每个线程的对话轮数')
+    args = parser.parse_args()
+
+    results = [run(int(count), args.threads, args.turns) for count in args.shards.split(',') if count.strip()]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
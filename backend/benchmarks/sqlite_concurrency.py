@@ -0,0 +1,105 @@
+"""SQLite并发写入基准：对比默认配置与生产配置的吞吐量和锁错误
+
+用法（在backend目录下执行）：
+    python -m benchmarks.sqlite_concurrency --threads 8 --turns 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from models import db, Agent, AgentLog, Model, Conversation, Message
+from sqlite_profile import load_sqlite_profile, configure_sqlite_engines
+
+
+def build_app(db_path, profile):
+    """创建一个只包含数据库的最小应用"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    load_sqlite_profile(app, {'SQLITE_PROFILE': profile})
+    db.init_app(app)
+    with app.app_context():
+        configure_sqlite_engines(app, db)
+        db.create_all()
+        model = Model(name='bench', api_endpoint='http://localhost', model_name='bench')
+        db.session.add(model)
+        db.session.commit()
+        agent = Agent(name='bench', model_id=model.id)
+        db.session.add(agent)
+        db.session.commit()
+        agent_id = agent.id
+    return app, agent_id
+
+
+def chat_turns(app, agent_id, turns, stats, lock):
+    """模拟一个客户端连续对话：读取历史、写入用户消息、写入助手消息和日志"""
+    with app.app_context():
+        conversation = Conversation(agent_id=agent_id, conversation_id=f'bench-{threading.get_ident()}')
+        db.session.add(conversation)
+        db.session.commit()
+        for turn in range(turns):
+            try:
+                history = Message.query.filter_by(conversation_id=conversation.id).all()
+                db.session.add(Message(conversation_id=conversation.id, role='user', content=f'question {turn}'))
+                db.session.commit()
+                db.session.add(Message(conversation_id=conversation.id, role='assistant',
+                                       content=f'answer {turn} after {len(history)} messages'))
+                db.session.add(AgentLog(agent_id=agent_id, level='info', message=f'turn {turn}'))
+                db.session.commit()
+                with lock:
+                    stats['turns'] += 1
+            except OperationalError as e:
+                db.session.rollback()
+                with lock:
+                    stats['errors'] += 1
+                    stats['last_error'] = str(e.orig)
+
+
+def run(profile, threads, turns):
+    """在临时数据库上运行一轮基准，返回统计结果"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app, agent_id = build_app(os.path.join(tmp, 'bench.sqlite3'), profile)
+        stats = {'turns': 0, 'errors': 0, 'last_error': None}
+        lock = threading.Lock()
+        workers = [
+            threading.Thread(target=chat_turns, args=(app, agent_id, turns, stats, lock))
+            for _ in range(threads)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+    return {
+        'profile': profile,
+        'threads': threads,
+        'turns': stats['turns'],
+        'errors': stats['errors'],
+        'last_error': stats['last_error'],
+        'seconds': round(elapsed, 3),
+        'turns_per_second': round(stats['turns'] / elapsed, 1) if elapsed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite并发写入基准')
+    parser.add_argument('--threads', type=int, default=8, help='并发线程数')
+    parser.add_argument('--turns', type=int, default=50, help='每个线程的对话轮数')
+    args = parser.parse_args()
+
+    results = [run(profile, args.threads, args.turns) for profile in ('default', 'production')]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""启动耗时基准：在全新的子进程中测量导入、创建应用、建表检查和首个请求的耗时
+
+用法（在backend目录下执行）：
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# 在子进程中执行的测量脚本，各阶段耗时以毫秒为单位输出为JSON
+PROBE = r'''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+client = application.test_client()
+client.get('/')
+first_request = time.perf_counter()
+schema_check = None
+if {init_db}:
+    with application.app_context():
+        app.init_db()
+    schema_check = (time.perf_counter() - first_request) * 1000
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (first_request - created) * 1000,
+    'schema_check_ms': schema_check,
+}}))
+'''
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def probe(init_db):
+    """启动一个新的Python进程并返回各阶段耗时"""
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(init_db=init_db)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples, key):
+    """计算某个阶段的中位数和最大值"""
+    values = [sample[key] for sample in samples if sample[key] is not None]
+    if not values:
+        return None
+    return {'median_ms': round(statistics.median(values), 1), 'max_ms': round(max(values), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动耗时基准')
+    parser.add_argument('--runs', type=int, default=10, help='每种模式启动的进程数')
+    parser.add_argument('--with-schema-check', action='store_true',
+                        help='同时测量init-db建表检查的耗时（会连接数据库）')
+    args = parser.parse_args()
+
+    samples = [probe(args.with_schema_check) for _ in range(args.runs)]
+    keys = ['import_ms', 'create_app_ms', 'first_request_ms', 'schema_check_ms']
+    result = {'runs': args.runs, 'python': sys.version.split()[0]}
+    result.update({key: summarize(samples, key) for key in keys})
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""本地OpenAI兼容的模型桩服务，用于压测和调试，无需真实模型
+
+支持 POST /v1/chat/completions（含stream流式输出）和 GET /v1/models。
+延迟、吐字速度、错误注入均可配置。
+还模拟了Ollama的模型加载：--load-ms大于0时，未加载的模型在首次请求时额外等待该时间，
+POST /api/generate（不带prompt）按keep_alive预加载或卸载模型，GET /api/ps列出已加载的模型。
+
+用法（在backend目录下执行）：
+    python -m benchmarks.stub_model --port 5999 --latency-ms 200 --tokens-per-second 50 --error-rate 0.01
+模型的API端点填写 http://127.0.0.1:5999/v1/chat/completions 即可。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubSettings:
+    """桩服务的行为配置"""
+
+    def __init__(self, latency_ms=50, jitter_ms=0, tokens_per_second=0, response_tokens=32,
+                 error_rate=0.0, error_status=500, load_ms=0):
+        self.latency_ms = latency_ms                # 首个token之前的固定延迟
+        self.jitter_ms = jitter_ms                  # 在固定延迟上叠加的随机延迟
+        self.tokens_per_second = tokens_per_second  # 吐字速度，0表示立即返回全部内容
+        self.response_tokens = response_tokens      # 每次回复的token数
+        self.error_rate = error_rate                # 返回错误的请求比例
+        self.error_status = error_status
+        self.load_ms = load_ms                      # 模拟冷启动：加载未驻留内存的模型的耗时
+
+
+# Ollama默认的keep_alive
+DEFAULT_KEEP_ALIVE = 300
+
+
+def _parse_keep_alive(value):
+    """解析Ollama的keep_alive（秒数或"5m"、"1h"这样的时长），返回秒数"""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        return value
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if value[-1:] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def _count_tokens(messages):
+    """粗略估算提示词的token数（按空白分词）"""
+    return sum(len(str(message.get('content', '')).split()) for message in messages)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    settings = StubSettings()
+    protocol_version = 'HTTP/1.1'
+    # 保持连接时响应头和响应体分开发送，不关闭Nagle算法会在每个请求上多等约40毫秒的延迟确认
+    disable_nagle_algorithm = True
+    loaded = {}  # 模型名 -> 驻留截止时间
+    loads = 0    # 加载次数
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        # 压测时不输出访问日志
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _ensure_loaded(self, model, keep_alive=None):
+        """模拟加载模型：未驻留时等待load_ms，然后按keep_alive刷新驻留时间"""
+        keep_seconds = _parse_keep_alive(keep_alive)
+        with self.lock:
+            resident = self.loaded.get(model, 0) > time.time()
+        if not resident and self.settings.load_ms and keep_seconds != 0:
+            time.sleep(self.settings.load_ms / 1000)
+            with self.lock:
+                type(self).loads += 1
+        with self.lock:
+            if keep_seconds == 0:
+                self.loaded.pop(model, None)
+            else:
+                self.loaded[model] = time.time() + keep_seconds if keep_seconds > 0 else float('inf')
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'stub', 'object': 'model'}]})
+        elif self.path.rstrip('/') == '/api/ps':
+            now = time.time()
+            with self.lock:
+                models = [{'name': name, 'expires_in': round(until - now, 1)}
+                          for name, until in self.loaded.items() if until > now]
+            self._send_json(200, {'models': models, 'loads': self.loads})
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.path.rstrip('/') == '/api/generate' and not payload.get('prompt'):
+            # Ollama：不带prompt的generate请求只加载（keep_alive为0时卸载）模型
+            self._ensure_loaded(payload.get('model', 'stub'), payload.get('keep_alive'))
+            self._send_json(200, {'model': payload.get('model', 'stub'), 'response': '', 'done': True})
+            return
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        settings = self.settings
+        self._ensure_loaded(payload.get('model', 'stub'))
+        time.sleep((settings.latency_ms + random.uniform(0, settings.jitter_ms)) / 1000)
+        if settings.error_rate and random.random() < settings.error_rate:
+            self._send_json(settings.error_status, {'error': {'message': 'Injected stub error'}})
+            return
+
+        tokens = [f'token{i}' for i in range(settings.response_tokens)]
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        model = payload.get('model', 'stub')
+        usage = {
+            'prompt_tokens': _count_tokens(payload.get('messages', [])),
+            'completion_tokens': len(tokens),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        delay = 1 / settings.tokens_per_second if settings.tokens_per_second else 0
+
+        if payload.get('stream'):
+            self._stream(completion_id, model, tokens, delay)
+            return
+
+        time.sleep(delay * len(tokens))
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ' '.join(tokens)},
+                'finish_reason': 'stop',
+            }],
+            'usage': usage,
+        })
+
+    def _stream(self, completion_id, model, tokens, delay):
+        """按server-sent events格式逐token输出"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for index, token in enumerate(tokens):
+            time.sleep(delay)
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': token if index == 0 else ' ' + token},
+                    'finish_reason': None,
+                }],
+            }
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+
+def start_stub(host='127.0.0.1', port=0, settings=None):
+    """在后台线程中启动桩服务，返回(server, base_url)，port为0时自动分配端口"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'settings': settings or StubSettings(), 'loaded': {}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def add_stub_arguments(parser, prefix=''):
+    """添加桩服务的命令行参数，loadtest等脚本复用"""
+    parser.add_argument(f'--{prefix}latency-ms', type=float, default=50, help='首个token之前的延迟（毫秒）')
+    parser.add_argument(f'--{prefix}jitter-ms', type=float, default=0, help='叠加的随机延迟（毫秒）')
+    parser.add_argument(f'--{prefix}tokens-per-second', type=float, default=0, help='吐字速度，0表示立即返回')
+    parser.add_argument(f'--{prefix}response-tokens', type=int, default=32, help='每次回复的token数')
+    parser.add_argument(f'--{prefix}error-rate', type=float, default=0.0, help='返回错误的请求比例（0~1）')
+    parser.add_argument(f'--{prefix}load-ms', type=float, default=0, help='模拟加载未驻留模型的耗时（毫秒）')
+
+
+def settings_from_args(args, prefix=''):
+    """根据命令行参数创建StubSettings"""
+    prefix = prefix.replace('-', '_')
+    return StubSettings(
+        latency_ms=getattr(args, f'{prefix}latency_ms'),
+        jitter_ms=getattr(args, f'{prefix}jitter_ms'),
+        tokens_per_second=getattr(args, f'{prefix}tokens_per_second'),
+        response_tokens=getattr(args, f'{prefix}response_tokens'),
+        error_rate=getattr(args, f'{prefix}error_rate'),
+        load_ms=getattr(args, f'{prefix}load_ms'),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI兼容的模型桩服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5999)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'settings': settings_from_args(args), 'loaded': {}})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f'Stub model listening on http://{args.host}:{args.port}/v1/chat/completions')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
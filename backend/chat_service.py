@@ -0,0 +1,158 @@
+import threading
+import uuid
+
+from archive import rehydrate_conversation
+from forks import history_query
+from metrics import upstream_timer
+from models import db, AgentLog, Conversation, Message
+from ratelimit import check_tokens, record_tokens
+from shards import use_agent_shard
+from turns import conversation_turn
+
+_local = threading.local()
+
+
+class ChatError(Exception):
+    """对话无法进行（不可重试的错误），status_code为对应的HTTP状态码"""
+    status_code = 400
+
+
+class ConversationNotFound(ChatError):
+    status_code = 404
+
+    def __init__(self):
+        super().__init__('Conversation not found')
+
+
+class ModelInactive(ChatError):
+    def __init__(self):
+        super().__init__('Model is inactive')
+
+
+def open_conversation(agent, conversation_id=None, create=False):
+    """获取智能体的对话，返回(conversation_id, conversation)
+
+    没有conversation_id时创建新对话；create为True时，指定的对话不存在则以该ID创建
+    （异步任务提交时预先分配对话ID，重试时找到的是同一个对话）。
+    本轮的对话、消息和日志都在智能体数据所在的分片上读写，数据迁移中的智能体抛出ShardMoving。
+    """
+    use_agent_shard(agent, write=True)
+    if not conversation_id:
+        conversation_id = str(uuid.uuid4())
+        create = True
+    else:
+        conversation = Conversation.query.filter_by(agent_id=agent.id, conversation_id=conversation_id,
+                                                    deleted_at=None).first()
+        if not conversation:
+            # 已归档的对话自动恢复
+            conversation = rehydrate_conversation(conversation_id, agent_id=agent.id)
+        if conversation:
+            return conversation_id, conversation
+        if not create:
+            raise ConversationNotFound()
+
+    conversation = Conversation(agent_id=agent.id, conversation_id=conversation_id)
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation_id, conversation
+
+
+def conversation_history(conversation_pk, parent_id=None):
+    """按时间顺序构造发送给模型的消息列表（分叉出的对话含父对话在分叉点之前的消息）"""
+    return [
+        {'role': msg.role, 'content': msg.content}
+        for msg in history_query(conversation_pk, parent_id)
+    ]
+
+
+def model_request(model, messages):
+    """构造OpenAI兼容的请求，返回(api_endpoint, 请求体, 请求头)"""
+    openai_request = {'model': model.model_name, 'messages': messages}
+
+    # 添加API密钥（如果有）
+    headers = {'Content-Type': 'application/json'}
+    if model.api_key:
+        headers['Authorization'] = f'Bearer {model.api_key}'
+    return model.api_endpoint, openai_request, headers
+
+
+def _http_session():
+    """当前线程的HTTP会话，复用与模型API的连接，省去每次调用建立会话和连接的开销"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        # requests导入较慢，只在真正调用模型时加载
+        import requests
+
+        session = _local.session = requests.Session()
+    return session
+
+
+def call_model(api_endpoint, openai_request, headers):
+    """调用模型API，返回(助手回复的内容, 消耗的token数)"""
+    with upstream_timer():
+        response = _http_session().post(api_endpoint, json=openai_request, headers=headers)
+    response.raise_for_status()
+    response_data = response.json()
+    content = response_data['choices'][0]['message']['content']
+    tokens = (response_data.get('usage') or {}).get('total_tokens')
+    if tokens is None:
+        # 模型没有返回用量时按约4个字符一个token估算
+        characters = sum(len(str(message['content'])) for message in openai_request['messages']) + len(content)
+        tokens = characters // 4 + 1
+    return content, tokens
+
+
+def complete_turn(agent, conversation_id, conversation_pk, before_commit=None, usage=None, parent_id=None):
+    """调用模型回复对话中的最新消息，保存回复并记录日志，返回回复内容
+
+    before_commit在回复与日志写入的同一事务中调用，可以附带其他更新（例如标记异步任务完成）。
+    usage不为None时写入本轮消耗的token数（usage['tokens']）。
+    parent_id为对话的Conversation.parent_id，分叉出的对话的历史包含父对话的消息。
+    模型API出错时抛出requests.exceptions.RequestException。
+    """
+    agent_id = agent.id
+    model = agent.model
+    if model.status != 'active':
+        raise ModelInactive()
+    model_id = model.id
+    request_args = model_request(model, conversation_history(conversation_pk, parent_id))
+    # 等待模型期间不持有数据库事务（SQLite写事务会阻塞其他写入）
+    db.session.commit()
+
+    reply, tokens = call_model(*request_args)
+    record_tokens(agent_id, model_id, tokens)
+    if usage is not None:
+        usage['tokens'] = tokens
+
+    # 保存助手消息和对话日志
+    db.session.add(Message(conversation_id=conversation_pk, role='assistant', content=reply))
+    db.session.add(AgentLog(
+        agent_id=agent_id,
+        level='info',
+        message=f'Conversation {conversation_id}: User message received and responded'
+    ))
+    if before_commit is not None:
+        before_commit(reply)
+    db.session.commit()
+    return reply
+
+
+def chat_turn(agent, content, conversation_id=None, usage=None):
+    """完成一轮对话：保存用户消息、调用模型、保存回复并记录日志，返回(conversation_id, 回复内容)
+
+    模型API出错时抛出requests.exceptions.RequestException，超出token配额时抛出RateLimited，
+    同一对话排队的轮次过多或等待超时时抛出ConversationBusy。
+    """
+    # 在保存用户消息之前检查，超出配额时对话中不会留下没有回复的消息
+    check_tokens(agent.id, agent.model_id)
+    # 同一对话的轮次逐个执行，并发的请求不会交错读写历史；新对话不需要排队
+    with conversation_turn(conversation_id):
+        conversation_id, conversation = open_conversation(agent, conversation_id)
+        conversation_pk, parent_id = conversation.id, conversation.parent_id
+
+        # 保存用户消息
+        db.session.add(Message(conversation_id=conversation_pk, role='user', content=content))
+        db.session.commit()
+
+        return conversation_id, complete_turn(agent, conversation_id, conversation_pk, usage=usage,
+                                                parent_id=parent_id)
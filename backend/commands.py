@@ -0,0 +1,207 @@
+import os
+
+import click
+from flask import current_app
+
+from models import db
+
+
+def init_db():
+    """在主库和各分片上创建缺失的数据表，需要在应用上下文中调用"""
+    from shards import create_shard_tables
+
+    # 只在主库上建表，副本的结构由复制同步
+    db.create_all(bind_key=None)
+    create_shard_tables()
+
+
+@click.command('init-db')
+def init_db_command():
+    """创建数据库表"""
+    init_db()
+    click.echo('Database tables created')
+
+
+@click.command('serve')
+@click.option('--bind', default=None, help='监听地址，默认0.0.0.0:5003')
+@click.option('--workers', type=int, default=None, help='工作进程数，默认CPU核数*2+1')
+@click.option('--threads', type=int, default=None, help='每个工作进程的线程数，默认4')
+@click.option('--max-requests', type=int, default=None, help='工作进程处理多少请求后回收，默认1000')
+@click.option('--graceful-timeout', type=int, default=None, help='优雅退出时等待进行中请求的秒数，默认120')
+def serve_command(bind, workers, threads, max_requests, graceful_timeout):
+    """以预fork多进程模式运行生产服务"""
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        raise click.ClickException('serve requires gunicorn (Linux/macOS only): pip install gunicorn')
+    import serve
+
+    options = serve.load_serve_options(os.environ, {
+        'SERVE_BIND': bind,
+        'SERVE_WORKERS': workers,
+        'SERVE_THREADS': threads,
+        'SERVE_MAX_REQUESTS': max_requests,
+        'SERVE_GRACEFUL_TIMEOUT': graceful_timeout,
+    })
+    serve.run(current_app._get_current_object(), options)
+
+
+@click.command('archive-conversations')
+@click.option('--days', type=float, default=lambda: float(os.getenv('ARCHIVE_IDLE_DAYS', '7')),
+              help='超过多少天没有活动的对话会被归档，默认7天（ARCHIVE_IDLE_DAYS）')
+@click.option('--batch-size', type=int, default=100, help='每批归档并提交的对话数')
+def archive_conversations_command(days, batch_size):
+    """将长期不活动的对话归档到冷存储"""
+    from archive import archive_idle_conversations
+
+    archived = archive_idle_conversations(days, batch_size)
+    click.echo(f'Archived {archived} conversations')
+
+
+@click.command('agent-runtime')
+@click.option('--workers', type=int, default=None, help='每个进程的工作线程数（RUNTIME_WORKERS）')
+@click.option('--processes', type=int, default=1, help='运行时进程数，大于1时fork多个进程（仅Linux/macOS）')
+@click.option('--shutdown-timeout', type=float, default=None, help='退出时等待进行中任务的最长秒数，默认一直等待')
+def agent_runtime_command(workers, processes, shutdown_timeout):
+    """运行智能体运行时，执行状态为running的智能体的任务队列"""
+    import runtime
+
+    runtime.run(current_app._get_current_object(), workers=workers, processes=processes,
+                shutdown_timeout=shutdown_timeout)
+
+
+@click.command('chat-jobs')
+@click.option('--workers', type=int, default=None, help='执行线程数（CHAT_JOBS_WORKERS）')
+@click.option('--shutdown-timeout', type=float, default=None, help='退出时等待进行中任务的最长秒数，默认一直等待')
+def chat_jobs_command(workers, shutdown_timeout):
+    """运行独立的异步对话任务执行器（CHAT_JOBS_EXECUTOR=external时使用）"""
+    import jobs
+
+    jobs.run(current_app._get_current_object(), workers=workers, shutdown_timeout=shutdown_timeout)
+
+
+@click.command('deletion-jobs')
+@click.option('--shutdown-timeout', type=float, default=None, help='退出时等待当前批次的最长秒数，默认一直等待')
+def deletion_jobs_command(shutdown_timeout):
+    """运行独立的后台删除执行器（DELETION_EXECUTOR=external时使用）"""
+    import deletion
+
+    deletion.run(current_app._get_current_object(), shutdown_timeout=shutdown_timeout)
+
+
+@click.command('run-dataset')
+@click.argument('dataset', type=click.Path(exists=True, dir_okay=False))
+@click.option('--agent', required=True, help='智能体ID或名称')
+@click.option('--output', required=True, type=click.Path(dir_okay=False),
+              help='NDJSON结果文件，同时作为断点：再次运行时跳过其中已完成的条目')
+@click.option('--concurrency', type=int, default=8, help='同时进行的对话数，默认8')
+@click.option('--prompt-field', default='prompt', help='数据集中提示词的字段名，默认prompt')
+@click.option('--id-field', default='id', help='数据集中条目标识的字段名，默认id，没有时使用行号')
+@click.option('--max-attempts', type=int, default=3, help='模型调用失败时每个条目最多执行的次数，默认3')
+@click.option('--retry-backoff', type=float, default=5.0, help='重试前等待的秒数，随执行次数线性增长，默认5')
+@click.option('--retry-errors', is_flag=True, help='重新执行输出中出错的条目')
+@click.option('--restart', is_flag=True, help='删除已有的输出，从头开始')
+@click.option('--progress-seconds', type=float, default=5.0, help='输出进度的间隔秒数，0表示只在结束时输出')
+def run_dataset_command(dataset, agent, output, concurrency, prompt_field, id_field, max_attempts, retry_backoff,
+                        retry_errors, restart, progress_seconds):
+    """用智能体并发执行JSONL数据集中的提示词，结果写入NDJSON，中断后可继续"""
+    import dataset as dataset_runner
+
+    try:
+        progress, interrupted = dataset_runner.run(
+            current_app._get_current_object(), dataset, agent, output, concurrency=concurrency,
+            prompt_field=prompt_field, id_field=id_field, max_attempts=max_attempts, retry_backoff=retry_backoff,
+            restart=restart, retry_errors=retry_errors, progress_seconds=progress_seconds)
+    except dataset_runner.DatasetError as e:
+        raise click.ClickException(str(e))
+    if interrupted:
+        click.echo('Interrupted, run the same command again to resume', err=True)
+        raise SystemExit(130)
+    if progress.failed:
+        raise SystemExit(1)
+
+
+@click.command('repair-stats')
+@click.option('--batch-size', type=int, default=500, help='每个事务处理的对话或智能体数，默认500')
+@click.option('--dry-run', is_flag=True, help='只检查并报告计数有误的对话和智能体，不写入')
+def repair_stats_command(batch_size, dry_run):
+    """按现有数据重建对话和智能体的统计计数（升级后或批量导入数据后执行）"""
+    import stats
+
+    conversations, agents = stats.repair(batch_size=batch_size, dry_run=dry_run)
+    verb = 'Found' if dry_run else 'Repaired'
+    click.echo(f'{verb} {conversations} conversations and {agents} agents with stale statistics')
+
+
+@click.command('rebalance-shards')
+@click.option('--dry-run', is_flag=True, help='只列出需要迁移的智能体，不迁移')
+@click.option('--batch-size', type=int, default=500, help='每个事务复制的对话、消息或日志数，默认500')
+@click.option('--round-size', type=int, default=50, help='每轮一起迁移的智能体数，默认50')
+@click.option('--drain-seconds', type=float, default=60,
+              help='标记迁移后和切换分片后等待进行中的请求结束的秒数，默认60')
+def rebalance_shards_command(dry_run, batch_size, round_size, drain_seconds):
+    """把数据不在一致性哈希位置上的智能体迁移到应在的分片（增加分片或首次启用分片后执行）"""
+    import rebalance
+    from shards import shard_label, shards_enabled
+
+    if not shards_enabled():
+        raise click.ClickException('Sharding is not enabled, set DB_SHARD_URIS first')
+    moves = rebalance.plan()
+    if dry_run:
+        for move in moves:
+            click.echo(f'Agent {move.agent_id} ({move.name}): {shard_label(move.source)} -> '
+                       f'{shard_label(move.target)}')
+        click.echo(f'{len(moves)} agents need to be moved')
+        return
+    moved = rebalance.rebalance(moves, batch_size=batch_size, round_size=round_size,
+                                drain_seconds=drain_seconds, echo=click.echo)
+    click.echo(f'Moved {moved} of {len(moves)} agents')
+
+
+@click.command('seed-data')
+@click.option('--scale', type=click.Choice(['small', 'medium', 'production']), default='small',
+              help='预设规模，默认small；production约为1万智能体、100万对话、5000万消息、1亿日志')
+@click.option('--agents', type=int, default=None, help='智能体数，覆盖预设规模')
+@click.option('--conversations', type=int, default=None, help='对话数，覆盖预设规模')
+@click.option('--messages', type=int, default=None, help='消息总数，覆盖预设规模')
+@click.option('--logs', type=int, default=None, help='日志数，覆盖预设规模')
+@click.option('--roles', type=int, default=None, help='角色数，覆盖预设规模')
+@click.option('--users', type=int, default=None, help='用户数，覆盖预设规模')
+@click.option('--batch-size', type=int, default=10000, help='每个INSERT事务的行数，默认10000')
+@click.option('--days', type=float, default=90, help='数据的时间跨度（到当前时间为止），默认90天')
+@click.option('--message-length', type=int, default=200, help='消息内容的大致字符数，默认200')
+@click.option('--seed', type=int, default=None, help='随机数种子，相同的种子生成相同的数据')
+def seed_data_command(scale, agents, conversations, messages, logs, roles, users, batch_size, days, message_length,
+                      seed):
+    """按接近生产的规模和分布批量生成合成数据（用于压测和评估查询），追加在已有数据之后"""
+    import time
+
+    import seed as seed_data
+
+    counts = dict(seed_data.SCALES[scale])
+    for name, value in (('agents', agents), ('conversations', conversations), ('messages', messages),
+                        ('logs', logs), ('roles', roles), ('users', users)):
+        if value is not None:
+            counts[name] = value
+    started = time.perf_counter()
+    try:
+        inserted = seed_data.generate(counts, batch_size=batch_size, days=days, message_length=message_length,
+                                      seed=seed, echo=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    summary = ', '.join(f'{count} {table}' for table, count in inserted.items())
+    click.echo(f'Inserted {summary} in {time.perf_counter() - started:.1f}s')
+
+
+def register_commands(app):
+    """注册命令行命令（flask --app app <command>）"""
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(serve_command)
+    app.cli.add_command(archive_conversations_command)
+    app.cli.add_command(agent_runtime_command)
+    app.cli.add_command(chat_jobs_command)
+    app.cli.add_command(deletion_jobs_command)
+    app.cli.add_command(run_dataset_command)
+    app.cli.add_command(repair_stats_command)
+    app.cli.add_command(rebalance_shards_command)
+    app.cli.add_command(seed_data_command)
@@ -0,0 +1,132 @@
+import hashlib
+import zlib
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db_routing import RoutingSession
+from models import db, Message, MessageContent
+
+# 压缩级别，6是zlib在速度和压缩率之间的默认折中
+COMPRESSION_LEVEL = 6
+
+
+def load_content_store_config(app, environ):
+    """从环境变量读取消息内容去重配置"""
+    app.config['MESSAGE_DEDUP'] = environ.get('MESSAGE_DEDUP', 'false').lower() == 'true'
+    # 超过该字节数的内容压缩后保存
+    app.config['MESSAGE_DEDUP_COMPRESS_THRESHOLD'] = int(environ.get('MESSAGE_DEDUP_COMPRESS_THRESHOLD', '1024'))
+
+
+def content_hash(text):
+    """计算消息内容的哈希"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _encode(text, threshold):
+    """编码消息内容，超过阈值时压缩"""
+    data = text.encode('utf-8')
+    if len(data) >= threshold:
+        return zlib.compress(data, COMPRESSION_LEVEL), True, len(data)
+    return data, False, len(data)
+
+
+def decode(data, compressed):
+    """还原消息内容"""
+    if compressed:
+        data = zlib.decompress(data)
+    return data.decode('utf-8')
+
+
+def _upsert(connection, hash_value, text, references, threshold):
+    """插入内容或增加已有内容的引用计数"""
+    data, compressed, size = _encode(text, threshold)
+    values = {'hash': hash_value, 'data': data, 'compressed': compressed, 'size': size, 'ref_count': references}
+    table = MessageContent.__table__
+    if connection.dialect.name == 'mysql':
+        statement = mysql_insert(table).values(**values).on_duplicate_key_update(
+            ref_count=table.c.ref_count + references)
+    else:
+        statement = sqlite_insert(table).values(**values).on_conflict_do_update(
+            index_elements=[table.c.hash], set_={'ref_count': table.c.ref_count + references})
+    connection.execute(statement)
+
+
+def _content_connection(session):
+    # 去重存储与消息在同一个数据库中（启用分片时为会话当前的分片）
+    return session.connection(bind_arguments={'mapper': MessageContent})
+
+
+def _release(connection, references):
+    """减少内容的引用计数，并删除不再被引用的内容"""
+    table = MessageContent.__table__
+    for hash_value, count in references.items():
+        connection.execute(
+            table.update().where(table.c.hash == hash_value).values(ref_count=table.c.ref_count - count))
+    if references:
+        connection.execute(
+            table.delete().where(table.c.hash.in_(list(references)), table.c.ref_count <= 0))
+
+
+def release_conversation_contents(conversation_ids):
+    """批量删除对话的消息前调用，释放这些消息引用的内容（不提交事务）"""
+    rows = (
+        db.session.query(Message.content_hash, db.func.count())
+        .filter(Message.conversation_id.in_(conversation_ids), Message.content_hash.isnot(None))
+        .group_by(Message.content_hash)
+        .all()
+    )
+    _release(_content_connection(db.session), dict(rows))
+
+
+def release_message_contents(message_ids):
+    """批量删除消息前调用，释放这些消息引用的内容（不提交事务）"""
+    rows = (
+        db.session.query(Message.content_hash, db.func.count())
+        .filter(Message.id.in_(message_ids), Message.content_hash.isnot(None))
+        .group_by(Message.content_hash)
+        .all()
+    )
+    _release(_content_connection(db.session), dict(rows))
+
+
+def _before_flush(session, flush_context, instances):
+    """新消息的内容写入去重存储，被删除或修改内容的消息释放原有引用"""
+    config = current_app.config
+    released = Counter()
+    for obj in session.deleted:
+        if isinstance(obj, Message) and obj.content_hash is not None:
+            released[obj.content_hash] += 1
+    for obj in session.dirty:
+        if isinstance(obj, Message):
+            # 修改内容时setter会清空content_hash，原值需要释放
+            history = inspect(obj).attrs.content_hash.history
+            released.update(value for value in history.deleted if value is not None)
+    if not config.get('MESSAGE_DEDUP') and not released:
+        return
+
+    connection = _content_connection(session)
+    if config.get('MESSAGE_DEDUP'):
+        texts = {}
+        references = Counter()
+        for message in list(session.new) + list(session.dirty):
+            if not isinstance(message, Message) or message.content_hash is not None or not message._content:
+                continue
+            hash_value = content_hash(message._content)
+            texts[hash_value] = message._content
+            references[hash_value] += 1
+            message.content_hash = hash_value
+            message._content = ''
+        for hash_value, count in references.items():
+            _upsert(connection, hash_value, texts[hash_value], count,
+                    config['MESSAGE_DEDUP_COMPRESS_THRESHOLD'])
+    _release(connection, released)
+
+
+def configure_content_store():
+    """注册会话事件，只需注册一次"""
+    if not event.contains(RoutingSession, 'before_flush', _before_flush):
+        event.listen(RoutingSession, 'before_flush', _before_flush)
@@ -0,0 +1,218 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from chat_service import ChatError, chat_turn
+from models import db, Agent
+from ratelimit import RateLimited
+
+
+class DatasetError(Exception):
+    """数据集或运行参数无效"""
+
+
+def resolve_agent(agent):
+    """按ID或名称查找未删除的智能体，返回其ID"""
+    query = Agent.query.filter_by(deleted_at=None)
+    found = query.filter_by(id=int(agent)).first() if agent.isdigit() else None
+    found = found or query.filter_by(name=agent).first()
+    if found is None:
+        raise DatasetError(f'Agent {agent} not found')
+    return found.id
+
+
+def read_items(path, prompt_field, id_field):
+    """逐行读取JSONL数据集，产出(条目标识, 提示词, 解析错误)
+
+    每行是一个JSON对象（提示词在prompt_field中）或一个JSON字符串；条目标识取id_field，
+    没有时为行号。空行跳过，无法解析的行以错误结果输出，不中断运行。
+    """
+    with open(path, encoding='utf-8') as dataset:
+        for line_number, line in enumerate(dataset, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f'Invalid JSON: {e}'
+                continue
+            if isinstance(item, str):
+                yield line_number, item, None
+            elif isinstance(item, dict) and isinstance(item.get(prompt_field), str):
+                yield item.get(id_field, line_number), item[prompt_field], None
+            else:
+                yield item.get(id_field, line_number) if isinstance(item, dict) else line_number, None, \
+                    f'Missing "{prompt_field}"'
+
+
+def completed_items(output_path, retry_errors):
+    """从已有的输出中读出已完成的条目标识，输出文件同时作为断点
+
+    中断时可能留下不完整的最后一行，将其截掉后继续追加。retry_errors为True时出错的条目重新执行，
+    同一条目的新结果追加在后面（以最后一行为准）。
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'rb+') as output:
+        valid_end = 0
+        for line in output:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                result = json.loads(line)
+            except ValueError:
+                break
+            valid_end += len(line)
+            key = json.dumps(result['id'])
+            if result.get('error') and retry_errors:
+                done.discard(key)
+            else:
+                done.add(key)
+        output.truncate(valid_end)
+    return done
+
+
+class Progress:
+    """运行进度：定期在标准错误输出完成数、吞吐量、延迟和token速度"""
+
+    def __init__(self, interval, stream=sys.stderr):
+        self.interval = interval
+        self.stream = stream
+        self.started = self.reported = time.monotonic()
+        self.completed = self.failed = self.tokens = 0
+        self.latency_total = 0.0
+        self.skipped = 0
+        self._window = (0, 0)  # 上次报告时的(完成数, token数)
+
+    def record(self, result):
+        self.completed += 1
+        if result.get('error'):
+            self.failed += 1
+        self.tokens += result.get('tokens') or 0
+        self.latency_total += result.get('latency_ms') or 0
+        if self.interval and time.monotonic() - self.reported >= self.interval:
+            self.report()
+
+    def report(self, final=False):
+        now = time.monotonic()
+        completed, tokens = self._window
+        elapsed = max(now - self.reported, 1e-9)
+        if final:
+            completed, tokens, elapsed = 0, 0, max(now - self.started, 1e-9)
+        average = self.latency_total / self.completed if self.completed else 0
+        self.stream.write(
+            f'{"finished" if final else "progress"}: {self.completed} done, {self.failed} failed, '
+            f'{self.skipped} skipped | {(self.completed - completed) / elapsed:.1f} items/s, '
+            f'{(self.tokens - tokens) / elapsed:.0f} tokens/s | avg latency {average:.0f} ms\n')
+        self.stream.flush()
+        self.reported = now
+        self._window = (self.completed, self.tokens)
+
+
+class DatasetRunner:
+    """用现有的对话流程（chat_turn）并发执行数据集中的提示词，每个提示词一个新对话
+
+    数据集按流读取，同时进行的对话不超过concurrency个，内存占用与数据集大小无关。
+    结果每完成一条就追加到NDJSON输出中，输出文件同时是断点：中断后用相同参数再次运行会跳过已完成的条目。
+    """
+
+    def __init__(self, app, agent_id, concurrency=8, max_attempts=3, retry_backoff=5.0):
+        self.app = app
+        self.agent_id = agent_id
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.stopping = threading.Event()
+
+    def run_item(self, item_id, prompt):
+        """执行一个条目，返回结果；可重试的错误退避后重试，超出token配额时等待配额恢复
+
+        等待期间收到停止信号时返回None，该条目不写入输出，下次运行时重新执行。
+        """
+        started = time.perf_counter()
+        attempts = 0
+        result = {'id': item_id}
+        with self.app.app_context():
+            while True:
+                attempts += 1
+                usage = {}
+                try:
+                    agent = db.session.get(Agent, self.agent_id)
+                    conversation_id, reply = chat_turn(agent, prompt, usage=usage)
+                except RateLimited as e:
+                    # 等待配额不计入执行次数
+                    db.session.rollback()
+                    attempts -= 1
+                    if self.stopping.wait(e.retry_after):
+                        return None
+                except Exception as e:
+                    db.session.rollback()
+                    if isinstance(e, ChatError) or attempts >= self.max_attempts:
+                        result['error'] = str(e)
+                        break
+                    if self.stopping.wait(self.retry_backoff * attempts):
+                        return None
+                else:
+                    result.update(conversation_id=conversation_id, response=reply, tokens=usage.get('tokens'))
+                    break
+        result.update(attempts=attempts, latency_ms=round((time.perf_counter() - started) * 1000, 1),
+                      finished_at=datetime.utcnow().isoformat())
+        return result
+
+    def run(self, items, output, skip, progress):
+        """执行items中不在skip里的条目，结果按完成顺序写入output"""
+        def write(results):
+            for result in results:
+                if result is None:
+                    continue
+                output.write(json.dumps(result, ensure_ascii=False) + '\n')
+                output.flush()
+                progress.record(result)
+
+        pending = set()
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix='dataset') as pool:
+            for item_id, prompt, error in items:
+                if self.stopping.is_set():
+                    break
+                if json.dumps(item_id) in skip:
+                    progress.skipped += 1
+                    continue
+                if error is not None:
+                    write([{'id': item_id, 'error': error, 'attempts': 0}])
+                    continue
+                if len(pending) >= self.concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    write(future.result() for future in done)
+                pending.add(pool.submit(self.run_item, item_id, prompt))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(future.result() for future in done)
+
+
+def run(app, dataset_path, agent, output_path, concurrency=8, prompt_field='prompt', id_field='id',
+        max_attempts=3, retry_backoff=5.0, restart=False, retry_errors=False, progress_seconds=5.0):
+    """执行数据集，收到SIGINT或SIGTERM时不再开始新条目，等待进行中的条目写入后退出"""
+    if concurrency < 1:
+        raise DatasetError('Concurrency must be at least 1')
+    with app.app_context():
+        agent_id = resolve_agent(str(agent))
+    if restart and os.path.exists(output_path):
+        os.remove(output_path)
+    skip = completed_items(output_path, retry_errors)
+
+    runner = DatasetRunner(app, agent_id, concurrency=concurrency, max_attempts=max_attempts,
+                           retry_backoff=retry_backoff)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: runner.stopping.set())
+    progress = Progress(progress_seconds)
+    with open(output_path, 'a', encoding='utf-8') as output:
+        runner.run(read_items(dataset_path, prompt_field, id_field), output, skip, progress)
+    progress.report(final=True)
+    return progress, runner.stopping.is_set()
@@ -0,0 +1,162 @@
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Table, event, inspect
+
+from sqlite_profile import READ_ONLY_METHODS
+
+# 只读副本在SQLALCHEMY_BINDS中的键前缀
+REPLICA_BIND_PREFIX = 'replica_'
+# 记录客户端最近写入时间的cookie
+STICKY_COOKIE = 'db_primary_until'
+# 进程内粘滞表的最大条目数，超过后清理已过期的条目
+STICKY_MAX_CLIENTS = 10000
+# 按智能体分片存储的表（见shards.py），会话切换到某个分片后，这些表的读写都在该分片的数据库中执行
+SHARDED_TABLES = frozenset({'conversation', 'message', 'message_content', 'agent_log', 'archived_conversation',
+                            'agent_stats'})
+# 会话当前分片在Session.info中的键，没有设置或为None时是主库
+SHARD_INFO_KEY = 'db_shard'
+
+_round_robin = itertools.count()
+_lock = threading.Lock()
+_replica_down_until = {}
+_recent_writers = {}
+
+
+def load_replica_config(app, environ):
+    """从环境变量读取只读副本配置，副本以bind的形式注册到Flask-SQLAlchemy"""
+    uris = [uri.strip() for uri in environ.get('DB_REPLICA_URIS', '').split(',') if uri.strip()]
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    keys = []
+    for index, uri in enumerate(uris):
+        key = f'{REPLICA_BIND_PREFIX}{index}'
+        binds[key] = uri
+        keys.append(key)
+    app.config['DB_REPLICA_KEYS'] = keys
+    # 客户端写入后在该时间窗口内的读请求仍走主库（读己之写）
+    app.config['DB_READ_YOUR_WRITES_SECONDS'] = float(environ.get('DB_READ_YOUR_WRITES_SECONDS', '5'))
+    # 副本出错后暂停使用的秒数
+    app.config['DB_REPLICA_RETRY_SECONDS'] = float(environ.get('DB_REPLICA_RETRY_SECONDS', '30'))
+
+
+def client_key():
+    """识别客户端：优先使用X-Client-Id请求头，否则使用远端地址"""
+    return request.headers.get('X-Client-Id') or request.remote_addr
+
+
+def _is_recent_writer():
+    """判断当前客户端是否处于写后粘滞窗口内"""
+    now = time.time()
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > now:
+            return True
+    except ValueError:
+        pass
+    return _recent_writers.get(client_key(), 0) > now
+
+
+def _healthy_replicas(config):
+    """返回当前可用的副本键列表"""
+    now = time.time()
+    return [key for key in config['DB_REPLICA_KEYS'] if _replica_down_until.get(key, 0) <= now]
+
+
+def choose_read_bind(db):
+    """为当前请求选择只读副本引擎，不满足条件时返回None（使用主库）"""
+    if not has_request_context() or request.method not in READ_ONLY_METHODS:
+        return None
+    if g.get('db_use_primary'):
+        return None
+    if 'db_replica_key' not in g:
+        config = current_app.config
+        replicas = _healthy_replicas(config) if config.get('DB_REPLICA_KEYS') else []
+        if not replicas or _is_recent_writer():
+            g.db_replica_key = None
+        else:
+            # 同一请求内固定使用同一个副本，保证读取结果一致
+            g.db_replica_key = replicas[next(_round_robin) % len(replicas)]
+    if g.db_replica_key is None:
+        return None
+    return db.engines[g.db_replica_key]
+
+
+def use_primary():
+    """让当前请求余下的查询都走主库（读请求中需要写入时调用）"""
+    if has_request_context():
+        g.db_use_primary = True
+
+
+def _touches_shard(mapper, clause):
+    """语句是否读写分片表：ORM语句按映射类判断，Core的INSERT/UPDATE/DELETE按目标表判断"""
+    if mapper is not None:
+        return inspect(mapper).local_table.name in SHARDED_TABLES
+    table = getattr(clause, 'table', clause)
+    return isinstance(table, Table) and table.name in SHARDED_TABLES
+
+
+class RoutingSession(Session):
+    """读写分离会话：分片表的语句路由到会话当前的分片，只读请求中的其他查询路由到副本，其余走主库"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            shard = self.info.get(SHARD_INFO_KEY)
+            if shard is not None and _touches_shard(mapper, clause):
+                return self._db.engines[shard]
+        if bind is None and not self._flushing:
+            replica = choose_read_bind(self._db)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _mark_replica_down(key, config):
+    """副本出错时将其暂时移出可用列表，并让当前请求回退到主库"""
+    with _lock:
+        _replica_down_until[key] = time.time() + config['DB_REPLICA_RETRY_SECONDS']
+    if has_request_context():
+        g.db_replica_failed = True
+
+
+def configure_replica_engines(app, db):
+    """为副本引擎注册错误处理，需要在应用上下文中调用"""
+    for key in app.config.get('DB_REPLICA_KEYS', []):
+        engine = db.engines[key]
+
+        @event.listens_for(engine, 'handle_error')
+        def on_error(context, key=key):
+            _mark_replica_down(key, app.config)
+
+
+def replica_fallback(method):
+    """资源方法装饰器：读请求在副本上出错时，回滚后在主库上重试一次"""
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        result = method(*args, **kwargs)
+        if g.pop('db_replica_failed', False):
+            current_app.extensions['sqlalchemy'].session.rollback()
+            g.db_use_primary = True
+            result = method(*args, **kwargs)
+        return result
+    return wrapper
+
+
+def remember_writer(response):
+    """after_request钩子：写请求之后一段时间内让该客户端的读请求走主库"""
+    config = current_app.config
+    if request.method in READ_ONLY_METHODS or not config.get('DB_REPLICA_KEYS'):
+        return response
+    window = config['DB_READ_YOUR_WRITES_SECONDS']
+    until = time.time() + window
+    with _lock:
+        if len(_recent_writers) >= STICKY_MAX_CLIENTS:
+            now = time.time()
+            for client, expires in list(_recent_writers.items()):
+                if expires <= now:
+                    del _recent_writers[client]
+        _recent_writers[client_key()] = until
+    response.set_cookie(STICKY_COOKIE, f'{until:.3f}', max_age=int(window) + 1, httponly=True)
+    return response
@@ -0,0 +1,312 @@
+import atexit
+import os
+import signal
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+
+import leases
+from content_store import release_conversation_contents, release_message_contents
+from models import (db, Agent, AgentLog, AgentRuntimeState, AgentStats, AgentTask, ArchivedConversation,
+                    ChatJob, Conversation, DeletionJob, Message)
+from shards import current_shard, use_shard
+from sqlite_profile import deferred_reads
+from stats import release_log_counts
+
+# 后台删除的默认配置，均可通过同名环境变量覆盖
+DELETION_DEFAULTS = {
+    'DELETION_EXECUTOR': 'embedded',         # embedded：在Web工作进程内执行；external：由flask deletion-jobs执行
+    'DELETION_CHUNK_SIZE': '500',            # 每个事务删除的行数，越小每次持有写锁的时间越短
+    'DELETION_PAUSE_SECONDS': '0.05',        # 每批之间的间隔，给在线请求让出写锁
+    'DELETION_POLL_SECONDS': '2',            # 没有任务时的轮询间隔
+    'DELETION_LEASE_SECONDS': '120',         # 执行进程退出后，任务在租约过期后由其他进程继续
+    'DELETION_MAX_ATTEMPTS': '3',
+    'DELETION_RETRY_BACKOFF_SECONDS': '30',
+    'DELETION_SHUTDOWN_SECONDS': '10',       # 内嵌执行器随进程退出时等待当前批次的最长秒数
+}
+
+_start_lock = threading.Lock()
+
+
+class LeaseLost(Exception):
+    """任务租约已过期并被其他执行者接管"""
+
+
+def load_deletion_config(app, environ):
+    """从环境变量读取后台删除配置"""
+    for key, default in DELETION_DEFAULTS.items():
+        value = environ.get(key, default)
+        if key == 'DELETION_EXECUTOR':
+            app.config[key] = value
+        else:
+            app.config[key] = float(value) if key.endswith('_SECONDS') else int(value)
+
+
+def get_agent_or_404(agent_id):
+    """获取未被删除的智能体，不存在或已删除时返回404"""
+    return Agent.query.filter_by(id=agent_id, deleted_at=None).first_or_404()
+
+
+def _schedule(job):
+    db.session.add(job)
+    db.session.commit()
+    executor = current_app.extensions.get('deletion')
+    if executor is not None:
+        executor.wake()
+    return job
+
+
+def delete_agent(agent):
+    """软删除智能体并安排后台删除其对话、消息、日志和任务，返回删除任务
+
+    智能体立即从API中消失并停止运行，数据由删除执行器分批删除。
+    """
+    agent.deleted_at = datetime.utcnow()
+    # 运行时不再领取该智能体的任务，模型预热也随之释放
+    agent.status = 'stopped'
+    return _schedule(DeletionJob(target_type='agent', target_id=agent.id, label=agent.name, shard=agent.shard))
+
+
+def delete_conversation(conversation):
+    """软删除对话并安排后台删除其消息，返回删除任务（对话在会话当前的分片上）"""
+    conversation.deleted_at = datetime.utcnow()
+    return _schedule(DeletionJob(target_type='conversation', target_id=conversation.id,
+                                 label=conversation.conversation_id, shard=current_shard()))
+
+
+def delete_agent_data(agent, shard, available_at=None):
+    """安排后台删除智能体留在shard上的对话、消息、日志和统计（数据迁移到其他分片之后），返回删除任务"""
+    return _schedule(DeletionJob(target_type='agent_data', target_id=agent.id, label=agent.name, shard=shard,
+                                 available_at=available_at or datetime.utcnow()))
+
+
+def purge_agent_data(agent_id, shard, chunk_size):
+    """立即删除智能体留在shard上的对话、消息、日志和统计（不经过删除任务），每批提交，返回删除的行数"""
+    use_shard(shard)
+    deleted = 0
+    for _, model, criteria in _phases('agent_data', agent_id):
+        while True:
+            count, _ = _delete_chunk(model, criteria, chunk_size)
+            db.session.commit()
+            deleted += count
+            if count < chunk_size:
+                break
+    return deleted
+
+
+def _phases(target_type, target_id):
+    """删除目标数据的各阶段：(阶段名, 模型, 筛选条件)，按外键依赖顺序排列"""
+    if target_type == 'conversation':
+        return [
+            ('messages', Message, [Message.conversation_id == target_id]),
+            ('conversation', Conversation, [Conversation.id == target_id]),
+        ]
+    conversations = select(Conversation.id).where(Conversation.agent_id == target_id)
+    data = [
+        ('messages', Message, [Message.conversation_id.in_(conversations)]),
+        ('conversations', Conversation, [Conversation.agent_id == target_id]),
+        ('archived_conversations', ArchivedConversation, [ArchivedConversation.agent_id == target_id]),
+        ('logs', AgentLog, [AgentLog.agent_id == target_id]),
+    ]
+    if target_type == 'agent_data':
+        return data + [('stats', AgentStats, [AgentStats.agent_id == target_id])]
+    return data + [
+        ('tasks', AgentTask, [AgentTask.agent_id == target_id]),
+        ('runtime_states', AgentRuntimeState, [AgentRuntimeState.agent_id == target_id]),
+        ('chat_jobs', ChatJob, [ChatJob.agent_id == target_id]),
+        ('agent', Agent, [Agent.id == target_id]),
+    ]
+
+
+def _delete_chunk(model, criteria, size):
+    """删除最多size行（不提交），返回(删除的行数, 提交后需要删除的归档文件)"""
+    key = model.__mapper__.primary_key[0]
+    ids = [row_id for (row_id,) in db.session.query(key).filter(*criteria).order_by(key).limit(size)]
+    if not ids:
+        return 0, []
+    files = []
+    if model is Message:
+        release_message_contents(ids)
+    elif model is Conversation:
+        # 删除消息阶段之后才写入的消息（例如删除时进行中的对话）
+        release_conversation_contents(ids)
+        Message.query.filter(Message.conversation_id.in_(ids)).delete(synchronize_session=False)
+    elif model is ArchivedConversation:
+        files = [location for (location,) in db.session.query(ArchivedConversation.location)
+                 .filter(ArchivedConversation.id.in_(ids), ArchivedConversation.storage == 'file')]
+    elif model is AgentLog:
+        # 全部日志的总数由各智能体的计数相加，删除过程中也保持准确
+        release_log_counts(ids)
+    elif model is Agent:
+        AgentStats.query.filter(AgentStats.agent_id.in_(ids)).delete(synchronize_session=False)
+    model.query.filter(key.in_(ids)).delete(synchronize_session=False)
+    return len(ids), files
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class DeletionExecutor:
+    """后台删除执行器：领取删除任务，按阶段分批删除目标的数据
+
+    每批删除DELETION_CHUNK_SIZE行并单独提交，批次之间暂停DELETION_PAUSE_SECONDS，
+    删除大量数据时不会长时间持有写锁而阻塞在线对话。每批提交时一起更新任务进度并续租；
+    执行进程退出后，任务在租约过期后由其他执行者从剩余的数据继续删除。
+    """
+
+    def __init__(self, app, executor_id=None):
+        self.app = app
+        self.config = app.config
+        self.executor_id = executor_id or f'{socket.gethostname()}:{os.getpid()}:deletion'
+        self.pid = os.getpid()
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def wake(self):
+        """有新任务时唤醒执行线程"""
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._work, name='deletion-jobs', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """停止执行，进行中的任务在当前批次提交后重新排队；超时时直接把任务交还队列"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                with self.app.app_context():
+                    leases.release_owned(DeletionJob, self.executor_id)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = None
+            try:
+                with self.app.app_context():
+                    job = leases.claim(DeletionJob, [], [DeletionJob.available_at.asc(), DeletionJob.id.asc()],
+                                       self.executor_id, self.config['DELETION_LEASE_SECONDS'])
+                    if job is not None:
+                        self.run_job(job)
+            except Exception:
+                self.app.logger.exception('Deletion executor error')
+            if job is None:
+                self._wake.wait(self.config['DELETION_POLL_SECONDS'])
+                self._wake.clear()
+
+    def run_job(self, job):
+        """执行一条已领取的删除任务"""
+        job_pk, target_type, target_id = job.id, job.target_type, job.target_id
+        attempts, total, shard, error = job.attempts, job.total_rows, job.shard, job.error
+        # 领取时读取任务开启了写事务，先结束它
+        db.session.commit()
+        # 目标的对话、消息和日志所在的分片，其他表不受影响
+        use_shard(shard)
+        owner = self.executor_id
+        if attempts > self.config['DELETION_MAX_ATTEMPTS']:
+            leases.release(DeletionJob, job_pk, owner, status='failed', finished_at=datetime.utcnow(),
+                           error=error or 'Lease expired too many times')
+            return
+
+        size = self.config['DELETION_CHUNK_SIZE']
+        try:
+            phases = _phases(target_type, target_id)
+            if not total:
+                # 统计行数可能要扫描大量数据，在只读事务中执行，期间不占SQLite写锁
+                with deferred_reads():
+                    total = sum(db.session.query(db.func.count(model.__mapper__.primary_key[0]))
+                                .filter(*criteria).scalar() for _, model, criteria in phases)
+                    db.session.commit()
+                if not leases.update_held(DeletionJob, job_pk, owner, total_rows=total):
+                    raise LeaseLost()
+                db.session.commit()
+
+            for phase, model, criteria in phases:
+                while True:
+                    deleted, files = _delete_chunk(model, criteria, size)
+                    # 进度与删除在同一事务中提交，并顺带续租
+                    held = leases.update_held(
+                        DeletionJob, job_pk, owner, phase=phase, deleted_rows=DeletionJob.deleted_rows + deleted,
+                        lease_expires_at=datetime.utcnow() + timedelta(seconds=self.config['DELETION_LEASE_SECONDS']))
+                    if not held:
+                        raise LeaseLost()
+                    db.session.commit()
+                    # 迁移后留下的归档记录与新分片上的记录指向同一个文件，不删除文件
+                    if target_type != 'agent_data':
+                        _remove_files(files)
+                    if deleted < size:
+                        break
+                    if self._stopping.wait(self.config['DELETION_PAUSE_SECONDS']):
+                        # 退出前把任务交还队列，不计入执行次数
+                        leases.release(DeletionJob, job_pk, owner, status='pending',
+                                       attempts=DeletionJob.attempts - 1, available_at=datetime.utcnow())
+                        return
+
+            leases.release(DeletionJob, job_pk, owner, status='done', phase=None, error=None,
+                           finished_at=datetime.utcnow())
+        except LeaseLost:
+            db.session.rollback()
+        except Exception as e:
+            db.session.rollback()
+            if attempts < self.config['DELETION_MAX_ATTEMPTS']:
+                delay = self.config['DELETION_RETRY_BACKOFF_SECONDS'] * attempts
+                leases.release(DeletionJob, job_pk, owner, status='pending', error=str(e),
+                               available_at=datetime.utcnow() + timedelta(seconds=delay))
+            else:
+                leases.release(DeletionJob, job_pk, owner, status='failed', error=str(e),
+                               finished_at=datetime.utcnow())
+
+
+def start_embedded_executor(app):
+    """before_request钩子：在当前进程中启动内嵌执行器（预fork部署时每个工作进程各自启动）"""
+    executor = app.extensions.get('deletion')
+    if executor is not None and executor.pid == os.getpid():
+        return
+    with _start_lock:
+        executor = app.extensions.get('deletion')
+        if executor is not None and executor.pid == os.getpid():
+            return
+        executor = DeletionExecutor(app)
+        executor.start()
+        app.extensions['deletion'] = executor
+        atexit.register(stop_embedded_executor, app, app.config['DELETION_SHUTDOWN_SECONDS'])
+
+
+def stop_embedded_executor(app, timeout):
+    """停止当前进程中的内嵌执行器（工作进程回收或退出时调用），最多等待timeout秒"""
+    executor = app.extensions.get('deletion')
+    if executor is None or executor.pid != os.getpid():
+        return
+    with _start_lock:
+        if app.extensions.get('deletion') is not executor:
+            return
+        del app.extensions['deletion']
+    executor.stop(timeout=timeout)
+
+
+def configure_deletion(app):
+    """配置执行器：embedded模式下随Web进程启动"""
+    if app.config['DELETION_EXECUTOR'] == 'embedded':
+        app.before_request(lambda: start_embedded_executor(app))
+
+
+def run(app, shutdown_timeout=None):
+    """在当前进程中运行独立的执行器，直到收到SIGTERM或SIGINT"""
+    executor = DeletionExecutor(app)
+    stopped = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stopped.set())
+    executor.start()
+    app.logger.info('Deletion executor %s started', executor.executor_id)
+    stopped.wait()
+    executor.stop(timeout=shutdown_timeout)
@@ -0,0 +1,121 @@
+"""对话分叉：子对话通过父对话指针和分叉点共享父对话历史的前缀，不复制消息
+
+对话的历史 = 父对话历史的前fork_point条 + 本对话自己的消息，父对话本身也可以是分叉出的对话。
+分叉只插入一行对话，与历史长度无关；读取历史时用一条递归查询取出整条链，再把各段的消息合并成一个查询。
+"""
+import uuid
+
+from sqlalchemy import select, union_all
+
+from models import db, Conversation, Message
+
+
+class ForkError(Exception):
+    """无法分叉，status_code为对应的HTTP状态码"""
+    status_code = 400
+
+
+class ConversationExists(ForkError):
+    status_code = 409
+
+    def __init__(self, conversation_id):
+        super().__init__(f'Conversation {conversation_id} already exists')
+
+
+def history_length(conversation):
+    """对话历史的消息数（含从父对话共享的消息）"""
+    return (conversation.fork_point or 0) + (conversation.message_count or 0)
+
+
+def _chain(conversation_pk):
+    """从对话到根对话的分叉链[(id, fork_point)]，一条递归查询"""
+    chain = (select(Conversation.id, Conversation.parent_id, Conversation.fork_point)
+             .where(Conversation.id == conversation_pk).cte('fork_chain', recursive=True))
+    chain = chain.union_all(
+        select(Conversation.id, Conversation.parent_id, Conversation.fork_point)
+        .join(chain, Conversation.id == chain.c.parent_id)
+    )
+    # 指定映射类，启用分片时在会话当前的分片上执行
+    rows = {row.id: row for row in db.session.execute(select(chain), bind_arguments={'mapper': Conversation})}
+    links = []
+    pk = conversation_pk
+    while pk in rows:
+        links.append((pk, rows[pk].fork_point or 0))
+        pk = rows[pk].parent_id
+    return links
+
+
+def segments(conversation_pk, parent_id):
+    """组成对话历史的各段[(对话主键, 取前多少条消息，None为全部)]，从根对话到本对话
+
+    parent_id为None时对话不是分叉出的，不查询分叉链。
+    """
+    if parent_id is None:
+        return [(conversation_pk, None)]
+    links = _chain(conversation_pk)
+    result = [(conversation_pk, None)]
+    # visible为下一个祖先的历史中可见的前缀长度
+    visible = links[0][1]
+    for pk, fork_point in links[1:]:
+        if visible > fork_point:
+            result.append((pk, visible - fork_point))
+        visible = min(visible, fork_point)
+    result.reverse()
+    return result
+
+
+def history_query(conversation_pk, parent_id=None):
+    """对话完整历史的消息查询，按时间顺序排列，parent_id为对话的Conversation.parent_id
+
+    父对话在分叉点之前的消息都早于分叉，按时间排序即为链上从根到本对话的顺序。
+    """
+    parts = segments(conversation_pk, parent_id)
+    if len(parts) == 1:
+        query = Message.query.filter_by(conversation_id=conversation_pk)
+    else:
+        selects = []
+        for pk, limit in parts:
+            part = select(Message.id).where(Message.conversation_id == pk)
+            if limit is not None:
+                part = part.order_by(Message.timestamp.asc(), Message.id.asc()).limit(limit)
+            # 每段单独作为子查询，SQLite不允许在UNION的成员上直接使用LIMIT
+            part = part.subquery()
+            selects.append(select(part.c.id))
+        query = Message.query.filter(Message.id.in_(union_all(*selects)))
+    return query.order_by(Message.timestamp.asc(), Message.id.asc())
+
+
+def has_forks(conversation_pk):
+    """是否有未删除的对话从该对话分叉"""
+    return db.session.query(
+        Conversation.query.filter_by(parent_id=conversation_pk, deleted_at=None).exists()
+    ).scalar()
+
+
+def fork_conversation(parent, fork_point=None, conversation_id=None):
+    """从parent历史的前fork_point条消息（默认全部）分叉出新对话并提交，返回新对话
+
+    新对话属于同一个智能体，只插入一行，不复制消息。调用方已切换到智能体所在的分片。
+    """
+    length = history_length(parent)
+    if fork_point is None:
+        fork_point = length
+    if not isinstance(fork_point, int) or isinstance(fork_point, bool) or not 0 <= fork_point <= length:
+        raise ForkError(f'fork_point must be an integer between 0 and {length}')
+    if conversation_id:
+        exists = Conversation.query.filter_by(agent_id=parent.agent_id, conversation_id=conversation_id,
+                                              deleted_at=None).first()
+        if exists:
+            raise ConversationExists(conversation_id)
+    else:
+        conversation_id = str(uuid.uuid4())
+
+    parent_id = parent.id
+    if fork_point <= (parent.fork_point or 0) and parent.parent_id is not None:
+        # 分叉点在父对话共享的前缀之内，直接引用父对话的父对话，链不会变长
+        parent_id = parent.parent_id
+    conversation = Conversation(agent_id=parent.agent_id, conversation_id=conversation_id,
+                                parent_id=parent_id, fork_point=fork_point)
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+from flask_restx.utils import unpack
+
+from models import db
+from ratelimit import user_identity
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# SQLite存储每处理多少个新键清理一次过期和超出上限的记录
+SQLITE_CLEANUP_EVERY = 100
+
+
+def load_idempotency_config(app, environ):
+    """从环境变量读取幂等键配置"""
+    app.config['IDEMPOTENCY_ENABLED'] = environ.get('IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+    # memory：进程内；sqlite：同一主机上的所有工作进程共享
+    app.config['IDEMPOTENCY_STORE'] = environ.get('IDEMPOTENCY_STORE', 'memory')
+    app.config['IDEMPOTENCY_SQLITE_PATH'] = environ.get(
+        'IDEMPOTENCY_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'agent-platform-idempotency.sqlite3'))
+    # 已完成请求的结果保留多久，期间的重试直接返回该结果
+    app.config['IDEMPOTENCY_TTL_SECONDS'] = float(environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+    # 最多保留的键数，超出时淘汰最早的
+    app.config['IDEMPOTENCY_MAX_KEYS'] = int(environ.get('IDEMPOTENCY_MAX_KEYS', '10000'))
+    # 原请求仍在处理时，重试最多等待多久，超时返回409
+    app.config['IDEMPOTENCY_WAIT_SECONDS'] = float(environ.get('IDEMPOTENCY_WAIT_SECONDS', '60'))
+    # 处理中的记录的有效期，处理进程退出后，过期的键可以被重新执行
+    app.config['IDEMPOTENCY_LEASE_SECONDS'] = float(environ.get('IDEMPOTENCY_LEASE_SECONDS', '600'))
+
+
+class MemoryStore:
+    """进程内的幂等记录：键 -> [请求指纹, 结果（处理中为None）, 过期时间]，按写入顺序淘汰"""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._changed = threading.Condition()
+        self._entries = OrderedDict()
+
+    def begin(self, key, fingerprint, lease_seconds):
+        """开始处理一个键，返回('new'|'pending'|'done'|'mismatch', 已完成的结果)"""
+        now = time.time()
+        with self._changed:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= now:
+                self._entries.pop(key, None)
+                self._entries[key] = [fingerprint, None, now + lease_seconds]
+                while len(self._entries) > self.max_keys:
+                    self._entries.popitem(last=False)
+                return 'new', None
+            if entry[0] != fingerprint:
+                return 'mismatch', None
+            return ('pending', None) if entry[1] is None else ('done', entry[1])
+
+    def complete(self, key, fingerprint, record, ttl_seconds):
+        with self._changed:
+            self._entries.pop(key, None)
+            self._entries[key] = [fingerprint, record, time.time() + ttl_seconds]
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+            self._changed.notify_all()
+
+    def abandon(self, key):
+        """放弃处理中的键，之后的重试重新执行"""
+        with self._changed:
+            self._entries.pop(key, None)
+            self._changed.notify_all()
+
+    def wait(self, key, timeout):
+        """等待处理中的键完成或被放弃"""
+        with self._changed:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is None:
+                self._changed.wait(timeout)
+
+
+class SQLiteStore:
+    """保存在本地SQLite文件中的幂等记录，同一主机上的多个工作进程共享"""
+
+    def __init__(self, path, max_keys):
+        self.path = path
+        self.max_keys = max_keys
+        self._local = threading.local()
+        self._begun = 0
+
+    @property
+    def connection(self):
+        # 每个线程使用独立的连接，自行管理事务
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS idempotency_key '
+                               '(key TEXT PRIMARY KEY, fingerprint TEXT, record TEXT, expires REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_idempotency_key_expires ON idempotency_key (expires)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def begin(self, key, fingerprint, lease_seconds):
+        connection = self.connection
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT fingerprint, record, expires FROM idempotency_key WHERE key = ?',
+                                     (key,)).fetchone()
+            if row is None or row[2] <= now:
+                connection.execute('INSERT OR REPLACE INTO idempotency_key (key, fingerprint, record, expires) '
+                                   'VALUES (?, ?, NULL, ?)', (key, fingerprint, now + lease_seconds))
+                result = 'new', None
+            elif row[0] != fingerprint:
+                result = 'mismatch', None
+            else:
+                result = ('pending', None) if row[1] is None else ('done', row[1])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if result[0] == 'new':
+            self._begun += 1
+            if self._begun % SQLITE_CLEANUP_EVERY == 0:
+                self._cleanup(now)
+        return result
+
+    def _cleanup(self, now):
+        """删除过期的记录，并按过期时间淘汰超出上限的记录"""
+        connection = self.connection
+        connection.execute('DELETE FROM idempotency_key WHERE expires <= ?', (now,))
+        connection.execute('DELETE FROM idempotency_key WHERE key IN (SELECT key FROM idempotency_key '
+                           'ORDER BY expires DESC LIMIT -1 OFFSET ?)', (self.max_keys,))
+
+    def complete(self, key, fingerprint, record, ttl_seconds):
+        self.connection.execute('INSERT OR REPLACE INTO idempotency_key (key, fingerprint, record, expires) '
+                                'VALUES (?, ?, ?, ?)', (key, fingerprint, record, time.time() + ttl_seconds))
+
+    def abandon(self, key):
+        self.connection.execute('DELETE FROM idempotency_key WHERE key = ? AND record IS NULL', (key,))
+
+    def wait(self, key, timeout):
+        # 其他进程完成时无法通知，轮询
+        time.sleep(min(timeout, 0.05))
+
+
+def _store():
+    return current_app.extensions['idempotency_store']
+
+
+def _scoped_key(key):
+    """幂等键按用户、方法和路径隔离，不同用户使用相同的键互不影响
+
+    用户与限流相同，不使用客户端自己发来的X-User-Id，否则伪造该请求头就能取回其他用户保存的响应。
+    """
+    return f'{user_identity()}:{request.method}:{request.path}:{key}'
+
+
+def _fingerprint():
+    """请求的指纹，同一个键用于不同的请求时返回422"""
+    return hashlib.sha256(request.query_string + b'\n' + request.get_data()).hexdigest()
+
+
+def _record(result):
+    """资源方法的返回值转换为可保存的结果：(响应体, 状态码, 响应头)"""
+    if isinstance(result, current_app.response_class):
+        return result.get_json(silent=True), result.status_code, dict(result.headers)
+    body, status, headers = unpack(result)
+    return body, status, dict(headers or {})
+
+
+def idempotent(method):
+    """资源方法装饰器：带Idempotency-Key请求头的请求只执行一次
+
+    第一个请求的结果（5xx、429和带Retry-After的响应除外）在IDEMPOTENCY_TTL_SECONDS内保存，之后同一客户端以相同的键、方法和路径
+    重试时直接返回该结果（带Idempotent-Replayed响应头），不再调用模型或写入数据；原请求仍在处理时，
+    重试等待其完成。同一个键用于不同的请求体时返回422。
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        # 事务批处理中的修改可能被回滚，不记录结果
+        if not key or not current_app.config.get('IDEMPOTENCY_ENABLED') or db.session.info.get('deferred_commit'):
+            return method(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'}, 400
+
+        config = current_app.config
+        store = _store()
+        scoped, fingerprint = _scoped_key(key), _fingerprint()
+        deadline = time.monotonic() + config['IDEMPOTENCY_WAIT_SECONDS']
+        while True:
+            state, record = store.begin(scoped, fingerprint, config['IDEMPOTENCY_LEASE_SECONDS'])
+            if state != 'pending':
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return {'error': f'A request with this {HEADER} is still in progress'}, 409, {'Retry-After': '1'}
+            store.wait(scoped, remaining)
+
+        if state == 'mismatch':
+            return {'error': f'{HEADER} was already used for a different request'}, 422
+        if state == 'done':
+            body, status, headers = json.loads(record)
+            headers['Idempotent-Replayed'] = 'true'
+            return body, status, headers
+
+        try:
+            result = method(*args, **kwargs)
+        except BaseException:
+            store.abandon(scoped)
+            raise
+        body, status, headers = _record(result)
+        if status >= 500 or status == 429 or 'Retry-After' in headers:
+            # 失败、被限流或对话忙的请求可以重试
+            store.abandon(scoped)
+        else:
+            kept = {name: value for name, value in headers.items() if name == 'Location'}
+            store.complete(scoped, fingerprint, json.dumps([body, status, kept]), config['IDEMPOTENCY_TTL_SECONDS'])
+        return result
+    return wrapper
+
+
+def configure_idempotency(app):
+    """创建幂等记录存储"""
+    if not app.config.get('IDEMPOTENCY_ENABLED'):
+        return
+    if app.config['IDEMPOTENCY_STORE'] == 'sqlite':
+        app.extensions['idempotency_store'] = SQLiteStore(app.config['IDEMPOTENCY_SQLITE_PATH'],
+                                                          app.config['IDEMPOTENCY_MAX_KEYS'])
+    else:
+        app.extensions['idempotency_store'] = MemoryStore(app.config['IDEMPOTENCY_MAX_KEYS'])
@@ -0,0 +1,442 @@
+import atexit
+import ipaddress
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+import leases
+from chat_service import ChatError, complete_turn, open_conversation
+from models import db, Agent, AgentLog, ChatJob, Message
+from ratelimit import RateLimited, check_tokens
+from sqlite_profile import deferred_reads
+from shards import current_shard, use_agent_shard
+from turns import ConversationBusy, conversation_turn
+
+# 异步对话任务的默认配置，均可通过同名环境变量覆盖
+CHAT_JOBS_DEFAULTS = {
+    'CHAT_JOBS_EXECUTOR': 'embedded',          # embedded：在Web工作进程内执行；external：由flask chat-jobs执行
+    'CHAT_JOBS_WORKERS': '4',                  # 每个进程的执行线程数
+    'CHAT_JOBS_POLL_SECONDS': '1',             # 没有任务时的轮询间隔
+    'CHAT_JOBS_LEASE_SECONDS': '120',          # 任务租约时长，执行进程退出后任务在租约过期后被重新执行
+    'CHAT_JOBS_MAX_ATTEMPTS': '3',             # 任务最多执行的次数
+    'CHAT_JOBS_RETRY_BACKOFF_SECONDS': '10',   # 重试前等待的秒数，随执行次数线性增长
+    'CHAT_JOBS_SHUTDOWN_SECONDS': '30',        # 内嵌执行器随进程退出时等待进行中任务的最长秒数
+    'CHAT_JOBS_CALLBACK_ATTEMPTS': '5',        # 回调最多投递的次数
+    'CHAT_JOBS_CALLBACK_TIMEOUT_SECONDS': '10',
+    # 允许的回调主机，逗号分隔，以.开头的项匹配其子域名；为空时允许任何解析到公网地址的主机
+    'CHAT_JOBS_CALLBACK_ALLOWED_HOSTS': '',
+    'CHAT_JOBS_CALLBACK_ALLOW_PRIVATE': 'false',  # 为true时允许回调内网、回环和链路本地地址（仅用于本地开发）
+}
+
+
+_start_lock = threading.Lock()
+
+
+class LeaseLost(Exception):
+    """任务租约已过期并被其他执行者接管"""
+
+
+def load_chat_jobs_config(app, environ):
+    """从环境变量读取异步对话任务配置"""
+    for key, default in CHAT_JOBS_DEFAULTS.items():
+        value = environ.get(key, default)
+        if key == 'CHAT_JOBS_EXECUTOR':
+            app.config[key] = value
+        elif key == 'CHAT_JOBS_CALLBACK_ALLOWED_HOSTS':
+            app.config[key] = [host.strip().lower() for host in value.split(',') if host.strip()]
+        elif key == 'CHAT_JOBS_CALLBACK_ALLOW_PRIVATE':
+            app.config[key] = value.lower() == 'true'
+        else:
+            app.config[key] = float(value) if key.endswith('_SECONDS') else int(value)
+
+
+class CallbackRejected(ValueError):
+    """回调地址不允许使用"""
+
+
+def _host_allowed(host, allowed):
+    return any(host == entry or (entry.startswith('.') and host.endswith(entry)) for entry in allowed)
+
+
+def check_callback_url(url, config):
+    """检查回调地址：只允许http(s)；配置了允许的主机时必须在其中，
+    否则主机解析出的每个地址都必须是公网地址（防止通过回调访问内网服务和云元数据接口）"""
+    parts = urlsplit(url) if isinstance(url, str) else None
+    if parts is None or parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise CallbackRejected('callback_url must be an http(s) URL')
+    host = parts.hostname.lower()
+    allowed = config['CHAT_JOBS_CALLBACK_ALLOWED_HOSTS']
+    if allowed and not _host_allowed(host, allowed):
+        raise CallbackRejected(f'callback_url host {host} is not allowed')
+    if config['CHAT_JOBS_CALLBACK_ALLOW_PRIVATE']:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        raise CallbackRejected(f'callback_url host {host} cannot be resolved')
+    for address in addresses:
+        # IPv6地址可能带有%网卡后缀
+        if not ipaddress.ip_address(address.split('%')[0]).is_global:
+            raise CallbackRejected(f'callback_url host {host} resolves to a non-public address')
+
+
+def submit_job(agent, message, conversation_id=None, callback_url=None, idempotency_key=None):
+    """提交异步对话任务，返回(job, created)；相同idempotency_key的重复提交返回已有任务"""
+    if idempotency_key:
+        existing = ChatJob.query.filter_by(agent_id=agent.id, idempotency_key=idempotency_key).first()
+        if existing:
+            return existing, False
+    job = ChatJob(
+        job_id=str(uuid.uuid4()),
+        agent_id=agent.id,
+        idempotency_key=idempotency_key,
+        message=message,
+        # 新对话在提交时分配ID，客户端可以立即用它查询消息，重试时也不会创建第二个对话
+        conversation_id=conversation_id or str(uuid.uuid4()),
+        new_conversation=not conversation_id,
+        callback_url=callback_url,
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # 并发的重复提交
+        db.session.rollback()
+        return ChatJob.query.filter_by(agent_id=agent.id, idempotency_key=idempotency_key).one(), False
+    executor = current_app.extensions.get('chat_jobs')
+    if executor is not None:
+        executor.wake()
+    return job, True
+
+
+def _saved_reply(conversation_pk, user_message_id):
+    """用户消息之后紧接着的助手回复的内容，没有时返回None"""
+    following = (Message.query.filter(Message.conversation_id == conversation_pk, Message.id > user_message_id)
+                 .order_by(Message.id.asc()).first())
+    if following is None or following.role != 'assistant':
+        return None
+    return following.content
+
+
+def _finished(callback_url, **values):
+    """结束任务时需要写入的字段，有回调地址时安排投递"""
+    now = datetime.utcnow()
+    values['finished_at'] = now
+    if callback_url:
+        values.update(callback_status='pending', callback_next_at=now)
+    return values
+
+
+class ChatJobExecutor:
+    """异步对话任务执行器：线程池从chat_job表领取任务执行，并投递完成回调
+
+    任务通过租约保证同一时间只有一个执行者；执行者退出后任务在租约过期后被重新执行。
+    重试是幂等的：用户消息只保存一次，回复与任务完成状态在同一事务中写入。
+    """
+
+    def __init__(self, app, workers=None, executor_id=None):
+        self.app = app
+        self.config = app.config
+        self.workers = workers or self.config['CHAT_JOBS_WORKERS']
+        self.executor_id = executor_id or f'{socket.gethostname()}:{os.getpid()}:jobs'
+        self.pid = os.getpid()
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._threads = []
+        # 正在执行的任务数，没有任务时续租线程不写数据库
+        self._running = 0
+        self._running_lock = threading.Lock()
+
+    def wake(self):
+        """有新任务时唤醒空闲的执行线程"""
+        self._wake.set()
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'chat-jobs-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._renew, name='chat-jobs-lease', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """停止领取新任务，等待进行中的任务完成；超时未完成的任务交还队列，不计入执行次数"""
+        self._stopping.set()
+        self._wake.set()
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.time()))
+        if any(thread.is_alive() for thread in self._threads):
+            # 执行线程随进程退出，之后它对任务的写入都会因租约已不属于它而放弃
+            with self.app.app_context():
+                released = leases.release_owned(ChatJob, self.executor_id)
+            self.app.logger.warning('Chat job executor %s stopped with %d jobs still running, returned them to the queue',
+                                    self.executor_id, released)
+
+    def _renew(self):
+        # 模型响应较慢时为进行中的任务续租
+        interval = self.config['CHAT_JOBS_LEASE_SECONDS'] / 3
+        while not self._stopping.wait(interval):
+            if not self._running:
+                continue
+            try:
+                with self.app.app_context():
+                    leases.renew(ChatJob, self.executor_id, self.config['CHAT_JOBS_LEASE_SECONDS'])
+                    db.session.commit()
+            except Exception:
+                self.app.logger.exception('Chat job executor failed to renew leases')
+
+    def _work(self):
+        while not self._stopping.is_set():
+            busy = False
+            try:
+                with self.app.app_context():
+                    job = leases.claim(ChatJob, [], [ChatJob.available_at.asc(), ChatJob.id.asc()],
+                                       self.executor_id, self.config['CHAT_JOBS_LEASE_SECONDS'])
+                    if job is not None:
+                        with self._running_lock:
+                            self._running += 1
+                        try:
+                            self.run_job(job)
+                        finally:
+                            with self._running_lock:
+                                self._running -= 1
+                        busy = True
+                    elif self.deliver_callback():
+                        busy = True
+            except Exception:
+                self.app.logger.exception('Chat job executor error')
+            if not busy:
+                self._wake.wait(self.config['CHAT_JOBS_POLL_SECONDS'])
+                self._wake.clear()
+
+    def run_job(self, job):
+        """执行一条已领取的任务"""
+        # 提交后对象会过期，先取出需要的字段
+        job_pk, agent_id, attempts = job.id, job.agent_id, job.attempts
+        message, conversation_id = job.message, job.conversation_id
+        new_conversation, user_message_id, callback_url = job.new_conversation, job.user_message_id, job.callback_url
+        created_at = job.created_at
+        owner = self.executor_id
+
+        if attempts > self.config['CHAT_JOBS_MAX_ATTEMPTS']:
+            # 之前的执行者在租约期内退出，且已用完执行次数
+            leases.release(ChatJob, job_pk, owner, status='failed',
+                           **_finished(callback_url, error=job.error or 'Lease expired too many times'))
+            return
+
+        try:
+            agent = db.session.get(Agent, agent_id)
+            if agent is None or agent.deleted_at:
+                raise ChatError('Agent not found')
+            check_tokens(agent.id, agent.model_id)
+            # 同一对话的任务与同步对话一起按到达顺序逐个执行
+            with conversation_turn(conversation_id):
+                conversation_id, conversation = open_conversation(agent, conversation_id, create=new_conversation)
+                conversation_pk, parent_id = conversation.id, conversation.parent_id
+
+                def mark_done(reply):
+                    done = leases.release(ChatJob, job_pk, owner, commit=False, status='done',
+                                          **_finished(callback_url, response=reply, error=None))
+                    if not done:
+                        # 回复由接管任务的执行者保存
+                        raise LeaseLost()
+
+                if user_message_id is None and attempts > 1:
+                    user_message_id = self._adopt_user_message(job_pk, conversation_pk, message, created_at)
+                elif user_message_id is not None and attempts > 1:
+                    reply = _saved_reply(conversation_pk, user_message_id)
+                    if reply is not None:
+                        # 上次执行已在分片上保存了回复，只是没能把任务标记为完成
+                        mark_done(reply)
+                        db.session.commit()
+                        return
+                if user_message_id is None:
+                    self._save_user_message(job_pk, conversation_pk, message)
+
+                complete_turn(agent, conversation_id, conversation_pk, before_commit=mark_done, parent_id=parent_id)
+        except LeaseLost:
+            db.session.rollback()
+        except Exception as e:
+            db.session.rollback()
+            self._fail(job_pk, agent_id, attempts, callback_url, e)
+
+    def _save_user_message(self, job_pk, conversation_pk, message):
+        """保存用户消息并记录到任务上，重试时不会重复保存
+
+        未启用分片时两者在同一事务中提交。启用分片时消息在智能体的分片上、任务在主库上，
+        先提交消息，记录到任务失败时删除消息；两次提交之间进程退出留下的消息由重试时的_adopt_user_message认领。
+        """
+        user_message = Message(conversation_id=conversation_pk, role='user', content=message)
+        db.session.add(user_message)
+        if current_shard() is None:
+            db.session.flush()
+            if not leases.update_held(ChatJob, job_pk, self.executor_id, user_message_id=user_message.id):
+                raise LeaseLost()
+            db.session.commit()
+            return
+        db.session.commit()
+        user_message_id = user_message.id
+        try:
+            if not leases.update_held(ChatJob, job_pk, self.executor_id, user_message_id=user_message_id):
+                raise LeaseLost()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # 通过ORM删除，同时更新统计和去重存储的引用计数
+            db.session.delete(db.session.get(Message, user_message_id))
+            db.session.commit()
+            raise
+
+    def _adopt_user_message(self, job_pk, conversation_pk, message, created_at):
+        """重试时认领上次执行已保存、但没能记录到任务上的用户消息，返回其ID，没有时返回None"""
+        latest = (Message.query.filter(Message.conversation_id == conversation_pk, Message.timestamp >= created_at)
+                  .order_by(Message.id.desc()).first())
+        if latest is None or latest.role != 'user' or latest.content != message:
+            return None
+        latest_id = latest.id
+        if not leases.update_held(ChatJob, job_pk, self.executor_id, user_message_id=latest_id):
+            raise LeaseLost()
+        db.session.commit()
+        return latest_id
+
+    def _fail(self, job_pk, agent_id, attempts, callback_url, error):
+        """任务执行失败：可重试的错误退避后重新排队，否则标记为失败"""
+        if isinstance(error, (RateLimited, ConversationBusy)):
+            # 超出token配额或对话排队已满不算一次执行，稍后重新排队
+            leases.release(ChatJob, job_pk, self.executor_id, attempts=ChatJob.attempts - 1,
+                           status='pending', available_at=datetime.utcnow() + timedelta(seconds=error.retry_after))
+            return
+        retry = not isinstance(error, ChatError) and attempts < self.config['CHAT_JOBS_MAX_ATTEMPTS']
+        if retry:
+            delay = self.config['CHAT_JOBS_RETRY_BACKOFF_SECONDS'] * attempts
+            updated = leases.release(ChatJob, job_pk, self.executor_id, commit=False, status='pending',
+                                     error=str(error), available_at=datetime.utcnow() + timedelta(seconds=delay))
+        else:
+            updated = leases.release(ChatJob, job_pk, self.executor_id, commit=False, status='failed',
+                                     **_finished(callback_url, error=str(error)))
+        if updated and db.session.get(Agent, agent_id) is not None:
+            use_agent_shard(agent_id)
+            db.session.add(AgentLog(
+                agent_id=agent_id,
+                level='warning' if retry else 'error',
+                message=f'Chat job {job_pk} attempt {attempts} failed: {error}'
+            ))
+        db.session.commit()
+
+    def deliver_callback(self):
+        """投递一条到期的完成回调，没有待投递的回调时返回False
+
+        回调至少投递一次，请求头中的Idempotency-Key为任务ID，接收方可据此去重。
+        """
+        now = datetime.utcnow()
+        timeout = self.config['CHAT_JOBS_CALLBACK_TIMEOUT_SECONDS']
+        due = (ChatJob.callback_status == 'pending', ChatJob.callback_next_at <= now)
+        # 空闲轮询只读，不拿SQLite写锁
+        with deferred_reads():
+            candidates = db.session.query(ChatJob.id).filter(*due).order_by(ChatJob.callback_next_at).limit(5).all()
+            db.session.commit()
+        for (job_pk,) in candidates:
+            # 推迟下次投递时间作为投递租约，避免多个执行者同时投递
+            claimed = db.session.execute(
+                update(ChatJob).where(ChatJob.id == job_pk, *due).values(
+                    callback_next_at=now + timedelta(seconds=timeout * 2),
+                    callback_attempts=ChatJob.callback_attempts + 1,
+                ).execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                break
+        else:
+            return False
+        # requests导入较慢，只在真正投递回调时加载
+        import requests
+
+        job = db.session.get(ChatJob, job_pk)
+        body, url, attempts = job.to_dict(), job.callback_url, job.callback_attempts
+        db.session.commit()
+        rejected = False
+        try:
+            # 提交后主机的DNS记录可能已改为内网地址，投递前重新检查；不跟随重定向
+            check_callback_url(url, self.config)
+            response = requests.post(url, json=body, timeout=timeout, allow_redirects=False,
+                                     headers={'Idempotency-Key': body['job_id']})
+            delivered = response.ok
+        except CallbackRejected as e:
+            self.app.logger.warning('Chat job %s callback rejected: %s', body['job_id'], e)
+            delivered, rejected = False, True
+        except requests.exceptions.RequestException:
+            delivered = False
+
+        if delivered:
+            values = {'callback_status': 'delivered', 'callback_next_at': None}
+        elif rejected:
+            values = {'callback_status': 'failed', 'callback_next_at': None}
+        elif attempts >= self.config['CHAT_JOBS_CALLBACK_ATTEMPTS']:
+            values = {'callback_status': 'failed', 'callback_next_at': None}
+        else:
+            # 指数退避：2、4、8……秒
+            values = {'callback_next_at': datetime.utcnow() + timedelta(seconds=2 ** attempts)}
+        db.session.execute(update(ChatJob).where(ChatJob.id == job_pk).values(**values)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+        return True
+
+
+def start_embedded_executor(app):
+    """before_request钩子：在当前进程中启动内嵌执行器
+
+    在首个请求时启动而不是在create_app()中，预fork部署时每个工作进程各自启动执行线程。
+    """
+    executor = app.extensions.get('chat_jobs')
+    if executor is not None and executor.pid == os.getpid():
+        return
+    with _start_lock:
+        executor = app.extensions.get('chat_jobs')
+        if executor is not None and executor.pid == os.getpid():
+            return
+        executor = ChatJobExecutor(app)
+        executor.start()
+        app.extensions['chat_jobs'] = executor
+        # 开发服务器等没有worker_exit钩子的进程，在解释器退出时停止执行器
+        atexit.register(stop_embedded_executor, app, app.config['CHAT_JOBS_SHUTDOWN_SECONDS'])
+
+
+def stop_embedded_executor(app, timeout):
+    """停止当前进程中的内嵌执行器（工作进程回收或退出时调用），最多等待timeout秒"""
+    executor = app.extensions.get('chat_jobs')
+    if executor is None or executor.pid != os.getpid():
+        return
+    with _start_lock:
+        if app.extensions.get('chat_jobs') is not executor:
+            return
+        del app.extensions['chat_jobs']
+    executor.stop(timeout=timeout)
+
+
+def configure_chat_jobs(app):
+    """配置执行器：embedded模式下随Web进程启动"""
+    if app.config['CHAT_JOBS_EXECUTOR'] == 'embedded':
+        app.before_request(lambda: start_embedded_executor(app))
+
+
+def run(app, workers=None, shutdown_timeout=None):
+    """在当前进程中运行独立的执行器，直到收到SIGTERM或SIGINT"""
+    executor = ChatJobExecutor(app, workers=workers)
+    stopped = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stopped.set())
+    executor.start()
+    app.logger.info('Chat job executor %s started with %d workers', executor.executor_id, executor.workers)
+    stopped.wait()
+    executor.stop(timeout=shutdown_timeout)
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, update
+
+from models import db
+from sqlite_profile import deferred_reads
+
+# 每次领取时查看的候选行数，候选被其他执行者抢走时继续尝试下一个
+CLAIM_CANDIDATES = 5
+
+
+def claimable(model, now):
+    """可领取的行：到期的待执行行，或租约已过期的行（model需包含status/available_at/lease_*字段）"""
+    return or_(
+        and_(model.status == 'pending', model.available_at <= now),
+        and_(model.status == 'leased', model.lease_expires_at < now),
+    )
+
+
+def claim(model, criteria, order_by, owner, lease_seconds):
+    """按order_by顺序领取一行并加租约，没有可领取的行时返回None
+
+    先查出候选行，再用带条件的UPDATE抢占租约；多个执行者并发领取同一行时只有一个能更新成功。
+    候选查询在只读事务中执行，没有可领取的行时空闲轮询不拿SQLite写锁。
+    """
+    now = datetime.utcnow()
+    with deferred_reads():
+        candidates = db.session.query(model.id).filter(*criteria, claimable(model, now)) \
+            .order_by(*order_by).limit(CLAIM_CANDIDATES).all()
+        db.session.commit()
+    for (row_id,) in candidates:
+        claimed = db.session.execute(
+            update(model).where(model.id == row_id, claimable(model, now)).values(
+                status='leased',
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=model.attempts + 1,
+                started_at=now,
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(model, row_id)
+    return None
+
+
+def release_owned(model, owner):
+    """把owner仍持有租约的行交还队列（不计入执行次数）并提交，返回交还的行数
+
+    执行者退出时调用：租约不必等到过期，行可以立即由其他执行者领取。
+    """
+    released = db.session.execute(
+        update(model).where(model.lease_owner == owner, model.status == 'leased').values(
+            status='pending',
+            lease_owner=None,
+            lease_expires_at=None,
+            attempts=model.attempts - 1,
+            available_at=datetime.utcnow(),
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return released
+
+
+def update_held(model, row_id, owner, **values):
+    """更新仍由owner持有租约的行（不提交）；租约已被其他执行者接管时不做修改，返回是否更新成功"""
+    updated = db.session.execute(
+        update(model).where(model.id == row_id, model.lease_owner == owner, model.status == 'leased')
+        .values(**values).execution_options(synchronize_session=False)
+    ).rowcount
+    return bool(updated)
+
+
+def release(model, row_id, owner, commit=True, **values):
+    """更新仍由owner持有租约的行并释放租约，返回是否更新成功"""
+    updated = update_held(model, row_id, owner, lease_owner=None, lease_expires_at=None, **values)
+    if commit:
+        db.session.commit()
+    return updated
+
+
+def renew(model, owner, lease_seconds):
+    """为owner持有的所有租约续期（不提交）"""
+    db.session.execute(
+        update(model).where(model.lease_owner == owner, model.status == 'leased')
+        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,170 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# 各类直方图的桶边界
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def load_metrics_config(app, environ):
+    """从环境变量读取请求指标配置"""
+    app.config['METRICS_ENABLED'] = environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+    # 在响应中附加Server-Timing头，浏览器开发者工具可直接查看各阶段耗时
+    app.config['SERVER_TIMING_ENABLED'] = environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+
+
+class Histogram:
+    """按标签分组的直方图，输出Prometheus文本格式"""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # 标签值 -> [各桶计数..., +Inf计数, 总和]
+
+    def observe(self, label_values, value):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self.series.items()):
+            labels = ','.join(f'{key}="{value}"' for key, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    """按标签分组的计数器"""
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self.series.items()):
+            labels = ','.join(f'{key}="{value}"' for key, value in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return lines
+
+
+ENDPOINT_LABELS = ('namespace', 'endpoint', 'method')
+
+_lock = threading.Lock()
+REQUESTS = Counter('http_requests_total', 'HTTP请求数', ENDPOINT_LABELS + ('status',))
+REQUEST_DURATION = Histogram('http_request_duration_seconds', '请求总耗时', ENDPOINT_LABELS, DURATION_BUCKETS)
+SQL_STATEMENTS = Histogram('http_request_sql_statements', '每个请求执行的SQL语句数', ENDPOINT_LABELS, COUNT_BUCKETS)
+SQL_DURATION = Histogram('http_request_sql_duration_seconds', '每个请求的SQL耗时', ENDPOINT_LABELS, DURATION_BUCKETS)
+UPSTREAM_DURATION = Histogram('http_request_upstream_duration_seconds', '每个请求调用模型API的耗时',
+                              ENDPOINT_LABELS, DURATION_BUCKETS)
+REQUEST_SIZE = Histogram('http_request_size_bytes', '请求体大小', ENDPOINT_LABELS, SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram('http_response_size_bytes', '响应体大小', ENDPOINT_LABELS, SIZE_BUCKETS)
+METRICS = [REQUESTS, REQUEST_DURATION, SQL_STATEMENTS, SQL_DURATION, UPSTREAM_DURATION, REQUEST_SIZE, RESPONSE_SIZE]
+
+
+def _endpoint_labels():
+    """当前请求的命名空间、端点和方法"""
+    rule = request.url_rule.rule if request.url_rule else ''
+    parts = rule.split('/')
+    # /api/<namespace>/... 取命名空间，其余路由归为根路径
+    namespace = parts[2] if len(parts) > 2 and parts[1] == 'api' else ''
+    return (namespace, request.endpoint or 'unknown', request.method)
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql_count = 0
+    g.metrics_sql_time = 0.0
+    g.metrics_upstream_time = 0.0
+
+
+def _finish_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    labels = _endpoint_labels()
+    with _lock:
+        REQUESTS.inc(labels + (str(response.status_code),))
+        REQUEST_DURATION.observe(labels, total)
+        SQL_STATEMENTS.observe(labels, g.metrics_sql_count)
+        SQL_DURATION.observe(labels, g.metrics_sql_time)
+        UPSTREAM_DURATION.observe(labels, g.metrics_upstream_time)
+        REQUEST_SIZE.observe(labels, request.content_length or 0)
+        RESPONSE_SIZE.observe(labels, response.calculate_content_length() or 0)
+
+    if current_app.config.get('SERVER_TIMING_ENABLED'):
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={g.metrics_sql_time * 1000:.1f};desc="{g.metrics_sql_count} queries"',
+            f'upstream;dur={g.metrics_upstream_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['metrics_query_start'].pop()
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_sql_count += 1
+        g.metrics_sql_time += time.perf_counter() - start
+
+
+@contextmanager
+def upstream_timer():
+    """统计代码块中调用模型API的耗时，计入当前请求"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_upstream_time += time.perf_counter() - start
+
+
+def metrics_view():
+    """Prometheus格式的指标（每个工作进程单独统计）"""
+    with _lock:
+        lines = []
+        for metric in METRICS:
+            lines.extend(metric.render())
+    lines.append(f'# pid {os.getpid()}')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def configure_metrics(app, db):
+    """注册请求钩子、SQL事件和/metrics端点，需要在应用上下文中调用"""
+    if not app.config.get('METRICS_ENABLED'):
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    for engine in db.engines.values():
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
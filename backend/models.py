@@ -1,8 +1,11 @@
+import json
+
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from db_routing import RoutingSession
 
-# 初始化SQLAlchemy
-db = SQLAlchemy()
+# 初始化SQLAlchemy（使用读写分离会话）
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Model(db.Model):
     """模型数据模型（Ollama模型，支持OpenAI接口标准）"""
@@ -39,6 +42,10 @@ class Agent(db.Model):
     description = db.Column(db.Text, nullable=True)
     model_id = db.Column(db.Integer, db.ForeignKey('model.id'), nullable=False)
     status = db.Column(db.String(20), default='inactive')  # inactive, running, paused, stopped
+    deleted_at = db.Column(db.DateTime, nullable=True)  # 软删除时间，数据由后台删除任务分批清理
+    # 对话、消息和日志所在的分片（bind键），为空时在主库；由shards在创建时按一致性哈希分配
+    shard = db.Column(db.String(50), nullable=True)
+    shard_moving_to = db.Column(db.String(50), nullable=True)  # 正在迁移到的分片，迁移期间不能开始新的对话轮次
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -64,10 +71,10 @@ class Agent(db.Model):
 class AgentLog(db.Model):
     """智能体日志数据模型"""
     id = db.Column(db.Integer, primary_key=True)
-    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False)
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False, index=True)
     level = db.Column(db.String(20), nullable=False)  # info, warning, error, debug
     message = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # 建立与Agent的关系
     agent = db.relationship('Agent', backref=db.backref('logs', lazy=True))
@@ -88,10 +95,18 @@ class AgentLog(db.Model):
 class Conversation(db.Model):
     """对话数据模型"""
     id = db.Column(db.Integer, primary_key=True)
-    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False)
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False, index=True)
     conversation_id = db.Column(db.String(100), nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # 软删除时间，消息由后台删除任务分批清理
+    # 消息数和最后一条消息的时间，与消息在同一事务中由stats维护
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    # 分叉出的对话引用父对话历史的前fork_point条消息，不复制；message_count只计本对话自己的消息。
+    # 父对话与子对话在同一个分片上，不建外键，删除任务可以按任意顺序分批删除对话
+    parent_id = db.Column(db.Integer, nullable=True, index=True)
+    fork_point = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # 新消息写入时更新
     
     # 建立与Agent的关系
     agent = db.relationship('Agent', backref=db.backref('conversations', lazy=True))
@@ -105,20 +120,60 @@ class Conversation(db.Model):
             'id': self.id,
             'agent_id': self.agent_id,
             'conversation_id': self.conversation_id,
+            # 历史的消息数，含从父对话共享的消息
+            'message_count': (self.fork_point or 0) + self.message_count,
+            'parent_id': self.parent_id,
+            'fork_point': self.fork_point or 0,
+            'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
 
+class MessageContent(db.Model):
+    """消息内容数据模型（按内容哈希去重存储，多条消息共享同一份内容）"""
+    hash = db.Column(db.String(64), primary_key=True)  # 内容的SHA-256
+    data = db.Column(db.LargeBinary, nullable=False)
+    compressed = db.Column(db.Boolean, nullable=False, default=False)  # data是否经过zlib压缩
+    size = db.Column(db.Integer, nullable=False)  # 原始内容的字节数
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # 引用该内容的消息数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<MessageContent {self.hash[:12]} ({self.ref_count} refs)>'
+    
+    @property
+    def text(self):
+        """还原后的消息内容"""
+        from content_store import decode
+        return decode(self.data, self.compressed)
+
 class Message(db.Model):
     """消息数据模型"""
     id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False, index=True)
     role = db.Column(db.String(20), nullable=False)  # user, assistant
-    content = db.Column(db.Text, nullable=False)
+    # 未启用去重时内容直接保存在这里，启用后为空字符串，内容通过content_hash引用
+    _content = db.Column('content', db.Text, nullable=False)
+    content_hash = db.Column(db.String(64), db.ForeignKey('message_content.hash'), nullable=True, index=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     # 建立与Conversation的关系
     conversation = db.relationship('Conversation', backref=db.backref('messages', lazy=True))
+    # 去重存储的内容随消息一起加载，避免逐条查询
+    content_blob = db.relationship('MessageContent', lazy='joined')
+    
+    @property
+    def content(self):
+        """消息内容，对去重存储透明"""
+        if self.content_hash is not None:
+            return self.content_blob.text
+        return self._content
+    
+    @content.setter
+    def content(self, value):
+        # 启用去重时，在flush前由content_store写入去重存储
+        self._content = value
+        self.content_hash = None
     
     def __repr__(self):
         return f'<Message {self.role}: {self.content[:50]}>'
@@ -186,3 +241,260 @@ class User(db.Model):
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
+
+class ArchivedConversation(db.Model):
+    """归档对话数据模型（冷存储，对话及其消息压缩后保存）"""
+    id = db.Column(db.Integer, primary_key=True)
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False)
+    conversation_id = db.Column(db.String(100), nullable=False, index=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    storage = db.Column(db.String(20), nullable=False, default='db')  # db, file
+    payload = db.Column(db.LargeBinary, nullable=True)  # storage为db时保存zlib压缩的JSON
+    location = db.Column(db.String(255), nullable=True)  # storage为file时保存文件路径
+    created_at = db.Column(db.DateTime, nullable=False)  # 原对话的创建时间
+    last_activity_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ArchivedConversation {self.conversation_id} ({self.message_count} messages)>'
+
+class AgentTask(db.Model):
+    """智能体任务数据模型（持久化任务队列，由运行时按优先级租用执行）"""
+    id = db.Column(db.Integer, primary_key=True)
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=0)  # 数值越大越先执行
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, leased, done, failed, cancelled
+    payload = db.Column(db.Text, nullable=False)  # JSON：{"message": ..., "conversation_id": ...}
+    result = db.Column(db.Text, nullable=True)  # JSON：{"conversation_id": ..., "response": ...}
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    lease_owner = db.Column(db.String(100), nullable=True)  # 持有租约的运行时
+    lease_expires_at = db.Column(db.DateTime, nullable=True)  # 租约过期后任务可被其他运行时重新领取
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # 重试退避期间不会被领取
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    # 领取任务时按状态、智能体和优先级查找
+    __table_args__ = (db.Index('ix_agent_task_claim', 'status', 'agent_id', 'priority', 'id'),)
+    
+    def __repr__(self):
+        return f'<AgentTask {self.id} ({self.status})>'
+    
+    def to_dict(self):
+        """转换为字典格式，用于API响应"""
+        return {
+            'id': self.id,
+            'agent_id': self.agent_id,
+            'priority': self.priority,
+            'status': self.status,
+            'payload': json.loads(self.payload),
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class AgentRuntimeState(db.Model):
+    """智能体运行状态（各运行时进程定期上报的心跳和吞吐量）"""
+    id = db.Column(db.Integer, primary_key=True)
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False)
+    runtime_id = db.Column(db.String(100), nullable=False)  # 主机名:进程号
+    state = db.Column(db.String(20), nullable=False)  # running, paused, stopped
+    active_tasks = db.Column(db.Integer, nullable=False, default=0)
+    tasks_completed = db.Column(db.Integer, nullable=False, default=0)
+    tasks_failed = db.Column(db.Integer, nullable=False, default=0)
+    throughput_per_minute = db.Column(db.Float, nullable=False, default=0)  # 最近一分钟完成的任务数
+    last_task_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('agent_id', 'runtime_id'),)
+    
+    def __repr__(self):
+        return f'<AgentRuntimeState agent={self.agent_id} {self.runtime_id} ({self.state})>'
+    
+    def to_dict(self):
+        """转换为字典格式，用于API响应"""
+        return {
+            'agent_id': self.agent_id,
+            'runtime_id': self.runtime_id,
+            'state': self.state,
+            'active_tasks': self.active_tasks,
+            'tasks_completed': self.tasks_completed,
+            'tasks_failed': self.tasks_failed,
+            'throughput_per_minute': self.throughput_per_minute,
+            'last_task_at': self.last_task_at.isoformat() if self.last_task_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat()
+        }
+
+class ChatJob(db.Model):
+    """异步对话任务数据模型（提交后立即返回，由后台执行器执行，可轮询结果或回调通知）"""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(36), unique=True, nullable=False)  # 对外公开的任务ID（UUID）
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), nullable=False)
+    idempotency_key = db.Column(db.String(255), nullable=True)  # 客户端提供，重复提交时返回同一个任务
+    message = db.Column(db.Text, nullable=False)
+    conversation_id = db.Column(db.String(100), nullable=False)  # 提交时确定，新对话预先分配ID
+    new_conversation = db.Column(db.Boolean, nullable=False, default=False)
+    user_message_id = db.Column(db.Integer, nullable=True)  # 已保存的用户消息，重试时不再重复保存
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, leased, done, failed
+    response = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    callback_url = db.Column(db.String(2048), nullable=True)  # 任务结束后POST结果到该地址
+    callback_status = db.Column(db.String(20), nullable=True)  # pending, delivered, failed
+    callback_attempts = db.Column(db.Integer, nullable=False, default=0)
+    callback_next_at = db.Column(db.DateTime, nullable=True)  # 下次投递回调的时间，投递中时兼作租约
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('agent_id', 'idempotency_key'),
+        db.Index('ix_chat_job_claim', 'status', 'available_at'),
+        db.Index('ix_chat_job_callback', 'callback_status', 'callback_next_at'),
+    )
+    
+    def __repr__(self):
+        return f'<ChatJob {self.job_id} ({self.status})>'
+    
+    def to_dict(self):
+        """转换为字典格式，用于API响应和回调"""
+        return {
+            'job_id': self.job_id,
+            'agent_id': self.agent_id,
+            'conversation_id': self.conversation_id,
+            'status': self.status,
+            'response': self.response,
+            'error': self.error,
+            'attempts': self.attempts,
+            'callback_url': self.callback_url,
+            'callback_status': self.callback_status,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class ModelWarmState(db.Model):
+    """模型预热状态（由预热管理器维护，运行中的智能体引用的模型保持驻留内存）"""
+    # 不设外键：模型删除后由预热管理器清理对应的行
+    model_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    state = db.Column(db.String(20), nullable=False, default='cold')  # cold, warming, warm, error
+    last_loaded_at = db.Column(db.DateTime, nullable=True)
+    load_seconds = db.Column(db.Float, nullable=True)  # 最近一次从冷状态加载的耗时
+    last_ping_at = db.Column(db.DateTime, nullable=True)
+    next_ping_at = db.Column(db.DateTime, nullable=True)  # 下次keep-alive时间，加载中时兼作租约
+    error = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ModelWarmState model={self.model_id} ({self.state})>'
+    
+    def to_dict(self):
+        """转换为字典格式，用于API响应"""
+        return {
+            'model_id': self.model_id,
+            'state': self.state,
+            'last_loaded_at': self.last_loaded_at.isoformat() if self.last_loaded_at else None,
+            'load_seconds': self.load_seconds,
+            'last_ping_at': self.last_ping_at.isoformat() if self.last_ping_at else None,
+            'next_ping_at': self.next_ping_at.isoformat() if self.next_ping_at else None,
+            'error': self.error
+        }
+
+class DeletionJob(db.Model):
+    """后台删除任务（智能体或对话软删除后，由删除执行器分批删除其数据）"""
+    id = db.Column(db.Integer, primary_key=True)
+    target_type = db.Column(db.String(20), nullable=False)  # agent, conversation, agent_data（迁移后留在原分片的数据）
+    target_id = db.Column(db.Integer, nullable=False)  # Agent.id或Conversation.id
+    shard = db.Column(db.String(50), nullable=True)  # 目标数据所在的分片，为空时在主库
+    label = db.Column(db.String(255), nullable=True)  # 智能体名称或对话ID，目标删除后仍可识别
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, leased, done, failed
+    phase = db.Column(db.String(50), nullable=True)  # 正在删除的数据，例如messages、logs
+    total_rows = db.Column(db.Integer, nullable=False, default=0)  # 开始删除时统计的待删除行数
+    deleted_rows = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (db.Index('ix_deletion_job_claim', 'status', 'available_at'),)
+    
+    def __repr__(self):
+        return f'<DeletionJob {self.target_type} {self.target_id} ({self.status})>'
+    
+    def to_dict(self):
+        """转换为字典格式，用于API响应"""
+        return {
+            'id': self.id,
+            'target_type': self.target_type,
+            'target_id': self.target_id,
+            'label': self.label,
+            'status': self.status,
+            'phase': self.phase,
+            'total_rows': self.total_rows,
+            'deleted_rows': self.deleted_rows,
+            'progress': round(min(1.0, self.deleted_rows / self.total_rows), 4) if self.total_rows else None,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class AgentStats(db.Model):
+    """智能体统计（对话数、消息数、各级别日志数和最后活动时间），与对应的写入在同一事务中由stats维护"""
+    # 不设外键：计数在flush后以批量语句更新，智能体删除后由删除执行器清理对应的行
+    agent_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    conversation_count = db.Column(db.Integer, nullable=False, default=0)  # 未删除的对话数
+    message_count = db.Column(db.Integer, nullable=False, default=0)  # 未删除的对话中的消息数
+    log_count = db.Column(db.Integer, nullable=False, default=0)
+    info_log_count = db.Column(db.Integer, nullable=False, default=0)
+    warning_log_count = db.Column(db.Integer, nullable=False, default=0)
+    error_log_count = db.Column(db.Integer, nullable=False, default=0)
+    debug_log_count = db.Column(db.Integer, nullable=False, default=0)
+    last_activity_at = db.Column(db.DateTime, nullable=True)  # 最后一条消息或日志的时间
+    
+    def __repr__(self):
+        return f'<AgentStats agent={self.agent_id} ({self.message_count} messages)>'
+    
+    def to_dict(self):
+        """转换为字典格式，用于API响应"""
+        return {
+            'agent_id': self.agent_id,
+            'conversation_count': self.conversation_count,
+            'message_count': self.message_count,
+            'log_count': self.log_count,
+            'log_counts': {
+                'info': self.info_log_count,
+                'warning': self.warning_log_count,
+                'error': self.error_log_count,
+                'debug': self.debug_log_count
+            },
+            'last_activity_at': self.last_activity_at.isoformat() if self.last_activity_at else None
+        }
+
+class ConversationTurn(db.Model):
+    """对话轮次排队（同一对话的轮次按ID顺序逐个执行，跨工作进程有效）"""
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.String(100), nullable=False)  # Conversation.conversation_id
+    owner = db.Column(db.String(100), nullable=False)  # 排队的进程：主机名:进程号
+    expires_at = db.Column(db.DateTime, nullable=False)  # 租约，由所属进程定期续期，进程退出后过期的行被跳过
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_conversation_turn_queue', 'conversation_id', 'id'),
+        db.Index('ix_conversation_turn_expires', 'expires_at'),
+    )
+    
+    def __repr__(self):
+        return f'<ConversationTurn {self.conversation_id} #{self.id}>'
@@ -0,0 +1,103 @@
+import re
+from functools import wraps
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import event
+
+# 事务控制语句不计入预算
+_IGNORED_PREFIXES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(Exception):
+    """资源方法执行的SQL语句超出预算，或出现N+1查询"""
+
+
+def load_query_budget_config(app, environ):
+    """从环境变量读取查询预算配置"""
+    # off：不检查；warn：记录警告日志（开发模式）；raise：抛出异常（测试/CI）
+    app.config['QUERY_BUDGET_MODE'] = environ.get('QUERY_BUDGET_MODE', 'off')
+    # 同一形状的语句以不同参数执行达到该次数时视为N+1查询
+    app.config['QUERY_BUDGET_REPEAT_THRESHOLD'] = int(environ.get('QUERY_BUDGET_REPEAT_THRESHOLD', '3'))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+    recorder = g.get('query_budget_recorder')
+    if recorder is None or statement.lstrip().upper().startswith(_IGNORED_PREFIXES):
+        return
+    recorder.append((_WHITESPACE.sub(' ', statement).strip(), repr(parameters)))
+
+
+def _repeated_shapes(statements, threshold):
+    """找出以不同参数重复执行的语句形状"""
+    variants = {}
+    for shape, parameters in statements:
+        variants.setdefault(shape, set()).add(parameters)
+    return {shape: len(params) for shape, params in variants.items() if len(params) >= threshold}
+
+
+def _report(name, budget, statements):
+    """按配置的模式报告超出预算和N+1查询"""
+    config = current_app.config
+    problems = []
+    if len(statements) > budget:
+        problems.append(f'{name} issued {len(statements)} SQL statements, budget is {budget}')
+    repeated = _repeated_shapes(statements, config['QUERY_BUDGET_REPEAT_THRESHOLD'])
+    for shape, count in repeated.items():
+        problems.append(f'{name} ran the same statement {count} times with different parameters '
+                        f'(possible N+1): {shape[:200]}')
+    if not problems:
+        return
+    if config['QUERY_BUDGET_MODE'] == 'raise':
+        raise QueryBudgetExceeded('; '.join(problems))
+    for problem in problems:
+        current_app.logger.warning(problem)
+
+
+def query_budget(max_statements):
+    """资源方法装饰器：声明该方法最多可以执行的SQL语句数"""
+    def decorator(method):
+        name = method.__qualname__
+
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if current_app.config.get('QUERY_BUDGET_MODE', 'off') == 'off':
+                return method(*args, **kwargs)
+            outer = g.get('query_budget_recorder')
+            g.query_budget_recorder = statements = []
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                g.query_budget_recorder = outer
+                if outer is not None:
+                    outer.extend(statements)
+            _report(name, max_statements, statements)
+            return result
+        wrapper.query_budget = max_statements
+        return wrapper
+    return decorator
+
+
+def exempt_from_query_budget(function):
+    """装饰器：函数内执行的语句不计入外层资源方法的预算（用于归档恢复等批量但少见的路径）"""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not has_request_context():
+            return function(*args, **kwargs)
+        outer = g.get('query_budget_recorder')
+        g.query_budget_recorder = None
+        try:
+            return function(*args, **kwargs)
+        finally:
+            g.query_budget_recorder = outer
+    return wrapper
+
+
+def configure_query_budget(app, db):
+    """为所有引擎注册语句记录，需要在应用上下文中调用"""
+    if app.config.get('QUERY_BUDGET_MODE', 'off') == 'off':
+        return
+    for engine in db.engines.values():
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
@@ -0,0 +1,317 @@
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context, jsonify, request
+
+# 限流的作用域：全局、用户（网关设置的用户请求头，没有时按客户端地址）、智能体、模型
+SCOPES = ('global', 'user', 'agent', 'model')
+# 智能体到模型的映射缓存时间（秒），避免每个请求都查询数据库
+AGENT_MODEL_CACHE_SECONDS = 60
+# 智能体到模型的映射缓存的最大条目数，超过时丢弃最久未使用的条目
+AGENT_MODEL_CACHE_SIZE = 10000
+# SQLite存储清理已补满的令牌桶的间隔（秒）
+SWEEP_SECONDS = 60
+
+
+class RateLimited(Exception):
+    """超出限流，retry_after为建议的重试等待秒数"""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f'Rate limit exceeded ({scope})')
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+def load_rate_limit_config(app, environ):
+    """从环境变量读取限流配置，各项为0表示不限制"""
+    app.config['RATE_LIMIT_ENABLED'] = environ.get('RATE_LIMIT_ENABLED', 'false').lower() == 'true'
+    # memory：进程内；sqlite：同一主机上的所有工作进程共享
+    app.config['RATE_LIMIT_STORE'] = environ.get('RATE_LIMIT_STORE', 'memory')
+    app.config['RATE_LIMIT_SQLITE_PATH'] = environ.get(
+        'RATE_LIMIT_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'agent-platform-ratelimit.sqlite3'))
+    # 每秒请求数的桶容量为多少秒的配额，允许短时突发
+    app.config['RATE_LIMIT_BURST_SECONDS'] = float(environ.get('RATE_LIMIT_BURST_SECONDS', '1'))
+    # 认证网关设置的用户标识请求头，网关必须覆盖客户端发来的同名请求头；为空时按客户端地址限流
+    app.config['RATE_LIMIT_USER_HEADER'] = environ.get('RATE_LIMIT_USER_HEADER', '')
+    # memory存储最多保留的令牌桶数，超过时丢弃最久未使用的桶
+    app.config['RATE_LIMIT_MAX_BUCKETS'] = int(environ.get('RATE_LIMIT_MAX_BUCKETS', '100000'))
+    for scope in SCOPES:
+        key = scope.upper()
+        app.config[f'RATE_LIMIT_{key}_RPS'] = float(environ.get(f'RATE_LIMIT_{key}_RPS', '0'))
+        app.config[f'RATE_LIMIT_{key}_TPM'] = float(environ.get(f'RATE_LIMIT_{key}_TPM', '0'))
+
+
+def _full_at(level, rate, capacity, now):
+    """令牌桶补满的时间，补满的桶与不存在的桶等价，可以删除"""
+    return now + max(0.0, capacity - level) / rate
+
+
+class MemoryStore:
+    """进程内的令牌桶存储
+
+    桶按最近更新的顺序排列，每次更新后从最久未更新的一端删除已补满的桶；
+    桶数超过max_buckets时丢弃最久未使用的桶（相当于把它补满）。
+    """
+
+    def __init__(self, max_buckets=100000):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated, full_at)
+        self._max_buckets = max(1, max_buckets)
+
+    def _level(self, key, rate, capacity, now):
+        tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+        return min(capacity, tokens + (now - updated) * rate)
+
+    def _save(self, buckets, levels, now):
+        for level, (key, rate, capacity, _) in zip(levels, buckets):
+            self._buckets[key] = (level, now, _full_at(level, rate, capacity, now))
+            self._buckets.move_to_end(key)
+        while self._buckets:
+            _, (_, _, full_at) = next(iter(self._buckets.items()))
+            if full_at > now and len(self._buckets) <= self._max_buckets:
+                break
+            self._buckets.popitem(last=False)
+
+    def acquire(self, buckets):
+        """buckets为[(key, rate, capacity, cost)]，全部满足时一起扣减，返回各桶扣减后的令牌数和是否允许"""
+        now = time.time()
+        with self._lock:
+            levels = [self._level(key, rate, capacity, now) for key, rate, capacity, cost in buckets]
+            allowed = all(_satisfies(level, cost) for level, (_, _, _, cost) in zip(levels, buckets))
+            if allowed:
+                levels = [level - cost for level, (_, _, _, cost) in zip(levels, buckets)]
+            self._save(buckets, levels, now)
+        return levels, allowed
+
+    def debit(self, buckets):
+        """扣减实际消耗，令牌数可以为负（欠账在补充前拒绝后续请求），最多欠一个桶容量"""
+        now = time.time()
+        with self._lock:
+            levels = [max(-capacity, self._level(key, rate, capacity, now) - cost)
+                      for key, rate, capacity, cost in buckets]
+            self._save(buckets, levels, now)
+
+
+class SQLiteStore:
+    """保存在本地SQLite文件中的令牌桶，同一主机上的多个工作进程共享同一组桶
+
+    每个进程每SWEEP_SECONDS秒删除一次已补满的桶。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._swept = 0.0
+
+    @property
+    def connection(self):
+        # 每个线程使用独立的连接，自行管理事务
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS token_bucket '
+                               '(key TEXT PRIMARY KEY, tokens REAL, updated REAL, full_at REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_token_bucket_full_at ON token_bucket (full_at)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _update(self, buckets, settle):
+        connection = self.connection
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            for key, rate, capacity, cost in buckets:
+                row = connection.execute('SELECT tokens, updated FROM token_bucket WHERE key = ?',
+                                         (key,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                levels.append(min(capacity, tokens + (now - updated) * rate))
+            levels, result = settle(levels)
+            connection.executemany(
+                'INSERT OR REPLACE INTO token_bucket (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                [(key, level, now, _full_at(level, rate, capacity, now))
+                 for level, (key, rate, capacity, _) in zip(levels, buckets)])
+            if now - self._swept >= SWEEP_SECONDS:
+                self._swept = now
+                connection.execute('DELETE FROM token_bucket WHERE full_at <= ?', (now,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return levels, result
+
+    def acquire(self, buckets):
+        def settle(levels):
+            allowed = all(_satisfies(level, cost) for level, (_, _, _, cost) in zip(levels, buckets))
+            if allowed:
+                levels = [level - cost for level, (_, _, _, cost) in zip(levels, buckets)]
+            return levels, allowed
+        return self._update(buckets, settle)
+
+    def debit(self, buckets):
+        def settle(levels):
+            return [max(-capacity, level - cost) for level, (_, _, capacity, cost) in zip(levels, buckets)], None
+        self._update(buckets, settle)
+
+
+def _satisfies(level, cost):
+    # cost为0时只检查是否欠账（用于模型调用前检查token配额）
+    return level >= cost if cost else level > 0
+
+
+def _store():
+    return current_app.extensions['rate_limit_store']
+
+
+def _agent_model_id(agent_id):
+    """智能体所用的模型ID（进程内LRU缓存，只缓存存在的智能体，路径中任意的agent_id不会撑大缓存）"""
+    from models import db, Agent
+
+    cache, lock = current_app.extensions['rate_limit_agent_models']
+    now = time.time()
+    with lock:
+        cached = cache.get(agent_id)
+        if cached and cached[1] > now:
+            cache.move_to_end(agent_id)
+            return cached[0]
+    model_id = db.session.query(Agent.model_id).filter_by(id=agent_id).scalar()
+    if model_id is not None:
+        with lock:
+            cache[agent_id] = (model_id, now + AGENT_MODEL_CACHE_SECONDS)
+            cache.move_to_end(agent_id)
+            while len(cache) > AGENT_MODEL_CACHE_SIZE:
+                cache.popitem(last=False)
+    return model_id
+
+
+def user_identity():
+    """当前请求的用户标识：网关设置的用户请求头，没有时按客户端地址
+
+    客户端自己发来的请求头不可信，限流和幂等键都按这个标识隔离。
+    """
+    header = current_app.config.get('RATE_LIMIT_USER_HEADER')
+    user = request.headers.get(header) if header else None
+    return user or f'client-{request.remote_addr}'
+
+
+def _identities(agent_id=None, model_id=None):
+    """各作用域在当前上下文中的标识，无法确定的作用域不参与限流"""
+    identities = {'global': 'all'}
+    if has_request_context():
+        identities['user'] = user_identity()
+    if agent_id is not None:
+        identities['agent'] = agent_id
+        if model_id is None:
+            model_id = _agent_model_id(agent_id)
+    if model_id is not None:
+        identities['model'] = model_id
+    return identities
+
+
+def _token_buckets(identities, cost):
+    """各作用域每分钟token数的令牌桶"""
+    config = current_app.config
+    buckets = []
+    for scope, identity in identities.items():
+        limit = config[f'RATE_LIMIT_{scope.upper()}_TPM']
+        if limit:
+            buckets.append((f'tpm:{scope}:{identity}', limit / 60, limit, cost))
+    return buckets
+
+
+def check_tokens(agent_id, model_id=None):
+    """调用模型前检查token配额，任一作用域欠账时抛出RateLimited"""
+    if not current_app.config.get('RATE_LIMIT_ENABLED'):
+        return
+    buckets = _token_buckets(_identities(agent_id, model_id), 0)
+    if not buckets:
+        return
+    levels, allowed = _store().acquire(buckets)
+    if not allowed:
+        scope, retry_after = _blocking(buckets, levels)
+        raise RateLimited(scope, retry_after)
+
+
+def record_tokens(agent_id, model_id, tokens):
+    """记录一次模型调用实际消耗的token数"""
+    if not current_app.config.get('RATE_LIMIT_ENABLED') or not tokens:
+        return
+    buckets = _token_buckets(_identities(agent_id, model_id), tokens)
+    if buckets:
+        _store().debit(buckets)
+
+
+def _blocking(buckets, levels):
+    """未满足的桶中需要等待最久的作用域和等待秒数"""
+    waits = []
+    for level, (key, rate, _, cost) in zip(levels, buckets):
+        if not _satisfies(level, cost):
+            # 欠账时需要补充到正数，请求时需要补充到cost
+            waits.append(((max(cost, 1e-6) - level) / rate, key.split(':')[1]))
+    retry_after, scope = max(waits)
+    return scope, retry_after
+
+
+def _before_request():
+    """按各作用域的每秒请求数限流，超出时返回429"""
+    if not request.path.startswith('/api/'):
+        return None
+    config = current_app.config
+    view_args = request.view_args or {}
+    identities = _identities(view_args.get('agent_id'), view_args.get('model_id'))
+    buckets = []
+    for scope, identity in identities.items():
+        rps = config[f'RATE_LIMIT_{scope.upper()}_RPS']
+        if rps:
+            buckets.append((f'rps:{scope}:{identity}', rps, max(1.0, rps * config['RATE_LIMIT_BURST_SECONDS']), 1))
+    if not buckets:
+        return None
+
+    levels, allowed = _store().acquire(buckets)
+    # 响应头报告剩余比例最小的桶
+    level, (key, rate, capacity, _) = min(zip(levels, buckets), key=lambda item: item[0] / item[1][2])
+    g.rate_limit_headers = {
+        'X-RateLimit-Limit': f'{rate:g}',
+        'X-RateLimit-Remaining': str(max(0, math.floor(level))),
+        'X-RateLimit-Reset': str(math.ceil(max(0.0, capacity - level) / rate)),
+        'X-RateLimit-Scope': key.split(':')[1],
+    }
+    if allowed:
+        return None
+    scope, retry_after = _blocking(buckets, levels)
+    return rate_limited_response(RateLimited(scope, retry_after))
+
+
+def rate_limited_response(error):
+    """429响应，带Retry-After头"""
+    response = jsonify({'error': str(error), 'scope': error.scope, 'retry_after': round(error.retry_after, 3)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+
+def _after_request(response):
+    for name, value in g.pop('rate_limit_headers', {}).items():
+        response.headers.setdefault(name, value)
+    return response
+
+
+def configure_rate_limit(app):
+    """注册限流钩子并创建令牌桶存储"""
+    if not app.config.get('RATE_LIMIT_ENABLED'):
+        return
+    if app.config['RATE_LIMIT_STORE'] == 'sqlite':
+        app.extensions['rate_limit_store'] = SQLiteStore(app.config['RATE_LIMIT_SQLITE_PATH'])
+    else:
+        app.extensions['rate_limit_store'] = MemoryStore(app.config['RATE_LIMIT_MAX_BUCKETS'])
+    app.extensions['rate_limit_agent_models'] = (OrderedDict(), threading.Lock())
+    app.before_request(_before_request)
+    app.after_request(_after_request)
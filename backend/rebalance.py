@@ -0,0 +1,265 @@
+"""分片再平衡：把数据不在一致性哈希位置上的智能体迁移到应在的分片（flask --app app rebalance-shards）
+
+每轮迁移一批智能体：
+1. 标记智能体正在迁移（Agent.shard_moving_to），之后开始的对话轮次返回409，等待进行中的轮次结束；
+2. 按批把对话、消息、日志、归档和统计复制到目标分片（分配新的主键）；
+3. 切换智能体的分片并取消标记，之后的读写都在目标分片上；再等待切换前开始的请求结束，
+   把复制之后源分片上新写入的行补到目标分片，重算目标分片上的统计；
+4. 源分片上的旧数据由删除任务（agent_data）在后台分批删除。
+
+复制期间读请求仍由源分片响应，只有写入会被拒绝。中断后重新执行会清理目标分片上复制了一半的数据。
+"""
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from content_store import decode
+from deletion import delete_agent_data, purge_agent_data
+from models import db, Agent, AgentLog, AgentStats, ArchivedConversation, Conversation, DeletionJob, Message, \
+    MessageContent
+from shards import shard_for, shard_label, use_shard
+from stats import repair_agent
+
+# 切换后源分片上的删除任务在补齐之前不能执行，先推迟到这个时间
+HELD_UNTIL = datetime(9999, 1, 1)
+
+
+class Move:
+    """一个智能体的迁移和复制进度"""
+
+    def __init__(self, agent_id, name, source, target, moving_to=None):
+        self.agent_id = agent_id
+        self.name = name
+        self.source = source
+        self.target = target
+        # 上次中断时正在迁移到的分片，上面可能有复制了一半的数据
+        self.moving_to = moving_to
+        # 源对话主键 -> 目标对话主键
+        self.conversations = {}
+        self.last_conversation = 0
+        self.last_archived = 0
+        self.last_log = 0
+        # 开始复制时源分片上最大的消息ID，之后写入的消息在切换后补齐
+        self.message_snapshot = 0
+        self.late_messages = set()
+        self.copied = {'conversations': 0, 'messages': 0, 'logs': 0, 'archived': 0}
+        self.job_id = None
+
+
+def plan():
+    """需要迁移的智能体（包括上次中断的迁移），按ID排序"""
+    moves = []
+    rows = (db.session.query(Agent.id, Agent.name, Agent.shard, Agent.shard_moving_to)
+            .filter(Agent.deleted_at.is_(None)).order_by(Agent.id))
+    for agent_id, name, shard, moving_to in rows:
+        target = shard_for(agent_id)
+        if shard != target or moving_to is not None:
+            moves.append(Move(agent_id, name, shard, target, moving_to))
+    return moves
+
+
+def _mark(agent_id, **values):
+    """修改未删除的智能体并提交，返回修改的行数（不更新updated_at）"""
+    values['updated_at'] = Agent.updated_at
+    updated = (Agent.query.filter(Agent.id == agent_id, Agent.deleted_at.is_(None))
+               .update(values, synchronize_session=False))
+    db.session.commit()
+    return updated
+
+
+def _without_id(row, **values):
+    return {**{name: value for name, value in row.items() if name != 'id'}, **values}
+
+
+def _message_rows(connection, batch_size, *criteria):
+    """按ID顺序分批读取消息，去重存储的内容还原为正文，每批为行字典列表"""
+    messages, contents = Message.__table__, MessageContent.__table__
+    after = 0
+    while True:
+        rows = connection.execute(
+            select(messages, contents.c.data, contents.c.compressed)
+            .outerjoin(contents, contents.c.hash == messages.c.content_hash)
+            .where(messages.c.id > after, *criteria)
+            .order_by(messages.c.id).limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            return
+        after = rows[-1]['id']
+        yield rows
+
+
+def _copy_messages(move, source, target, batch_size, *criteria):
+    """复制满足criteria的消息，对话主键换成目标分片上的主键；内容不在目标分片上去重，直接写入消息"""
+    messages = Message.__table__
+    with source.connect() as connection:
+        for rows in _message_rows(connection, batch_size, *criteria):
+            values = []
+            for row in rows:
+                if row['id'] in move.late_messages:
+                    continue
+                if row['id'] > move.message_snapshot:
+                    move.late_messages.add(row['id'])
+                content = decode(row['data'], row['compressed']) if row['content_hash'] else row['content']
+                values.append({'conversation_id': move.conversations[row['conversation_id']], 'role': row['role'],
+                               'content': content, 'content_hash': None, 'timestamp': row['timestamp']})
+            if values:
+                with target.begin() as writer:
+                    writer.execute(messages.insert(), values)
+                move.copied['messages'] += len(values)
+
+
+def _copy_conversations(move, source, target, batch_size):
+    """复制ID大于上次复制位置的未删除对话及其消息"""
+    conversations, messages = Conversation.__table__, Message.__table__
+    while True:
+        with source.connect() as connection:
+            rows = connection.execute(
+                select(conversations)
+                .where(conversations.c.agent_id == move.agent_id, conversations.c.deleted_at.is_(None),
+                       conversations.c.id > move.last_conversation)
+                .order_by(conversations.c.id).limit(batch_size)
+            ).mappings().all()
+        if not rows:
+            return
+        with target.begin() as writer:
+            for row in rows:
+                # 被分叉的对话ID更小，已先复制，分叉出的对话改为引用它在目标分片上的主键
+                parent_id = move.conversations.get(row['parent_id']) if row['parent_id'] is not None else None
+                result = writer.execute(conversations.insert().values(_without_id(row, parent_id=parent_id)))
+                move.conversations[row['id']] = result.inserted_primary_key[0]
+        move.last_conversation = rows[-1]['id']
+        move.copied['conversations'] += len(rows)
+        _copy_messages(move, source, target, batch_size, messages.c.conversation_id.in_([row['id'] for row in rows]))
+
+
+def _copy_rows(move, source, target, model, after, batch_size):
+    """复制智能体在model表中ID大于after的行（分配新ID），返回最后复制的源ID"""
+    table = model.__table__
+    while True:
+        with source.connect() as connection:
+            rows = connection.execute(
+                select(table).where(table.c.agent_id == move.agent_id, table.c.id > after)
+                .order_by(table.c.id).limit(batch_size)
+            ).mappings().all()
+        if not rows:
+            return after
+        with target.begin() as writer:
+            writer.execute(table.insert(), [_without_id(row) for row in rows])
+        after = rows[-1]['id']
+        move.copied['logs' if model is AgentLog else 'archived'] += len(rows)
+
+
+def _copy_stats(move, source, target):
+    """复制智能体的统计行，切换后在目标分片上重算"""
+    table = AgentStats.__table__
+    with source.connect() as connection:
+        row = connection.execute(select(table).where(table.c.agent_id == move.agent_id)).mappings().first()
+    with target.begin() as writer:
+        writer.execute(table.delete().where(table.c.agent_id == move.agent_id))
+        writer.execute(table.insert().values(dict(row) if row else {'agent_id': move.agent_id}))
+
+
+def copy_agent(move, batch_size):
+    """把智能体的数据从源分片复制到目标分片（智能体已标记为迁移中）"""
+    source, target = db.engines[move.source], db.engines[move.target]
+    with source.connect() as connection:
+        move.message_snapshot = connection.execute(select(func.max(Message.id))).scalar() or 0
+    _copy_conversations(move, source, target, batch_size)
+    move.last_archived = _copy_rows(move, source, target, ArchivedConversation, 0, batch_size)
+    move.last_log = _copy_rows(move, source, target, AgentLog, 0, batch_size)
+    _copy_stats(move, source, target)
+
+
+def catch_up(move, batch_size):
+    """补齐复制之后、切换之前源分片上新写入的消息、对话、归档和日志，然后重算目标分片上的统计"""
+    source, target = db.engines[move.source], db.engines[move.target]
+    messages = Message.__table__
+    copied = list(move.conversations)
+    for start in range(0, len(copied), batch_size):
+        _copy_messages(move, source, target, batch_size, messages.c.id > move.message_snapshot,
+                       messages.c.conversation_id.in_(copied[start:start + batch_size]))
+    _copy_conversations(move, source, target, batch_size)
+    move.last_archived = _copy_rows(move, source, target, ArchivedConversation, move.last_archived, batch_size)
+    move.last_log = _copy_rows(move, source, target, AgentLog, move.last_log, batch_size)
+    use_shard(move.target)
+    repair_agent(move.agent_id, batch_size)
+
+
+def _switch(move):
+    """切换智能体的分片，同时安排删除源分片上的数据（补齐之后才开始），返回是否切换成功"""
+    values = {'shard': move.target, 'shard_moving_to': None, 'updated_at': Agent.updated_at}
+    updated = (Agent.query.filter(Agent.id == move.agent_id, Agent.deleted_at.is_(None))
+               .update(values, synchronize_session=False))
+    if not updated:
+        db.session.rollback()
+        return False
+    # 删除任务与切换一起提交，补齐前先推迟执行
+    job = delete_agent_data(db.session.get(Agent, move.agent_id), move.source, available_at=HELD_UNTIL)
+    move.job_id = job.id
+    # 提交后读取任务ID会开启新的事务，结束它以免在等待和补齐期间占住主库的写锁
+    db.session.commit()
+    return True
+
+
+def _release(move):
+    """补齐之后让源分片上的删除任务立即可以执行"""
+    DeletionJob.query.filter_by(id=move.job_id).update({'available_at': datetime.utcnow()},
+                                                       synchronize_session=False)
+    db.session.commit()
+
+
+def run_round(moves, batch_size=500, drain_seconds=60, echo=print):
+    """迁移一批智能体，返回迁移完成的智能体"""
+    marked = []
+    for move in moves:
+        if move.source == move.target:
+            # 上次中断的迁移，智能体应在的分片又回到了原处：清理目标分片并取消标记
+            if move.moving_to not in (None, move.source):
+                purge_agent_data(move.agent_id, move.moving_to, batch_size)
+            _mark(move.agent_id, shard_moving_to=None)
+            continue
+        if move.moving_to not in (None, move.source, move.target):
+            purge_agent_data(move.agent_id, move.moving_to, batch_size)
+        if _mark(move.agent_id, shard_moving_to=move.target):
+            marked.append(move)
+    if not marked:
+        return []
+    # 等待标记之前开始的对话轮次结束
+    time.sleep(drain_seconds)
+
+    switched = []
+    for move in marked:
+        # 清理上次中断时留在目标分片上的数据
+        purge_agent_data(move.agent_id, move.target, batch_size)
+        copy_agent(move, batch_size)
+        use_shard(None)
+        if _switch(move):
+            switched.append(move)
+        else:
+            # 复制期间智能体被删除，目标分片上的数据不再需要
+            purge_agent_data(move.agent_id, move.target, batch_size)
+        use_shard(None)
+    if not switched:
+        return []
+    # 等待切换之前开始、仍在写源分片的请求结束
+    time.sleep(drain_seconds)
+
+    for move in switched:
+        catch_up(move, batch_size)
+        use_shard(None)
+        _release(move)
+        echo(f'Moved agent {move.agent_id} from {shard_label(move.source)} to {shard_label(move.target)}: '
+             f'{move.copied["conversations"]} conversations, {move.copied["messages"]} messages, '
+             f'{move.copied["logs"]} logs, {move.copied["archived"]} archived conversations')
+    return switched
+
+
+def rebalance(moves, batch_size=500, round_size=50, drain_seconds=60, echo=print):
+    """按round_size分轮迁移moves中的智能体，返回迁移完成的智能体数"""
+    round_size = max(round_size, 1)
+    moved = 0
+    for start in range(0, len(moves), round_size):
+        moved += len(run_round(moves[start:start + round_size], batch_size=batch_size,
+                               drain_seconds=drain_seconds, echo=echo))
+    return moved
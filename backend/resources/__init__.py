@@ -0,0 +1,24 @@
+import importlib
+
+# 各命名空间所在的模块，按注册顺序排列
+# 模块在create_app()中才被导入，导入app.py本身不会构建任何Flask-RESTX模型
+NAMESPACE_MODULES = [
+    'resources.model',
+    'resources.agent',
+    'resources.chat',
+    'resources.log',
+    'resources.user',
+    'resources.role',
+    'resources.runtime',
+    'resources.deletion',
+    'resources.batch',
+    'resources.dashboard',
+    'resources.search',
+]
+
+
+def register_namespaces(api):
+    """导入各命名空间模块并注册到API"""
+    for module_name in NAMESPACE_MODULES:
+        module = importlib.import_module(module_name)
+        api.add_namespace(module.ns)
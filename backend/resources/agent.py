@@ -0,0 +1,254 @@
+from flask import request
+from flask_restx import Namespace, Resource, fields
+from models import db, Agent, AgentLog, AgentStats, Model
+from query_budget import query_budget
+from idempotency import idempotent
+from warmup import agent_status_changed
+from deletion import delete_agent, get_agent_or_404
+from shards import use_agent_shard
+
+ns = Namespace('agents', description='智能体管理API')
+
+# 定义数据模型
+agent_model = ns.model('Agent', {
+    'id': fields.Integer(readonly=True, description='智能体ID'),
+    'name': fields.String(required=True, description='智能体名称'),
+    'description': fields.String(description='智能体描述'),
+    'model_id': fields.Integer(required=True, description='模型ID'),
+    'model_name': fields.String(readonly=True, description='模型名称'),
+    'status': fields.String(description='智能体状态', enum=['inactive', 'running', 'paused', 'stopped']),
+    'created_at': fields.String(readonly=True, description='创建时间'),
+    'updated_at': fields.String(readonly=True, description='更新时间')
+})
+
+agent_stats_model = ns.model('AgentStats', {
+    'agent_id': fields.Integer(description='智能体ID'),
+    'conversation_count': fields.Integer(description='对话数（不含已删除和已归档的对话）'),
+    'message_count': fields.Integer(description='消息数'),
+    'log_count': fields.Integer(description='日志数'),
+    'log_counts': fields.Raw(description='各级别的日志数：info、warning、error、debug'),
+    'last_activity_at': fields.String(description='最后一条消息或日志的时间')
+})
+
+@ns.route('/')
+class AgentList(Resource):
+    @ns.doc('list_agents')
+    @ns.response(200, 'Success', agent_model)
+    @query_budget(2)
+    def get(self):
+        """获取智能体列表（支持分页）"""
+        try:
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 10, type=int)
+            
+            # 查询智能体（同时加载所属模型，避免逐个查询），不包括已删除的智能体
+            agents = Agent.query.filter_by(deleted_at=None).options(db.joinedload(Agent.model))
+            agents = agents.paginate(page=page, per_page=per_page, error_out=False)
+            
+            # 构造响应数据
+            response = {
+                'agents': [agent.to_dict() for agent in agents.items],
+                'page': agents.page,
+                'per_page': agents.per_page,
+                'total': agents.total,
+                'pages': agents.pages
+            }
+            
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('create_agent')
+    @ns.expect(agent_model)
+    @ns.response(201, 'Created', agent_model)
+    @idempotent
+    @query_budget(9)
+    def post(self):
+        """注册新智能体"""
+        try:
+            data = request.get_json()
+            
+            # 验证必填字段
+            if not data or 'name' not in data or 'model_id' not in data:
+                return {'error': 'Name and model_id are required'}, 400
+            
+            # 检查智能体是否已存在
+            existing_agent = Agent.query.filter_by(name=data['name']).first()
+            if existing_agent:
+                if existing_agent.deleted_at:
+                    return {'error': 'An agent with this name is being deleted, try again later'}, 409
+                return {'error': 'Agent already exists'}, 409
+            
+            # 检查模型是否存在
+            model = Model.query.get(data['model_id'])
+            if not model:
+                return {'error': 'Model not found'}, 404
+            
+            # 创建新智能体
+            agent = Agent(
+                name=data['name'],
+                description=data.get('description', ''),
+                model_id=data['model_id'],
+                status=data.get('status', 'inactive')
+            )
+            
+            db.session.add(agent)
+            db.session.commit()
+            if agent.status == 'running':
+                # 预加载模型
+                agent_status_changed()
+            
+            # 添加创建日志（写入分配给智能体的分片）
+            use_agent_shard(agent)
+            log = AgentLog(
+                agent_id=agent.id,
+                level='info',
+                message=f'Agent "{agent.name}" created successfully'
+            )
+            db.session.add(log)
+            db.session.commit()
+            
+            return {'message': 'Agent created successfully', 'agent': agent.to_dict()}, 201
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/<int:agent_id>')
+@ns.param('agent_id', '智能体ID')
+class AgentResource(Resource):
+    @ns.doc('get_agent')
+    @ns.response(200, 'Success', agent_model)
+    @query_budget(2)
+    def get(self, agent_id):
+        """获取单个智能体信息"""
+        try:
+            agent = get_agent_or_404(agent_id)
+            return {'agent': agent.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('update_agent')
+    @ns.expect(agent_model)
+    @ns.response(200, 'Success', agent_model)
+    @idempotent
+    @query_budget(7)
+    def put(self, agent_id):
+        """更新智能体信息"""
+        try:
+            agent = get_agent_or_404(agent_id)
+            data = request.get_json()
+            
+            # 更新智能体信息
+            if 'name' in data:
+                agent.name = data['name']
+            if 'description' in data:
+                agent.description = data['description']
+            if 'status' in data:
+                # 验证状态值
+                valid_statuses = ['inactive', 'running', 'paused', 'stopped']
+                if data['status'] not in valid_statuses:
+                    return {'error': f'Invalid status. Must be one of {valid_statuses}'}, 400
+                agent.status = data['status']
+            
+            db.session.commit()
+            if 'status' in data:
+                agent_status_changed()
+            
+            # 添加更新日志
+            use_agent_shard(agent)
+            log = AgentLog(
+                agent_id=agent.id,
+                level='info',
+                message=f'Agent "{agent.name}" updated successfully'
+            )
+            db.session.add(log)
+            db.session.commit()
+            
+            return {'message': 'Agent updated successfully', 'agent': agent.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('delete_agent')
+    @ns.response(202, 'Accepted')
+    @query_budget(4)
+    def delete(self, agent_id):
+        """删除智能体（立即停止并隐藏，对话、消息和日志由后台分批删除）"""
+        try:
+            agent = get_agent_or_404(agent_id)
+            
+            # 软删除智能体并安排后台删除任务
+            job = delete_agent(agent)
+            agent_status_changed()
+            
+            return {'message': 'Agent deletion scheduled', 'deletion': job.to_dict()}, 202, {
+                'Location': f'/api/deletions/{job.id}'
+            }
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/<int:agent_id>/status')
+@ns.param('agent_id', '智能体ID')
+class AgentStatusResource(Resource):
+    @ns.doc('update_agent_status')
+    @idempotent
+    @query_budget(7)
+    def post(self, agent_id):
+        """更新智能体运行状态"""
+        try:
+            agent = get_agent_or_404(agent_id)
+            data = request.get_json()
+            
+            # 验证状态值
+            if 'status' not in data:
+                return {'error': 'Status is required'}, 400
+                
+            valid_statuses = ['inactive', 'running', 'paused', 'stopped']
+            if data['status'] not in valid_statuses:
+                return {'error': f'Invalid status. Must be one of {valid_statuses}'}, 400
+            
+            # 更新状态
+            old_status = agent.status
+            agent.status = data['status']
+            db.session.commit()
+            # 预加载、保持或卸载模型
+            agent_status_changed()
+            
+            # 添加状态变更日志
+            use_agent_shard(agent)
+            log = AgentLog(
+                agent_id=agent.id,
+                level='info',
+                message=f'Agent "{agent.name}" status changed from "{old_status}" to "{agent.status}"' 
+            )
+            db.session.add(log)
+            db.session.commit()
+            
+            return {'message': f'Agent status updated to {agent.status}', 'agent': agent.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/<int:agent_id>/stats')
+@ns.param('agent_id', '智能体ID')
+class AgentStatsResource(Resource):
+    @ns.doc('get_agent_stats')
+    @ns.response(200, 'Success', agent_stats_model)
+    @query_budget(2)
+    def get(self, agent_id):
+        """获取智能体的对话数、消息数、各级别日志数和最后活动时间（读取维护的计数，不扫描数据）"""
+        try:
+            agent = get_agent_or_404(agent_id)
+            use_agent_shard(agent)
+            stats = db.session.get(AgentStats, agent.id)
+            if not stats:
+                # 升级前创建的智能体在执行 flask --app app repair-stats 之前没有统计
+                return {'error': 'Statistics not available, run repair-stats'}, 404
+            return {'stats': stats.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,42 @@
+from flask import request
+from flask_restx import Namespace, Resource, fields
+from batch import BatchError, run_batch
+from query_budget import query_budget
+
+ns = Namespace('batch', description='批量请求API')
+
+# 定义数据模型
+sub_request_model = ns.model('BatchSubRequest', {
+    'id': fields.String(description='客户端指定的标识，原样返回'),
+    'method': fields.String(description='请求方法（默认：GET）', enum=['GET', 'POST', 'PUT', 'PATCH', 'DELETE']),
+    'path': fields.String(required=True, description='请求路径，例如 /users?page=1（可省略/api前缀）'),
+    'body': fields.Raw(description='JSON请求体'),
+    'headers': fields.Raw(description='额外的请求头')
+})
+
+batch_model = ns.model('BatchRequest', {
+    'requests': fields.List(fields.Nested(sub_request_model), required=True, description='按顺序执行的子请求'),
+    'transactional': fields.Boolean(description='所有子请求在同一事务中执行，任一失败时全部回滚（默认：false）')
+})
+
+@ns.route('', '/')
+class BatchResource(Resource):
+    @ns.doc('run_batch')
+    @ns.expect(batch_model)
+    # 子请求各自按所属资源方法的预算检查，批处理本身不执行查询
+    @query_budget(0)
+    def post(self):
+        """在一次HTTP调用中按顺序执行多个子请求"""
+        try:
+            data = request.get_json()
+            if not data or 'requests' not in data:
+                return {'error': 'requests is required'}, 400
+            
+            results, committed = run_batch(data['requests'], transactional=bool(data.get('transactional')))
+            
+            return {'responses': results, 'committed': committed}, 200
+            
+        except BatchError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,371 @@
+import os
+
+from flask import current_app, request
+from flask_restx import Namespace, Resource, fields
+from models import db, ArchivedConversation, ChatJob, Conversation
+from query_budget import query_budget
+from idempotency import idempotent
+from archive import rehydrate_conversation
+from chat_service import ChatError, chat_turn
+from jobs import CallbackRejected, check_callback_url, submit_job
+from deletion import delete_conversation, get_agent_or_404
+from forks import ForkError, fork_conversation, has_forks, history_length, history_query
+from ratelimit import RateLimited, rate_limited_response
+from shards import locate, use_agent_shard
+from stats import conversation_total, paginate
+from turns import ConversationBusy, queue_depth
+
+ns = Namespace('chat', description='智能体会话API')
+
+# 定义数据模型
+chat_model = ns.model('Chat', {
+    'message': fields.String(required=True, description='用户消息'),
+    'conversation_id': fields.String(description='对话ID')
+})
+
+chat_response_model = ns.model('ChatResponse', {
+    'message': fields.String(description='响应消息'),
+    'conversation_id': fields.String(description='对话ID'),
+    'response': fields.String(description='智能体响应')
+})
+
+chat_job_request_model = ns.model('ChatJobRequest', {
+    'message': fields.String(required=True, description='用户消息'),
+    'conversation_id': fields.String(description='对话ID，不指定时创建新对话'),
+    'callback_url': fields.String(description='任务结束后以POST方式接收结果的地址'),
+    'idempotency_key': fields.String(description='幂等键，同一智能体下重复提交时返回已有任务')
+})
+
+chat_job_model = ns.model('ChatJob', {
+    'job_id': fields.String(readonly=True, description='任务ID'),
+    'agent_id': fields.Integer(description='智能体ID'),
+    'conversation_id': fields.String(description='对话ID'),
+    'status': fields.String(description='任务状态', enum=['pending', 'leased', 'done', 'failed']),
+    'response': fields.String(description='智能体响应'),
+    'error': fields.String(description='最近一次错误'),
+    'attempts': fields.Integer(description='已执行次数'),
+    'callback_url': fields.String(description='回调地址'),
+    'callback_status': fields.String(description='回调投递状态', enum=['pending', 'delivered', 'failed']),
+    'created_at': fields.String(readonly=True, description='创建时间'),
+    'started_at': fields.String(readonly=True, description='最近一次开始执行的时间'),
+    'finished_at': fields.String(readonly=True, description='完成时间')
+})
+
+conversation_model = ns.model('Conversation', {
+    'id': fields.Integer(readonly=True, description='对话ID'),
+    'agent_id': fields.Integer(description='智能体ID'),
+    'conversation_id': fields.String(description='对话ID'),
+    'message_count': fields.Integer(readonly=True, description='消息数（含从父对话共享的消息）'),
+    'parent_id': fields.Integer(readonly=True, description='分叉来源对话的内部ID'),
+    'fork_point': fields.Integer(readonly=True, description='共享的父对话历史消息数'),
+    'last_message_at': fields.String(readonly=True, description='最后一条消息的时间'),
+    'created_at': fields.String(readonly=True, description='创建时间'),
+    'updated_at': fields.String(readonly=True, description='更新时间（新消息写入时更新）')
+})
+
+fork_model = ns.model('ConversationFork', {
+    'fork_point': fields.Integer(description='共享父对话历史的前多少条消息，默认全部'),
+    'conversation_id': fields.String(description='新对话ID，不指定时自动生成')
+})
+
+message_model = ns.model('Message', {
+    'id': fields.Integer(readonly=True, description='消息ID'),
+    'conversation_id': fields.Integer(description='对话ID'),
+    'role': fields.String(description='角色', enum=['user', 'assistant']),
+    'content': fields.String(description='消息内容'),
+    'timestamp': fields.String(readonly=True, description='时间戳')
+})
+
+@ns.route('/agents/<int:agent_id>/chat')
+@ns.param('agent_id', '智能体ID')
+class ChatResource(Resource):
+    @ns.doc('chat_with_agent')
+    @ns.expect(chat_model)
+    @ns.response(200, 'Success', chat_response_model)
+    @idempotent
+    # 启用去重时用户消息和回复各多一条内容写入
+    @query_budget(20)
+    def post(self, agent_id):
+        """与智能体进行对话"""
+        # requests导入较慢，只在处理对话请求时加载（用于识别模型API错误）
+        import requests
+
+        try:
+            agent = get_agent_or_404(agent_id)
+            data = request.get_json()
+            
+            # 验证必填字段
+            if not data or 'message' not in data:
+                return {'error': 'Message is required'}, 400
+            
+            conversation_id, assistant_message_content = chat_turn(
+                agent, data['message'], data.get('conversation_id'))
+            
+            # 构造响应
+            return {
+                'message': 'Chat completed successfully',
+                'conversation_id': conversation_id,
+                'response': assistant_message_content
+            }, 200
+            
+        except ChatError as e:
+            return {'error': str(e)}, e.status_code
+        except RateLimited as e:
+            return rate_limited_response(e)
+        except ConversationBusy as e:
+            return {'error': str(e)}, 409, {'Retry-After': str(e.retry_after)}
+        except requests.exceptions.RequestException as e:
+            return {'error': f'Model API error: {str(e)}'}, 500
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/agents/<int:agent_id>/jobs')
+@ns.param('agent_id', '智能体ID')
+class ChatJobListResource(Resource):
+    @ns.doc('submit_chat_job')
+    @ns.expect(chat_job_request_model)
+    @ns.response(202, 'Accepted', chat_job_model)
+    @idempotent
+    @query_budget(4)
+    def post(self, agent_id):
+        """提交异步对话任务，立即返回任务ID，结果通过轮询或回调获取"""
+        try:
+            agent = get_agent_or_404(agent_id)
+            data = request.get_json()
+            
+            # 验证必填字段
+            if not data or 'message' not in data:
+                return {'error': 'Message is required'}, 400
+            callback_url = data.get('callback_url')
+            if callback_url:
+                check_callback_url(callback_url, current_app.config)
+            
+            job, created = submit_job(agent, data['message'], data.get('conversation_id'),
+                                      callback_url=callback_url, idempotency_key=data.get('idempotency_key'))
+            status = 202 if created else 200
+            return {'message': 'Chat job accepted', 'job': job.to_dict()}, status, {
+                'Location': f'/api/chat/jobs/{job.job_id}'
+            }
+            
+        except CallbackRejected as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('get_agent_chat_jobs')
+    @ns.response(200, 'Success', chat_job_model)
+    @query_budget(2)
+    def get(self, agent_id):
+        """获取智能体的异步对话任务列表（支持分页和按状态过滤）"""
+        try:
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 20, type=int)
+            status = request.args.get('status')
+            
+            # 查询任务
+            jobs = ChatJob.query.filter_by(agent_id=agent_id)
+            if status:
+                jobs = jobs.filter_by(status=status)
+            jobs = jobs.order_by(ChatJob.id.desc())
+            jobs = jobs.paginate(page=page, per_page=per_page, error_out=False)
+            
+            # 构造响应数据
+            response = {
+                'jobs': [job.to_dict() for job in jobs.items],
+                'page': jobs.page,
+                'per_page': jobs.per_page,
+                'total': jobs.total,
+                'pages': jobs.pages
+            }
+            
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/jobs/<string:job_id>')
+@ns.param('job_id', '任务ID')
+class ChatJobResource(Resource):
+    @ns.doc('get_chat_job')
+    @ns.response(200, 'Success', chat_job_model)
+    @query_budget(1)
+    def get(self, job_id):
+        """获取异步对话任务的状态和结果"""
+        try:
+            job = ChatJob.query.filter_by(job_id=job_id).first()
+            if not job:
+                return {'error': 'Job not found'}, 404
+            return {'job': job.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/agents/<int:agent_id>/conversations')
+@ns.param('agent_id', '智能体ID')
+class ConversationListResource(Resource):
+    @ns.doc('get_agent_conversations')
+    @ns.response(200, 'Success', conversation_model)
+    @query_budget(3)
+    def get(self, agent_id):
+        """获取智能体的对话列表（最近有消息的在前）"""
+        try:
+            agent = get_agent_or_404(agent_id)
+            use_agent_shard(agent)
+            
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 10, type=int)
+            
+            # 查询对话
+            conversations = Conversation.query.filter_by(agent_id=agent.id, deleted_at=None)
+            conversations = conversations.order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+            # 总数取维护的对话数，不再COUNT(*)
+            conversations = paginate(conversations, page, per_page, conversation_total(agent.id))
+            
+            # 构造响应数据
+            response = {
+                'conversations': [conversation.to_dict() for conversation in conversations.items],
+                'page': conversations.page,
+                'per_page': conversations.per_page,
+                'total': conversations.total,
+                'pages': conversations.pages
+            }
+            
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/conversations/<string:conversation_id>/messages')
+@ns.param('conversation_id', '对话ID')
+class MessageListResource(Resource):
+    @ns.doc('get_conversation_messages')
+    @ns.response(200, 'Success', message_model)
+    @query_budget(3)
+    def get(self, conversation_id):
+        """获取对话的消息列表"""
+        try:
+            # 查找对话（启用分片时在各分片中查找）
+            conversation = locate(Conversation, conversation_id=conversation_id, deleted_at=None)
+            if not conversation:
+                # 已归档的对话自动恢复
+                conversation = rehydrate_conversation(conversation_id)
+            if not conversation:
+                return {'error': 'Conversation not found'}, 404
+            
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 20, type=int)
+            
+            # 查询消息（分叉出的对话含父对话在分叉点之前的消息）
+            messages = history_query(conversation.id, conversation.parent_id)
+            # 总数取对话上维护的消息数加上共享的消息数
+            messages = paginate(messages, page, per_page, history_length(conversation))
+            
+            # 构造响应数据
+            response = {
+                'messages': [message.to_dict() for message in messages.items],
+                'page': messages.page,
+                'per_page': messages.per_page,
+                'total': messages.total,
+                'pages': messages.pages
+            }
+            
+            return response, 200
+            
+        except ConversationBusy as e:
+            return {'error': str(e)}, 409, {'Retry-After': str(e.retry_after)}
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/conversations/<string:conversation_id>/fork')
+@ns.param('conversation_id', '对话ID')
+class ConversationForkResource(Resource):
+    @ns.doc('fork_conversation')
+    @ns.expect(fork_model)
+    @ns.response(201, 'Created', conversation_model)
+    @idempotent
+    @query_budget(6)
+    def post(self, conversation_id):
+        """从对话的前fork_point条消息分叉出新对话（共享父对话的消息，不复制）"""
+        try:
+            data = request.get_json(silent=True) or {}
+            conversation = locate(Conversation, conversation_id=conversation_id, deleted_at=None)
+            if not conversation:
+                # 已归档的对话自动恢复
+                conversation = rehydrate_conversation(conversation_id)
+            if not conversation:
+                return {'error': 'Conversation not found'}, 404
+            
+            use_agent_shard(conversation.agent_id, write=True)
+            fork = fork_conversation(conversation, data.get('fork_point'), data.get('conversation_id'))
+            return {
+                'message': 'Conversation forked successfully',
+                'conversation': fork.to_dict()
+            }, 201
+            
+        except ForkError as e:
+            return {'error': str(e)}, e.status_code
+        except ConversationBusy as e:
+            return {'error': str(e)}, 409, {'Retry-After': str(e.retry_after)}
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/conversations/<string:conversation_id>/queue')
+@ns.param('conversation_id', '对话ID')
+class ConversationQueueResource(Resource):
+    @ns.doc('get_conversation_queue')
+    @query_budget(1)
+    def get(self, conversation_id):
+        """获取对话排队中的轮次数：running为是否有轮次在执行，waiting为等待执行的轮次数"""
+        try:
+            depth = queue_depth(conversation_id)
+            if depth is None:
+                return {'error': 'Turn queue is disabled'}, 404
+            return {
+                'conversation_id': conversation_id,
+                'running': depth > 0,
+                'waiting': max(0, depth - 1),
+                'depth': depth
+            }, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/conversations/<string:conversation_id>')
+@ns.param('conversation_id', '对话ID')
+class ConversationResource(Resource):
+    @ns.doc('delete_conversation')
+    @ns.response(202, 'Accepted')
+    @query_budget(6)
+    def delete(self, conversation_id):
+        """删除对话（立即隐藏，消息由后台分批删除）"""
+        try:
+            conversation = locate(Conversation, conversation_id=conversation_id, deleted_at=None)
+            if not conversation:
+                # 已归档的对话只有一行，直接删除
+                archived = locate(ArchivedConversation, conversation_id=conversation_id)
+                if not archived:
+                    return {'error': 'Conversation not found'}, 404
+                use_agent_shard(archived.agent_id, write=True)
+                location = archived.location if archived.storage == 'file' else None
+                db.session.delete(archived)
+                db.session.commit()
+                if location and os.path.exists(location):
+                    os.remove(location)
+                return {'message': 'Conversation deleted successfully'}, 200
+            
+            use_agent_shard(conversation.agent_id, write=True)
+            if has_forks(conversation.id):
+                # 分叉出的对话仍在引用它的消息
+                return {'error': 'Conversation has forks, delete them first'}, 409
+            job = delete_conversation(conversation)
+            return {'message': 'Conversation deletion scheduled', 'deletion': job.to_dict()}, 202, {
+                'Location': f'/api/deletions/{job.id}'
+            }
+            
+        except ConversationBusy as e:
+            return {'error': str(e)}, 409, {'Retry-After': str(e.retry_after)}
+        except Exception as e:
+            return {'error': str(e)}, 500
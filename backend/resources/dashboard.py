@@ -0,0 +1,61 @@
+from flask import request
+from flask_restx import Namespace, Resource
+from models import db, Agent, AgentLog
+from query_budget import query_budget
+from shards import merge_recent, shards_enabled
+
+ns = Namespace('dashboard', description='仪表盘API')
+
+@ns.route('', '/')
+class DashboardResource(Resource):
+    @ns.doc('get_dashboard', params={
+        'agents': '返回的智能体数（默认：20，最近更新的在前）',
+        'logs': '返回的最近日志数（默认：20）'
+    })
+    @query_budget(3)
+    def get(self):
+        """获取仪表盘数据：智能体及其模型、各状态的智能体数和最近日志"""
+        try:
+            agent_limit = min(request.args.get('agents', 20, type=int), 100)
+            log_limit = min(request.args.get('logs', 20, type=int), 100)
+            
+            # 智能体与所属模型在一条语句中查询
+            agents = (
+                Agent.query.filter_by(deleted_at=None)
+                .options(db.joinedload(Agent.model))
+                .order_by(Agent.updated_at.desc())
+                .limit(agent_limit)
+                .all()
+            )
+            
+            # 各状态的智能体数
+            status_counts = dict(
+                db.session.query(Agent.status, db.func.count(Agent.id))
+                .filter(Agent.deleted_at.is_(None))
+                .group_by(Agent.status)
+                .all()
+            )
+            
+            # 最近日志及其智能体名称（按时间倒序走timestamp索引）
+            if shards_enabled():
+                # 日志分布在各分片上，分别取最近的日志后归并，名称从主库查询
+                logs = merge_recent(lambda: AgentLog.query.order_by(AgentLog.timestamp.desc()),
+                                    lambda log: log.timestamp, log_limit)
+            else:
+                logs = (
+                    db.session.query(AgentLog, Agent.name)
+                    .join(Agent, AgentLog.agent_id == Agent.id)
+                    .order_by(AgentLog.timestamp.desc())
+                    .limit(log_limit)
+                    .all()
+                )
+            
+            return {
+                'agents': [agent.to_dict() for agent in agents],
+                'status_counts': status_counts,
+                'total_agents': sum(status_counts.values()),
+                'recent_logs': [dict(log.to_dict(), agent_name=name) for log, name in logs]
+            }, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,73 @@
+from flask import request
+from flask_restx import Namespace, Resource, fields
+from models import DeletionJob
+from query_budget import query_budget
+
+ns = Namespace('deletions', description='后台删除任务API')
+
+# 定义数据模型
+deletion_model = ns.model('DeletionJob', {
+    'id': fields.Integer(readonly=True, description='删除任务ID'),
+    'target_type': fields.String(description='删除对象', enum=['agent', 'conversation', 'agent_data']),
+    'target_id': fields.Integer(description='智能体ID或对话的内部ID'),
+    'label': fields.String(description='智能体名称或对话ID'),
+    'status': fields.String(description='任务状态', enum=['pending', 'leased', 'done', 'failed']),
+    'phase': fields.String(description='正在删除的数据'),
+    'total_rows': fields.Integer(description='开始删除时统计的待删除行数'),
+    'deleted_rows': fields.Integer(description='已删除的行数'),
+    'progress': fields.Float(description='删除进度（0~1）'),
+    'error': fields.String(description='失败原因'),
+    'attempts': fields.Integer(description='执行次数'),
+    'created_at': fields.String(readonly=True, description='创建时间'),
+    'started_at': fields.String(readonly=True, description='开始时间'),
+    'finished_at': fields.String(readonly=True, description='结束时间')
+})
+
+@ns.route('/')
+class DeletionListResource(Resource):
+    @ns.doc('list_deletions')
+    @ns.response(200, 'Success', deletion_model)
+    @query_budget(2)
+    def get(self):
+        """获取删除任务列表（支持分页和按状态过滤）"""
+        try:
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 20, type=int)
+            status = request.args.get('status')
+            
+            # 查询删除任务，最新的在前
+            deletions = DeletionJob.query
+            if status:
+                deletions = deletions.filter_by(status=status)
+            deletions = deletions.order_by(DeletionJob.id.desc())
+            deletions = deletions.paginate(page=page, per_page=per_page, error_out=False)
+            
+            # 构造响应数据
+            response = {
+                'deletions': [deletion.to_dict() for deletion in deletions.items],
+                'page': deletions.page,
+                'per_page': deletions.per_page,
+                'total': deletions.total,
+                'pages': deletions.pages
+            }
+            
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/<int:deletion_id>')
+@ns.param('deletion_id', '删除任务ID')
+class DeletionResource(Resource):
+    @ns.doc('get_deletion')
+    @ns.response(200, 'Success', deletion_model)
+    @query_budget(1)
+    def get(self, deletion_id):
+        """获取删除任务的状态和进度"""
+        try:
+            deletion = DeletionJob.query.get_or_404(deletion_id)
+            return {'deletion': deletion.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
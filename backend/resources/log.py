@@ -0,0 +1,102 @@
+from flask import request
+from flask_restx import Namespace, Resource, fields
+from models import AgentLog
+from query_budget import query_budget
+from shards import paginate_shards, shards_enabled, use_agent_shard
+from stats import log_total, paginate
+
+ns = Namespace('logs', description='日志管理API')
+
+# 定义数据模型
+log_model = ns.model('AgentLog', {
+    'id': fields.Integer(readonly=True, description='日志ID'),
+    'agent_id': fields.Integer(description='智能体ID'),
+    'level': fields.String(description='日志级别', enum=['info', 'warning', 'error', 'debug']),
+    'message': fields.String(description='日志消息'),
+    'timestamp': fields.String(readonly=True, description='时间戳')
+})
+
+@ns.route('/agents/<int:agent_id>/logs')
+@ns.param('agent_id', '智能体ID')
+class AgentLogListResource(Resource):
+    @ns.doc('get_agent_logs')
+    @ns.response(200, 'Success', log_model)
+    @query_budget(2)
+    def get(self, agent_id):
+        """获取智能体日志列表（支持分页）"""
+        try:
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 20, type=int)
+            level = request.args.get('level')
+            
+            # 查询日志（启用分片时在智能体数据所在的分片上）
+            use_agent_shard(agent_id)
+            logs = AgentLog.query.filter_by(agent_id=agent_id)
+            
+            # 根据级别过滤
+            if level:
+                logs = logs.filter_by(level=level)
+            
+            # 分页查询
+            logs = logs.order_by(AgentLog.timestamp.desc())
+            # 总数取智能体维护的日志数，不常见的级别回退到COUNT(*)
+            logs = paginate(logs, page, per_page, log_total(agent_id, level))
+            
+            # 构造响应数据
+            response = {
+                'logs': [log.to_dict() for log in logs.items],
+                'page': logs.page,
+                'per_page': logs.per_page,
+                'total': logs.total,
+                'pages': logs.pages
+            }
+            
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/')
+class LogListResource(Resource):
+    @ns.doc('get_all_logs')
+    @ns.response(200, 'Success', log_model)
+    @query_budget(2)
+    def get(self):
+        """获取所有智能体日志列表（支持分页）"""
+        try:
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 20, type=int)
+            level = request.args.get('level')
+            
+            def query():
+                # 查询日志
+                logs = AgentLog.query
+
+                # 根据级别过滤
+                if level:
+                    logs = logs.filter_by(level=level)
+                return logs.order_by(AgentLog.timestamp.desc())
+
+            # 分页查询，总数为各智能体维护的日志数之和
+            if shards_enabled():
+                # 在主库和各分片上分别查询，按时间归并
+                logs = paginate_shards(query, lambda log: log.timestamp, page, per_page,
+                                       lambda: log_total(level=level))
+            else:
+                logs = paginate(query(), page, per_page, log_total(level=level))
+            
+            # 构造响应数据
+            response = {
+                'logs': [log.to_dict() for log in logs.items],
+                'page': logs.page,
+                'per_page': logs.per_page,
+                'total': logs.total,
+                'pages': logs.pages
+            }
+            
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
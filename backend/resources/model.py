@@ -0,0 +1,200 @@
+from flask import request
+from flask_restx import Namespace, Resource, fields
+from models import db, Model
+from query_budget import query_budget
+from idempotency import idempotent
+from warmup import warm_states
+
+ns = Namespace('models', description='模型管理API')
+
+# 定义数据模型
+model_model = ns.model('Model', {
+    'id': fields.Integer(readonly=True, description='模型ID'),
+    'name': fields.String(required=True, description='模型名称'),
+    'description': fields.String(description='模型描述'),
+    'api_endpoint': fields.String(required=True, description='API端点'),
+    'model_name': fields.String(required=True, description='模型名称'),
+    'status': fields.String(description='模型状态', enum=['active', 'inactive']),
+    'created_at': fields.String(readonly=True, description='创建时间'),
+    'updated_at': fields.String(readonly=True, description='更新时间')
+})
+
+warm_state_model = ns.model('ModelWarmState', {
+    'model_id': fields.Integer(description='模型ID'),
+    'state': fields.String(description='预热状态', enum=['cold', 'warming', 'warm', 'error']),
+    'running_agents': fields.Integer(description='引用该模型的运行中智能体数'),
+    'last_loaded_at': fields.String(description='最近一次加载时间'),
+    'load_seconds': fields.Float(description='最近一次从冷状态加载的耗时（秒）'),
+    'last_ping_at': fields.String(description='最近一次keep-alive时间'),
+    'next_ping_at': fields.String(description='下次keep-alive时间'),
+    'error': fields.String(description='最近一次加载失败的原因')
+})
+
+@ns.route('/')
+class ModelList(Resource):
+    @ns.doc('list_models')
+    @ns.response(200, 'Success', model_model)
+    @query_budget(2)
+    def get(self):
+        """获取模型列表"""
+        try:
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 10, type=int)
+            
+            # 查询模型
+            models = Model.query.paginate(page=page, per_page=per_page, error_out=False)
+            
+            # 构造响应数据
+            response = {
+                'models': [model.to_dict() for model in models.items],
+                'page': models.page,
+                'per_page': models.per_page,
+                'total': models.total,
+                'pages': models.pages
+            }
+            
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('create_model')
+    @ns.expect(model_model)
+    @ns.response(201, 'Created', model_model)
+    @idempotent
+    @query_budget(3)
+    def post(self):
+        """创建新模型"""
+        try:
+            data = request.get_json()
+            
+            # 验证必填字段
+            if not data or 'name' not in data or 'api_endpoint' not in data or 'model_name' not in data:
+                return {'error': 'Name, api_endpoint and model_name are required'}, 400
+            
+            # 检查模型是否已存在
+            existing_model = Model.query.filter_by(name=data['name']).first()
+            if existing_model:
+                return {'error': 'Model already exists'}, 409
+            
+            # 创建新模型
+            model = Model(
+                name=data['name'],
+                description=data.get('description', ''),
+                api_endpoint=data['api_endpoint'],
+                api_key=data.get('api_key', None),
+                model_name=data['model_name'],
+                status=data.get('status', 'active')
+            )
+            
+            db.session.add(model)
+            db.session.commit()
+            
+            return {'message': 'Model created successfully', 'model': model.to_dict()}, 201
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/<int:model_id>')
+@ns.param('model_id', '模型ID')
+class ModelResource(Resource):
+    @ns.doc('get_model')
+    @ns.response(200, 'Success', model_model)
+    @query_budget(1)
+    def get(self, model_id):
+        """获取单个模型信息"""
+        try:
+            model = Model.query.get_or_404(model_id)
+            return {'model': model.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('update_model')
+    @ns.expect(model_model)
+    @ns.response(200, 'Success', model_model)
+    @idempotent
+    @query_budget(3)
+    def put(self, model_id):
+        """更新模型信息"""
+        try:
+            model = Model.query.get_or_404(model_id)
+            data = request.get_json()
+            
+            # 更新模型信息
+            if 'name' in data:
+                model.name = data['name']
+            if 'description' in data:
+                model.description = data['description']
+            if 'api_endpoint' in data:
+                model.api_endpoint = data['api_endpoint']
+            if 'api_key' in data:
+                model.api_key = data['api_key']
+            if 'model_name' in data:
+                model.model_name = data['model_name']
+            if 'status' in data:
+                # 验证状态值
+                valid_statuses = ['active', 'inactive']
+                if data['status'] not in valid_statuses:
+                    return {'error': f'Invalid status. Must be one of {valid_statuses}'}, 400
+                model.status = data['status']
+            
+            db.session.commit()
+            
+            return {'message': 'Model updated successfully', 'model': model.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('delete_model')
+    @query_budget(3)
+    def delete(self, model_id):
+        """删除模型"""
+        try:
+            model = Model.query.get_or_404(model_id)
+            model_name = model.name
+            
+            # 检查是否有智能体使用该模型
+            if len(model.agents) > 0:
+                return {'error': f'Model "{model_name}" is being used by {len(model.agents)} agents. Cannot delete.'}, 400
+            
+            # 删除模型
+            db.session.delete(model)
+            db.session.commit()
+            
+            return {'message': 'Model deleted successfully'}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+
+@ns.route('/warmup')
+class ModelWarmupList(Resource):
+    @ns.doc('list_model_warm_states')
+    @ns.response(200, 'Success', warm_state_model)
+    @query_budget(3)
+    def get(self):
+        """获取所有模型的预热状态（warm/cold）"""
+        try:
+            model_ids = [model_id for (model_id,) in db.session.query(Model.id).order_by(Model.id)]
+            states = warm_states(model_ids)
+            return {'models': [states[model_id] for model_id in model_ids]}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/<int:model_id>/warmup')
+@ns.param('model_id', '模型ID')
+class ModelWarmupResource(Resource):
+    @ns.doc('get_model_warm_state')
+    @ns.response(200, 'Success', warm_state_model)
+    @query_budget(3)
+    def get(self, model_id):
+        """获取单个模型的预热状态"""
+        try:
+            Model.query.get_or_404(model_id)
+            return {'model': warm_states([model_id])[model_id]}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,185 @@
+from flask import request
+from flask_restx import Namespace, Resource, fields
+from models import db, Role, User
+from query_budget import query_budget
+from idempotency import idempotent
+
+ns = Namespace('roles', description='角色管理API')
+
+# 定义数据模型
+role_model = ns.model('Role', {
+    'id': fields.Integer(readonly=True, description='角色ID'),
+    'name': fields.String(required=True, description='角色名称'),
+    'description': fields.String(description='角色描述'),
+    'status': fields.String(description='角色状态', enum=['active', 'inactive']),
+    'created_at': fields.String(readonly=True, description='创建时间'),
+    'updated_at': fields.String(readonly=True, description='更新时间')
+})
+
+assign_users_model = ns.model('AssignUsers', {
+    'user_ids': fields.List(fields.Integer, required=True, description='用户ID列表')
+})
+
+@ns.route('/')
+class RoleListResource(Resource):
+    @ns.doc('list_roles')
+    @ns.response(200, 'Success', role_model)
+    @query_budget(3)
+    def get(self):
+        """获取角色列表（支持分页）"""
+        try:
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 10, type=int)
+            
+            # 查询角色
+            roles = Role.query.options(db.selectinload(Role.users)).paginate(page=page, per_page=per_page, error_out=False)
+            
+            # 构造响应数据
+            response = {
+                'roles': [role.to_dict() for role in roles.items],
+                'page': roles.page,
+                'per_page': roles.per_page,
+                'total': roles.total,
+                'pages': roles.pages
+            }
+            
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('create_role')
+    @ns.expect(role_model)
+    @ns.response(201, 'Created', role_model)
+    @idempotent
+    @query_budget(4)
+    def post(self):
+        """创建新角色"""
+        try:
+            data = request.get_json()
+            
+            # 验证必填字段
+            if not data or 'name' not in data:
+                return {'error': 'Name is required'}, 400
+            
+            # 检查角色是否已存在
+            existing_role = Role.query.filter_by(name=data['name']).first()
+            if existing_role:
+                return {'error': 'Role already exists'}, 409
+            
+            # 创建新角色
+            role = Role(
+                name=data['name'],
+                description=data.get('description', ''),
+                status=data.get('status', 'active')
+            )
+            
+            db.session.add(role)
+            db.session.commit()
+            
+            return {'message': 'Role created successfully', 'role': role.to_dict()}, 201
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/<int:role_id>')
+@ns.param('role_id', '角色ID')
+class RoleResource(Resource):
+    @ns.doc('get_role')
+    @ns.response(200, 'Success', role_model)
+    @query_budget(2)
+    def get(self, role_id):
+        """获取单个角色信息"""
+        try:
+            role = Role.query.get_or_404(role_id)
+            return {'role': role.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('update_role')
+    @ns.expect(role_model)
+    @ns.response(200, 'Success', role_model)
+    @idempotent
+    @query_budget(4)
+    def put(self, role_id):
+        """更新角色信息"""
+        try:
+            role = Role.query.get_or_404(role_id)
+            data = request.get_json()
+            
+            # 更新角色信息
+            if 'name' in data:
+                role.name = data['name']
+            if 'description' in data:
+                role.description = data['description']
+            if 'status' in data:
+                # 验证状态值
+                valid_statuses = ['active', 'inactive']
+                if data['status'] not in valid_statuses:
+                    return {'error': f'Invalid status. Must be one of {valid_statuses}'}, 400
+                role.status = data['status']
+            
+            db.session.commit()
+            
+            return {'message': 'Role updated successfully', 'role': role.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('delete_role')
+    @query_budget(3)
+    def delete(self, role_id):
+        """删除角色"""
+        try:
+            role = Role.query.get_or_404(role_id)
+            role_name = role.name
+            
+            # 检查是否有用户使用该角色
+            if len(role.users) > 0:
+                return {'error': f'Role "{role_name}" is being used by {len(role.users)} users. Cannot delete.'}, 400
+            
+            # 删除角色
+            db.session.delete(role)
+            db.session.commit()
+            
+            return {'message': 'Role deleted successfully'}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/<int:role_id>/assign-users')
+@ns.param('role_id', '角色ID')
+class RoleAssignUsersResource(Resource):
+    @ns.doc('assign_users_to_role')
+    @ns.expect(assign_users_model)
+    @idempotent
+    @query_budget(3)
+    def post(self, role_id):
+        """分配用户给角色"""
+        try:
+            role = Role.query.get_or_404(role_id)
+            data = request.get_json()
+            
+            # 验证必填字段
+            if not data or 'user_ids' not in data:
+                return {'error': 'user_ids is required'}, 400
+            
+            # 获取所有用户
+            users = User.query.filter(User.id.in_(data['user_ids'])).all()
+            
+            # 检查用户是否存在
+            if len(users) != len(data['user_ids']):
+                return {'error': 'Some users not found'}, 404
+            
+            # 分配角色给用户
+            for user in users:
+                user.role_id = role_id
+            
+            db.session.commit()
+            
+            return {'message': 'Users assigned to role successfully'}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
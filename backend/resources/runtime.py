@@ -0,0 +1,187 @@
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from flask_restx import Namespace, Resource, fields
+from models import db, AgentRuntimeState, AgentTask
+from query_budget import query_budget
+from idempotency import idempotent
+from runtime import enqueue_task
+from deletion import get_agent_or_404
+
+ns = Namespace('runtime', description='智能体运行时API')
+
+# 定义数据模型
+task_model = ns.model('AgentTask', {
+    'message': fields.String(required=True, description='用户消息'),
+    'conversation_id': fields.String(description='对话ID，不指定时创建新对话'),
+    'priority': fields.Integer(description='优先级，数值越大越先执行（默认：0）')
+})
+
+task_status_model = ns.model('AgentTaskStatus', {
+    'id': fields.Integer(readonly=True, description='任务ID'),
+    'agent_id': fields.Integer(description='智能体ID'),
+    'priority': fields.Integer(description='优先级'),
+    'status': fields.String(description='任务状态', enum=['pending', 'leased', 'done', 'failed', 'cancelled']),
+    'payload': fields.Raw(description='任务内容'),
+    'result': fields.Raw(description='执行结果'),
+    'error': fields.String(description='最近一次错误'),
+    'attempts': fields.Integer(description='已执行次数'),
+    'created_at': fields.String(readonly=True, description='创建时间'),
+    'started_at': fields.String(readonly=True, description='最近一次开始执行的时间'),
+    'finished_at': fields.String(readonly=True, description='完成时间')
+})
+
+runtime_state_model = ns.model('AgentRuntimeState', {
+    'agent_id': fields.Integer(description='智能体ID'),
+    'runtime_id': fields.String(description='运行时（主机名:进程号）'),
+    'state': fields.String(description='智能体循环状态', enum=['running', 'paused', 'stopped']),
+    'alive': fields.Boolean(description='运行时是否按时上报心跳'),
+    'active_tasks': fields.Integer(description='进行中的任务数'),
+    'tasks_completed': fields.Integer(description='已完成的任务数'),
+    'tasks_failed': fields.Integer(description='失败的任务数'),
+    'throughput_per_minute': fields.Float(description='最近一分钟完成的任务数'),
+    'last_task_at': fields.String(description='最近一次执行任务的时间'),
+    'heartbeat_at': fields.String(description='最近一次心跳时间')
+})
+
+
+def _state_dicts(states):
+    """运行状态列表，超过3个心跳间隔没有上报的运行时视为失联"""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['RUNTIME_HEARTBEAT_SECONDS'] * 3)
+    return [dict(state.to_dict(), alive=state.heartbeat_at >= cutoff) for state in states]
+
+
+def _queue_depth(agent_id=None):
+    """各状态的任务数"""
+    query = db.session.query(AgentTask.status, db.func.count(AgentTask.id))
+    if agent_id is not None:
+        query = query.filter(AgentTask.agent_id == agent_id)
+    return dict(query.group_by(AgentTask.status).all())
+
+
+@ns.route('/agents/<int:agent_id>/tasks')
+@ns.param('agent_id', '智能体ID')
+class AgentTaskListResource(Resource):
+    @ns.doc('enqueue_agent_task')
+    @ns.expect(task_model)
+    @ns.response(201, 'Created', task_status_model)
+    @idempotent
+    @query_budget(3)
+    def post(self, agent_id):
+        """向智能体的任务队列添加任务，由运行时异步执行"""
+        try:
+            agent = get_agent_or_404(agent_id)
+            data = request.get_json()
+
+            # 验证必填字段
+            if not data or 'message' not in data:
+                return {'error': 'Message is required'}, 400
+
+            task = enqueue_task(agent.id, data['message'], data.get('conversation_id'),
+                                priority=int(data.get('priority', 0)))
+            return {'message': 'Task queued successfully', 'task': task.to_dict()}, 201
+
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+    @ns.doc('get_agent_tasks')
+    @ns.response(200, 'Success', task_status_model)
+    @query_budget(2)
+    def get(self, agent_id):
+        """获取智能体的任务列表（支持分页和按状态过滤）"""
+        try:
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 20, type=int)
+            status = request.args.get('status')
+
+            # 查询任务
+            tasks = AgentTask.query.filter_by(agent_id=agent_id)
+            if status:
+                tasks = tasks.filter_by(status=status)
+            tasks = tasks.order_by(AgentTask.id.desc())
+            tasks = tasks.paginate(page=page, per_page=per_page, error_out=False)
+
+            # 构造响应数据
+            response = {
+                'tasks': [task.to_dict() for task in tasks.items],
+                'page': tasks.page,
+                'per_page': tasks.per_page,
+                'total': tasks.total,
+                'pages': tasks.pages
+            }
+
+            return response, 200
+
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/tasks/<int:task_id>')
+@ns.param('task_id', '任务ID')
+class AgentTaskResource(Resource):
+    @ns.doc('get_agent_task')
+    @ns.response(200, 'Success', task_status_model)
+    @query_budget(1)
+    def get(self, task_id):
+        """获取单个任务的状态和结果"""
+        try:
+            task = AgentTask.query.get_or_404(task_id)
+            return {'task': task.to_dict()}, 200
+
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/tasks/<int:task_id>/cancel')
+@ns.param('task_id', '任务ID')
+class AgentTaskCancelResource(Resource):
+    @ns.doc('cancel_agent_task')
+    @idempotent
+    @query_budget(3)
+    def post(self, task_id):
+        """取消尚未开始执行的任务"""
+        try:
+            AgentTask.query.get_or_404(task_id)
+            cancelled = AgentTask.query.filter_by(id=task_id, status='pending').update(
+                {'status': 'cancelled', 'finished_at': datetime.utcnow()}, synchronize_session=False)
+            db.session.commit()
+            if not cancelled:
+                return {'error': 'Only pending tasks can be cancelled'}, 409
+            return {'message': 'Task cancelled successfully'}, 200
+
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/agents/<int:agent_id>')
+@ns.param('agent_id', '智能体ID')
+class AgentRuntimeResource(Resource):
+    @ns.doc('get_agent_runtime')
+    @ns.response(200, 'Success', runtime_state_model)
+    @query_budget(3)
+    def get(self, agent_id):
+        """获取智能体在各运行时中的心跳、吞吐量和任务队列深度"""
+        try:
+            agent = get_agent_or_404(agent_id)
+            states = AgentRuntimeState.query.filter_by(agent_id=agent.id).order_by(AgentRuntimeState.runtime_id)
+            return {
+                'agent_id': agent.id,
+                'status': agent.status,
+                'runtimes': _state_dicts(states),
+                'queue': _queue_depth(agent.id)
+            }, 200
+
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/')
+class RuntimeResource(Resource):
+    @ns.doc('get_runtime_overview')
+    @ns.response(200, 'Success', runtime_state_model)
+    @query_budget(2)
+    def get(self):
+        """获取所有智能体的运行状态和任务队列深度"""
+        try:
+            states = AgentRuntimeState.query.order_by(AgentRuntimeState.agent_id, AgentRuntimeState.runtime_id)
+            return {'runtimes': _state_dicts(states), 'queue': _queue_depth()}, 200
+
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,33 @@
+from flask import current_app, request
+from flask_restx import Namespace, Resource
+from query_budget import query_budget
+from search import SEARCH_TYPES, search
+
+ns = Namespace('search', description='名称搜索API（输入提示）')
+
+@ns.route('', '/')
+class SearchResource(Resource):
+    @ns.doc('search', params={
+        'q': '查询词，匹配名称前缀和子串，不区分大小写（为空时按名称顺序返回）',
+        'types': '逗号分隔的类型：agents, models, users, roles（默认：全部）',
+        'limit': '每类最多返回的结果数（默认：10）'
+    })
+    @query_budget(0)
+    def get(self):
+        """按名称查找智能体、模型、用户（用户名和邮箱）和角色，前缀匹配的结果在前"""
+        try:
+            query = request.args.get('q', '').strip()
+            types = [name.strip() for name in request.args.get('types', ','.join(SEARCH_TYPES)).split(',')
+                     if name.strip()]
+            unknown = [name for name in types if name not in SEARCH_TYPES]
+            if unknown:
+                return {'error': f'Unknown search types: {", ".join(unknown)}'}, 400
+            limit = max(1, min(request.args.get('limit', 10, type=int), current_app.config['SEARCH_MAX_LIMIT']))
+            
+            response = {'q': query}
+            for search_type in types:
+                response[search_type] = search(search_type, query, limit)
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,150 @@
+from flask import request
+from flask_restx import Namespace, Resource, fields
+from models import db, User
+from query_budget import query_budget
+from idempotency import idempotent
+
+ns = Namespace('users', description='用户管理API')
+
+# 定义数据模型
+user_model = ns.model('User', {
+    'id': fields.Integer(readonly=True, description='用户ID'),
+    'username': fields.String(required=True, description='用户名'),
+    'email': fields.String(required=True, description='邮箱'),
+    'password': fields.String(required=True, description='密码'),
+    'role_id': fields.Integer(description='角色ID'),
+    'status': fields.String(description='用户状态', enum=['active', 'inactive']),
+    'created_at': fields.String(readonly=True, description='创建时间'),
+    'updated_at': fields.String(readonly=True, description='更新时间')
+})
+
+@ns.route('/')
+class UserListResource(Resource):
+    @ns.doc('list_users')
+    @ns.response(200, 'Success', user_model)
+    @query_budget(2)
+    def get(self):
+        """获取用户列表（支持分页）"""
+        try:
+            # 获取分页参数
+            page = request.args.get('page', 1, type=int)
+            per_page = request.args.get('per_page', 10, type=int)
+            
+            # 查询用户
+            users = User.query.options(db.joinedload(User.role)).paginate(page=page, per_page=per_page, error_out=False)
+            
+            # 构造响应数据
+            response = {
+                'users': [user.to_dict() for user in users.items],
+                'page': users.page,
+                'per_page': users.per_page,
+                'total': users.total,
+                'pages': users.pages
+            }
+            
+            return response, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('create_user')
+    @ns.expect(user_model)
+    @ns.response(201, 'Created', user_model)
+    @idempotent
+    @query_budget(4)
+    def post(self):
+        """创建新用户"""
+        try:
+            data = request.get_json()
+            
+            # 验证必填字段
+            if not data or 'username' not in data or 'email' not in data or 'password' not in data:
+                return {'error': 'Username, email and password are required'}, 400
+            
+            # 检查用户是否已存在
+            existing_user = User.query.filter((User.username == data['username']) | (User.email == data['email'])).first()
+            if existing_user:
+                return {'error': 'User already exists'}, 409
+            
+            # 创建新用户
+            user = User(
+                username=data['username'],
+                email=data['email'],
+                password=data['password'],  # 注意：实际应用中应该加密密码
+                role_id=data.get('role_id'),
+                status=data.get('status', 'active')
+            )
+            
+            db.session.add(user)
+            db.session.commit()
+            
+            return {'message': 'User created successfully', 'user': user.to_dict()}, 201
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+@ns.route('/<int:user_id>')
+@ns.param('user_id', '用户ID')
+class UserResource(Resource):
+    @ns.doc('get_user')
+    @ns.response(200, 'Success', user_model)
+    @query_budget(2)
+    def get(self, user_id):
+        """获取单个用户信息"""
+        try:
+            user = User.query.get_or_404(user_id)
+            return {'user': user.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('update_user')
+    @ns.expect(user_model)
+    @ns.response(200, 'Success', user_model)
+    @idempotent
+    @query_budget(4)
+    def put(self, user_id):
+        """更新用户信息"""
+        try:
+            user = User.query.get_or_404(user_id)
+            data = request.get_json()
+            
+            # 更新用户信息
+            if 'username' in data:
+                user.username = data['username']
+            if 'email' in data:
+                user.email = data['email']
+            if 'password' in data and data['password']:
+                user.password = data['password']  # 注意：实际应用中应该加密密码
+            if 'role_id' in data:
+                user.role_id = data['role_id']
+            if 'status' in data:
+                # 验证状态值
+                valid_statuses = ['active', 'inactive']
+                if data['status'] not in valid_statuses:
+                    return {'error': f'Invalid status. Must be one of {valid_statuses}'}, 400
+                user.status = data['status']
+            
+            db.session.commit()
+            
+            return {'message': 'User updated successfully', 'user': user.to_dict()}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
+    
+    @ns.doc('delete_user')
+    @query_budget(2)
+    def delete(self, user_id):
+        """删除用户"""
+        try:
+            user = User.query.get_or_404(user_id)
+            username = user.username
+            
+            # 删除用户
+            db.session.delete(user)
+            db.session.commit()
+            
+            return {'message': 'User deleted successfully'}, 200
+            
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,327 @@
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import leases
+from chat_service import ChatError, chat_turn
+from models import db, Agent, AgentLog, AgentRuntimeState, AgentTask
+from ratelimit import RateLimited
+from shards import use_agent_shard
+from turns import ConversationBusy
+from warmup import start_manager as start_warmup_manager
+
+# 运行时的默认配置，均可通过同名环境变量覆盖
+RUNTIME_DEFAULTS = {
+    'RUNTIME_WORKERS': str(min(32, (os.cpu_count() or 1) + 4)),  # 每个进程的工作线程数，任务主要在等待模型API
+    'RUNTIME_POLL_SECONDS': '1',            # 没有任务时的轮询间隔，也是响应智能体状态变化的最长延迟
+    'RUNTIME_LEASE_SECONDS': '120',         # 任务租约时长，运行时失联超过该时间后任务会被重新领取
+    'RUNTIME_HEARTBEAT_SECONDS': '10',      # 上报心跳、续租进行中任务的间隔
+    'RUNTIME_MAX_ATTEMPTS': '3',            # 任务最多执行的次数
+    'RUNTIME_RETRY_BACKOFF_SECONDS': '10',  # 重试前等待的秒数，随执行次数线性增长
+}
+# 计算吞吐量的时间窗口（秒）
+THROUGHPUT_WINDOW = 60
+
+
+def load_runtime_config(app, environ):
+    """从环境变量读取智能体运行时配置"""
+    for key, default in RUNTIME_DEFAULTS.items():
+        value = environ.get(key, default)
+        app.config[key] = float(value) if key.endswith('_SECONDS') else int(value)
+
+
+def enqueue_task(agent_id, message, conversation_id=None, priority=0):
+    """向智能体的任务队列添加一条对话任务"""
+    payload = {'message': message}
+    if conversation_id:
+        payload['conversation_id'] = conversation_id
+    task = AgentTask(agent_id=agent_id, priority=priority, payload=json.dumps(payload, ensure_ascii=False))
+    db.session.add(task)
+    db.session.commit()
+    return task
+
+
+def claim_task(agent_ids, owner, lease_seconds):
+    """为运行中的智能体领取优先级最高的任务，没有可领取的任务时返回None"""
+    return leases.claim(AgentTask, [AgentTask.agent_id.in_(agent_ids)],
+                        [AgentTask.priority.desc(), AgentTask.id.asc()], owner, lease_seconds)
+
+
+class AgentLoop:
+    """单个智能体在当前运行时中的状态和统计"""
+
+    def __init__(self, agent_id):
+        self.agent_id = agent_id
+        self.state = 'running'
+        self.active_tasks = 0
+        self.tasks_completed = 0
+        self.tasks_failed = 0
+        self.last_task_at = None
+        self.completions = deque()  # 最近完成任务的时间，用于计算吞吐量
+
+    def record(self, succeeded):
+        now = time.time()
+        if succeeded:
+            self.tasks_completed += 1
+            self.completions.append(now)
+        else:
+            self.tasks_failed += 1
+        self.last_task_at = datetime.utcnow()
+
+    def throughput(self):
+        """最近一分钟完成的任务数"""
+        cutoff = time.time() - THROUGHPUT_WINDOW
+        while self.completions and self.completions[0] < cutoff:
+            self.completions.popleft()
+        return len(self.completions)
+
+
+class AgentRuntime:
+    """智能体运行时：监督线程跟随智能体状态启停各智能体，工作线程池从任务队列领取并执行任务
+
+    智能体状态为running时领取新任务；paused或其他状态时不再领取，进行中的任务照常完成。
+    同一数据库上可以同时运行多个运行时（多进程、多主机），任务通过租约保证只被执行一次。
+    """
+
+    def __init__(self, app, workers=None, runtime_id=None):
+        self.app = app
+        self.config = app.config
+        self.workers = workers or self.config['RUNTIME_WORKERS']
+        self.runtime_id = runtime_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.loops = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._threads = []
+
+    def running_agent_ids(self):
+        with self._lock:
+            return [agent_id for agent_id, loop in self.loops.items() if loop.state == 'running']
+
+    def start(self):
+        """启动监督、心跳和工作线程"""
+        with self.app.app_context():
+            self.sync_agents()
+        targets = [self._supervise, self._heartbeat] + [self._work] * self.workers
+        for index, target in enumerate(targets):
+            thread = threading.Thread(target=target, name=f'agent-runtime-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """停止领取新任务，等待进行中的任务完成后上报最终状态"""
+        self._stopping.set()
+        self._wake.set()
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.time()))
+        with self._lock:
+            for loop in self.loops.values():
+                loop.state = 'stopped'
+        with self.app.app_context():
+            self.report()
+
+    def sync_agents(self):
+        """根据数据库中的智能体状态启动、暂停或停止各智能体的循环"""
+        statuses = dict(db.session.query(Agent.id, Agent.status).all())
+        db.session.commit()
+        changes = []
+        with self._lock:
+            for agent_id, status in statuses.items():
+                loop = self.loops.get(agent_id)
+                state = status if status in ('running', 'paused') else 'stopped'
+                if loop is None:
+                    if state != 'running':
+                        continue
+                    loop = self.loops[agent_id] = AgentLoop(agent_id)
+                elif loop.state == state:
+                    continue
+                loop.state = state
+                changes.append((agent_id, state))
+            # 已删除的智能体
+            for agent_id, loop in self.loops.items():
+                if agent_id not in statuses and loop.state != 'stopped':
+                    loop.state = 'stopped'
+        for agent_id, state in changes:
+            # 各智能体的日志写入其所在的分片，逐条提交
+            use_agent_shard(agent_id)
+            db.session.add(AgentLog(agent_id=agent_id, level='info',
+                                    message=f'Agent runtime {self.runtime_id}: agent loop {state}'))
+            db.session.commit()
+        if changes:
+            self._wake.set()
+
+    def report(self):
+        """上报各智能体的心跳和吞吐量，并为进行中的任务续租"""
+        now = datetime.utcnow()
+        with self._lock:
+            snapshot = [
+                (loop.agent_id, loop.state, loop.active_tasks, loop.tasks_completed, loop.tasks_failed,
+                 loop.throughput(), loop.last_task_at)
+                for loop in self.loops.values()
+            ]
+        rows = {row.agent_id: row for row in AgentRuntimeState.query.filter_by(runtime_id=self.runtime_id)}
+        existing_agents = {agent_id for (agent_id,) in db.session.query(Agent.id)}
+        for agent_id, state, active, completed, failed, throughput, last_task_at in snapshot:
+            if agent_id not in existing_agents:
+                continue
+            row = rows.get(agent_id)
+            if row is None:
+                row = AgentRuntimeState(agent_id=agent_id, runtime_id=self.runtime_id)
+                db.session.add(row)
+            row.state = state
+            row.active_tasks = active
+            row.tasks_completed = completed
+            row.tasks_failed = failed
+            row.throughput_per_minute = throughput
+            row.last_task_at = last_task_at
+            row.heartbeat_at = now
+        leases.renew(AgentTask, self.runtime_id, self.config['RUNTIME_LEASE_SECONDS'])
+        db.session.commit()
+
+    def _supervise(self):
+        while not self._stopping.wait(self.config['RUNTIME_POLL_SECONDS']):
+            try:
+                with self.app.app_context():
+                    self.sync_agents()
+            except Exception:
+                self.app.logger.exception('Agent runtime failed to sync agent statuses')
+
+    def _heartbeat(self):
+        while not self._stopping.wait(self.config['RUNTIME_HEARTBEAT_SECONDS']):
+            try:
+                with self.app.app_context():
+                    self.report()
+            except Exception:
+                self.app.logger.exception('Agent runtime failed to report heartbeat')
+
+    def _work(self):
+        while not self._stopping.is_set():
+            agent_ids = self.running_agent_ids()
+            task = None
+            try:
+                with self.app.app_context():
+                    if agent_ids:
+                        task = claim_task(agent_ids, self.runtime_id, self.config['RUNTIME_LEASE_SECONDS'])
+                    if task is not None:
+                        self._run(task)
+            except Exception:
+                self.app.logger.exception('Agent runtime worker error')
+            if task is None:
+                self._wake.wait(self.config['RUNTIME_POLL_SECONDS'])
+                self._wake.clear()
+
+    def _run(self, task):
+        """执行一条已领取的任务并记录结果"""
+        task_id, agent_id, attempts = task.id, task.agent_id, task.attempts
+        loop = self.loops[agent_id]
+        if attempts > self.config['RUNTIME_MAX_ATTEMPTS']:
+            # 之前的执行者在租约期内失联，且已用完执行次数
+            leases.release(AgentTask, task_id, self.runtime_id, status='failed', finished_at=datetime.utcnow(),
+                           error=task.error or 'Lease expired too many times')
+            return
+
+        with self._lock:
+            loop.active_tasks += 1
+        try:
+            payload = json.loads(task.payload)
+            agent = db.session.get(Agent, agent_id)
+            conversation_id, reply = chat_turn(agent, payload['message'], payload.get('conversation_id'))
+        except Exception as e:
+            db.session.rollback()
+            self._fail(task_id, agent_id, attempts, e)
+            # 被限流或对话排队已满的任务重新排队，不计入失败
+            succeeded = None if isinstance(e, (RateLimited, ConversationBusy)) else False
+        else:
+            result = json.dumps({'conversation_id': conversation_id, 'response': reply}, ensure_ascii=False)
+            succeeded = leases.release(AgentTask, task_id, self.runtime_id, status='done', result=result,
+                                       error=None, finished_at=datetime.utcnow())
+        finally:
+            with self._lock:
+                loop.active_tasks -= 1
+        if succeeded is not None:
+            with self._lock:
+                loop.record(succeeded)
+
+    def _fail(self, task_id, agent_id, attempts, error):
+        """任务执行失败：可重试的错误退避后重新排队，否则标记为失败"""
+        now = datetime.utcnow()
+        if isinstance(error, (RateLimited, ConversationBusy)):
+            # 超出token配额或对话排队已满不算一次执行，稍后重新排队
+            leases.release(AgentTask, task_id, self.runtime_id, attempts=AgentTask.attempts - 1,
+                           status='pending', available_at=now + timedelta(seconds=error.retry_after))
+            return
+        retry = not isinstance(error, ChatError) and attempts < self.config['RUNTIME_MAX_ATTEMPTS']
+        if retry:
+            delay = self.config['RUNTIME_RETRY_BACKOFF_SECONDS'] * attempts
+            leases.release(AgentTask, task_id, self.runtime_id, status='pending', error=str(error),
+                           available_at=now + timedelta(seconds=delay))
+        else:
+            leases.release(AgentTask, task_id, self.runtime_id, status='failed', error=str(error), finished_at=now)
+        use_agent_shard(agent_id)
+        db.session.add(AgentLog(
+            agent_id=agent_id,
+            level='warning' if retry else 'error',
+            message=f'Task {task_id} attempt {attempts} failed: {error}'
+        ))
+        db.session.commit()
+
+
+def _run_process(app, workers, shutdown_timeout):
+    """在当前进程中运行一个运行时，直到收到SIGTERM或SIGINT"""
+    runtime = AgentRuntime(app, workers=workers)
+    stopped = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stopped.set())
+    runtime.start()
+    # 运行时跟随智能体状态执行任务，同时负责其模型的预热（未启用时不启动）
+    start_warmup_manager(app)
+    app.logger.info('Agent runtime %s started with %d workers', runtime.runtime_id, runtime.workers)
+    stopped.wait()
+    runtime.stop(timeout=shutdown_timeout)
+
+
+def run(app, workers=None, processes=1, shutdown_timeout=None):
+    """运行智能体运行时；processes大于1时fork多个进程（仅Linux/macOS），充分利用多核"""
+    if processes <= 1:
+        _run_process(app, workers, shutdown_timeout)
+        return
+
+    from serve import dispose_engines
+
+    # fork前丢弃连接池，子进程各自建立连接
+    dispose_engines(app)
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_process(app, workers, shutdown_timeout)
+            except Exception:
+                app.logger.exception('Agent runtime process failed')
+                code = 1
+            os._exit(code)
+        children.append(pid)
+
+    def forward(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for child in children:
+        while True:
+            try:
+                os.waitpid(child, 0)
+                break
+            except InterruptedError:
+                continue
@@ -0,0 +1,300 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, select
+
+from db_routing import RoutingSession
+from models import db, Agent, Model, Role, User
+from query_budget import exempt_from_query_budget
+
+# 可搜索的对象：类型 -> (模型, 返回的字段, 参与匹配的字段)
+SEARCH_TYPES = {
+    'agents': (Agent, ('id', 'name', 'status', 'model_id'), ('name',)),
+    'models': (Model, ('id', 'name', 'model_name', 'status'), ('name',)),
+    'users': (User, ('id', 'username', 'email', 'status'), ('username', 'email')),
+    'roles': (Role, ('id', 'name', 'status'), ('name',)),
+}
+_TYPES_BY_MODEL = {model: search_type for search_type, (model, _, _) in SEARCH_TYPES.items()}
+# 查询词短于该长度时只做前缀匹配，单个字符的子串匹配几乎命中所有名称
+MIN_SUBSTRING_LENGTH = 2
+
+_start_lock = threading.Lock()
+
+
+def load_search_config(app, environ):
+    """从环境变量读取搜索索引配置"""
+    # 索引定期从数据库重建的间隔，用于同步其他进程的修改；本进程的修改在提交时立即更新索引
+    app.config['SEARCH_REFRESH_SECONDS'] = float(environ.get('SEARCH_REFRESH_SECONDS', '60'))
+    app.config['SEARCH_MAX_LIMIT'] = int(environ.get('SEARCH_MAX_LIMIT', '50'))
+
+
+def _normalize(value):
+    # 换行符用作子串匹配时各名称之间的分隔符
+    return (value or '').casefold().replace('\n', ' ')
+
+
+class NameIndex:
+    """一类对象的名称索引：按名称排序的(名称, ID)列表用于前缀匹配，拼接后的名称用于子串匹配"""
+
+    def __init__(self, fields, key_fields):
+        self.fields = fields
+        self.key_fields = key_fields
+        self.items = {}     # ID -> (匹配的名称, 返回的字段)
+        self.entries = []   # 按名称排序的(名称, ID)
+        self._joined = None
+
+    def fill(self, payloads):
+        """一次性载入全部对象，比逐个插入快"""
+        for payload in payloads:
+            keys = tuple(_normalize(payload[field]) for field in self.key_fields)
+            self.items[payload['id']] = (keys, payload)
+            self.entries.extend((key, payload['id']) for key in set(keys))
+        self.entries.sort()
+        self._joined = None
+
+    def put(self, item_id, payload):
+        """添加或更新一个对象，payload可以只包含修改的字段"""
+        current = self.items.get(item_id)
+        if current is not None:
+            payload = {**current[1], **payload}
+        elif len(payload) < len(self.fields):
+            # 字段不全的新对象等下次重建时再加入
+            return
+        keys = tuple(_normalize(payload[field]) for field in self.key_fields)
+        if current is not None and current[0] == keys:
+            # 名称未变，只更新返回的字段（例如智能体状态）
+            self.items[item_id] = (keys, payload)
+            return
+        self.remove(item_id)
+        self.items[item_id] = (keys, payload)
+        for key in set(keys):
+            self.entries.insert(bisect_left(self.entries, (key, item_id)), (key, item_id))
+        self._joined = None
+
+    def remove(self, item_id):
+        current = self.items.pop(item_id, None)
+        if current is None:
+            return
+        for key in set(current[0]):
+            index = bisect_left(self.entries, (key, item_id))
+            if index < len(self.entries) and self.entries[index] == (key, item_id):
+                del self.entries[index]
+        self._joined = None
+
+    def _joined_names(self):
+        """所有名称按顺序以换行符拼接的字符串及各名称的起始位置，修改后首次子串查询时重建"""
+        if self._joined is None:
+            starts, position = [], 0
+            for key, _ in self.entries:
+                starts.append(position)
+                position += len(key) + 1
+            self._joined = ('\n'.join(key for key, _ in self.entries), starts)
+        return self._joined
+
+    def search(self, query, limit):
+        """先返回名称以query开头的对象，再返回名称包含query的对象，各自按名称排序"""
+        query = _normalize(query)
+        found = []
+        seen = set()
+        index = bisect_left(self.entries, (query,))
+        while index < len(self.entries) and len(found) < limit:
+            key, item_id = self.entries[index]
+            if not key.startswith(query):
+                break
+            if item_id not in seen:
+                seen.add(item_id)
+                found.append(item_id)
+            index += 1
+
+        if len(found) < limit and len(query) >= MIN_SUBSTRING_LENGTH:
+            joined, starts = self._joined_names()
+            position = joined.find(query)
+            while position >= 0 and len(found) < limit:
+                index = bisect_right(starts, position) - 1
+                item_id = self.entries[index][1]
+                # 从名称开头匹配的已在前缀匹配中返回
+                if position > starts[index] and item_id not in seen:
+                    seen.add(item_id)
+                    found.append(item_id)
+                if index + 1 >= len(starts):
+                    break
+                position = joined.find(query, starts[index + 1])
+        return [dict(self.items[item_id][1]) for item_id in found]
+
+
+@exempt_from_query_budget
+def _load_indexes():
+    """从数据库构建全部索引"""
+    indexes = {}
+    for search_type, (model, fields, key_fields) in SEARCH_TYPES.items():
+        query = select(*(getattr(model, field) for field in fields))
+        if hasattr(model, 'deleted_at'):
+            query = query.where(model.deleted_at.is_(None))
+        index = NameIndex(fields, key_fields)
+        index.fill(dict(zip(fields, row)) for row in db.session.execute(query).tuples())
+        indexes[search_type] = index
+    db.session.commit()
+    return indexes
+
+
+class SearchIndexes:
+    """进程内的名称索引，首次搜索时从数据库构建
+
+    本进程提交的创建、修改和删除在提交后立即应用到索引；其他进程的修改通过每SEARCH_REFRESH_SECONDS
+    在后台重建一次索引同步，重建期间继续使用旧索引，重建时读到的数据之后提交的修改会在切换前重放。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._indexes = None
+        self._built_at = 0
+        self._replay = None  # 重建期间提交的修改
+
+    @property
+    def active(self):
+        """索引已构建或正在构建，此时需要记录提交的修改"""
+        return self._indexes is not None or self._replay is not None
+
+    def search(self, search_type, query, limit):
+        if self._indexes is None:
+            with self._build_lock:
+                if self._indexes is None:
+                    self._rebuild()
+        elif time.monotonic() - self._built_at > self.config['SEARCH_REFRESH_SECONDS']:
+            self._start_refresh()
+        with self._lock:
+            return self._indexes[search_type].search(query, limit)
+
+    def apply(self, changes):
+        """应用已提交的修改：{(类型, ID): 返回的字段，删除时为None}"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.extend(changes.items())
+            if self._indexes is None:
+                return
+            for (search_type, item_id), payload in changes.items():
+                index = self._indexes[search_type]
+                if payload is None:
+                    index.remove(item_id)
+                else:
+                    index.put(item_id, payload)
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._replay is not None:
+                return
+            self._replay = []
+            self._built_at = time.monotonic()
+        threading.Thread(target=self._refresh, name='search-index', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            with self.app.app_context():
+                self._rebuild()
+        except Exception:
+            self.app.logger.exception('Failed to rebuild search index')
+
+    def _rebuild(self):
+        with self._lock:
+            if self._replay is None:
+                self._replay = []
+        try:
+            indexes = _load_indexes()
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            for (search_type, item_id), payload in self._replay:
+                if payload is None:
+                    indexes[search_type].remove(item_id)
+                else:
+                    indexes[search_type].put(item_id, payload)
+            self._indexes = indexes
+            self._built_at = time.monotonic()
+            self._replay = None
+
+
+def get_search_indexes(app):
+    """当前应用的搜索索引"""
+    indexes = app.extensions.get('search')
+    if indexes is None:
+        with _start_lock:
+            indexes = app.extensions.get('search')
+            if indexes is None:
+                indexes = app.extensions['search'] = SearchIndexes(app)
+    return indexes
+
+
+def search(search_type, query, limit):
+    """按名称前缀和子串查找一类对象"""
+    return get_search_indexes(current_app._get_current_object()).search(search_type, query, limit)
+
+
+def _indexes_in_use():
+    if not has_app_context():
+        return None
+    indexes = current_app.extensions.get('search')
+    return indexes if indexes is not None and indexes.active else None
+
+
+def _after_flush(session, flush_context):
+    """记录本次flush中被索引对象的修改，提交后再应用"""
+    if _indexes_in_use() is None:
+        return
+    changes = session.info.setdefault('search_changes', {})
+    for obj in session.deleted:
+        search_type = _TYPES_BY_MODEL.get(type(obj))
+        if search_type is not None:
+            changes[(search_type, inspect(obj).identity[0])] = None
+    for obj in list(session.new) + list(session.dirty):
+        search_type = _TYPES_BY_MODEL.get(type(obj))
+        if search_type is None:
+            continue
+        _, fields, _ = SEARCH_TYPES[search_type]
+        # 只读取已加载的字段，不为索引发出额外的查询
+        state = inspect(obj)
+        loaded = state.dict
+        key = (search_type, state.identity[0] if state.identity else loaded['id'])
+        if loaded.get('deleted_at') is not None:
+            changes[key] = None
+        elif changes.get(key, {}) is not None:
+            changes[key] = {**changes.get(key, {}), **{field: loaded[field] for field in fields if field in loaded}}
+
+
+def _after_commit(session):
+    changes = session.info.pop('search_changes', None)
+    if not changes:
+        return
+    if session.info.get('deferred_commit'):
+        # 事务批处理：子请求的提交只释放保存点，等外层事务提交后再应用
+        session.info.setdefault('search_committed', {}).update(changes)
+        return
+    indexes = _indexes_in_use()
+    if indexes is not None:
+        indexes.apply(changes)
+
+
+def _after_rollback(session):
+    session.info.pop('search_changes', None)
+
+
+def apply_deferred_changes(session):
+    """外层事务提交后，应用会话中延迟的索引修改"""
+    changes = session.info.pop('search_committed', None)
+    indexes = _indexes_in_use()
+    if changes and indexes is not None:
+        indexes.apply(changes)
+
+
+def configure_search():
+    """注册会话事件，只需注册一次"""
+    for name, listener in (('after_flush', _after_flush), ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(RoutingSession, name, listener):
+            event.listen(RoutingSession, name, listener)
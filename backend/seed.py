@@ -0,0 +1,308 @@
+"""合成数据生成：按接近生产的规模和分布批量写入模型、智能体、对话、消息、日志、角色和用户
+
+数据以批量INSERT（executemany）直接写表，不经过ORM事件；对话的消息数和agent_stats在生成时一并算出写入，
+生成后不需要再执行repair-stats。各表的ID从现有的最大ID之后连续分配，可以在已有数据上追加。
+启用分片时，智能体按一致性哈希分配分片，其对话、消息、日志和统计直接写入所在分片。
+"""
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from sqlalchemy import func, select
+
+from db_routing import SHARDED_TABLES
+from models import db, Agent, AgentLog, AgentStats, Conversation, Message, Model, Role, User
+from shards import data_binds, shard_for
+
+# 预设规模，命令行参数可以单独覆盖其中的某一项
+SCALES = {
+    'small': {'agents': 100, 'conversations': 10_000, 'messages': 200_000, 'logs': 200_000,
+              'roles': 20, 'users': 1_000},
+    'medium': {'agents': 1_000, 'conversations': 100_000, 'messages': 5_000_000, 'logs': 10_000_000,
+               'roles': 50, 'users': 10_000},
+    'production': {'agents': 10_000, 'conversations': 1_000_000, 'messages': 50_000_000, 'logs': 100_000_000,
+                   'roles': 100, 'users': 100_000},
+}
+
+# 日志级别的比例
+LOG_LEVEL_WEIGHTS = (('info', 70), ('debug', 15), ('warning', 10), ('error', 5))
+# 智能体状态的比例
+AGENT_STATUS_WEIGHTS = (('inactive', 50), ('running', 20), ('stopped', 20), ('paused', 10))
+# 对话和日志在智能体之间按Zipf分布，少数智能体承担大部分流量
+AGENT_SKEW = 1.0
+# 每段对话的消息数按对数正态分布，sigma越大长对话越多
+MESSAGE_SIGMA = 1.2
+
+_WORDS = ('agent model request response token context prompt answer question summary result error retry '
+          'timeout cache index query page batch stream user assistant system tool plan step check update '
+          'report data value config status task queue worker latency throughput').split()
+_LOG_TEMPLATES = {
+    'info': ('Chat completed for conversation {}', 'Task {} finished', 'Agent status changed to {}'),
+    'debug': ('Prompt built with {} messages', 'Model call took {} ms', 'Cache lookup for {}'),
+    'warning': ('Model call slow: {} ms', 'Retrying request {}', 'Rate limit close for {}'),
+    'error': ('Model API error: {}', 'Task {} failed', 'Callback delivery failed: {}'),
+}
+
+
+class Generator:
+    """按给定的规模生成数据；seed相同时生成的数据相同（ID偏移和时间窗口除外）"""
+
+    def __init__(self, counts, batch_size=10_000, days=90, message_length=200, seed=None, echo=None):
+        self.counts = counts
+        self.batch_size = batch_size
+        self.message_length = message_length
+        self.random = random.Random(seed)
+        self.echo = echo or (lambda message: None)
+        self.end = datetime.utcnow()
+        self.start = self.end - timedelta(days=days)
+        self.inserted = Counter()
+        self._echoed_at = 0.0
+        # 拼接消息内容用的语料，按随机偏移截取
+        self.corpus = ' '.join(self.random.choice(_WORDS) for _ in range(max(20_000, message_length)))
+        # 每个生成的智能体的统计，最后写入agent_stats
+        self.agent_stats = defaultdict(Counter)
+        self.agent_activity = {}
+        # 每个生成的智能体所在的分片，None为主库
+        self.agent_shards = {}
+
+    def _next_id(self, column):
+        """现有最大ID之后的ID；分片表取主库和各分片中最大的，各库的ID不重叠"""
+        binds = data_binds() if column.table.name in SHARDED_TABLES else [None]
+        largest = 0
+        for key in binds:
+            with db.engines[key].connect() as connection:
+                largest = max(largest, connection.execute(select(func.max(column))).scalar() or 0)
+        return largest + 1
+
+    def _insert(self, model, rows, shard=None):
+        """在一个事务中批量插入一批行，shard为写入的分片（None为主库）"""
+        if not rows:
+            return
+        with db.engines[shard].begin() as connection:
+            connection.execute(model.__table__.insert(), rows)
+        self.inserted[model.__tablename__] += len(rows)
+
+    def _insert_by_shard(self, model, rows):
+        """按智能体所在的分片分组，分批插入带agent_id的行"""
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[self.agent_shards.get(row['agent_id'])].append(row)
+        for shard, shard_rows in grouped.items():
+            for index in range(0, len(shard_rows), self.batch_size):
+                self._insert(model, shard_rows[index:index + self.batch_size], shard)
+
+    def _batches(self, model, rows):
+        """分批插入产出的行，每批单独提交"""
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._insert(model, batch)
+                batch = []
+        self._insert(model, batch)
+
+    def _time(self, position, total):
+        """第position个（共total个）对象的时间，随ID单调增加并在时间窗口内均匀分布"""
+        span = (self.end - self.start).total_seconds()
+        return self.start + timedelta(seconds=span * (position + self.random.random()) / max(total, 1))
+
+    def _text(self, length):
+        offset = self.random.randrange(len(self.corpus) - length)
+        return self.corpus[offset:offset + length]
+
+    def _progress(self, label, done, total, started):
+        """每5秒及完成时输出一次进度"""
+        now = time.perf_counter()
+        if done < total and now - self._echoed_at < 5:
+            return
+        self._echoed_at = now
+        rate = done / (now - started) if now > started else 0
+        self.echo(f'{label}: {done}/{total} ({rate:,.0f}/s)')
+
+    def models(self):
+        first = self._next_id(Model.id)
+        count = max(1, self.counts['agents'] // 2000 + 3)
+        self._insert(Model, [{
+            'id': first + i, 'name': f'seed-model-{first + i}', 'description': 'Synthetic model',
+            'api_endpoint': 'http://127.0.0.1:5999/v1/chat/completions', 'model_name': 'stub',
+            'status': 'active', 'created_at': self.start, 'updated_at': self.start,
+        } for i in range(count)])
+        return list(range(first, first + count))
+
+    def agents(self, model_ids):
+        first = self._next_id(Agent.id)
+        statuses, weights = zip(*AGENT_STATUS_WEIGHTS)
+
+        def rows():
+            for i in range(self.counts['agents']):
+                created_at = self._time(i, self.counts['agents'])
+                shard = self.agent_shards[first + i] = shard_for(first + i)
+                yield {'id': first + i, 'name': f'seed-agent-{first + i}', 'description': self._text(60),
+                       'model_id': self.random.choice(model_ids),
+                       'status': self.random.choices(statuses, weights)[0], 'shard': shard,
+                       'created_at': created_at, 'updated_at': created_at}
+
+        self._batches(Agent, rows())
+        agent_ids = list(range(first, first + self.counts['agents']))
+        # 打乱排名，使流量最大的智能体不总是ID最小的
+        ranked = agent_ids[:]
+        self.random.shuffle(ranked)
+        self.agent_ids = ranked
+        self.agent_weights = list(accumulate(1 / (rank + 1) ** AGENT_SKEW for rank in range(len(ranked))))
+        return agent_ids
+
+    def _pick_agents(self, k):
+        return self.random.choices(self.agent_ids, cum_weights=self.agent_weights, k=k)
+
+    def _message_counts(self, start, stop):
+        """第start到stop段对话的消息数，按对数正态分布，总数恰好为messages"""
+        total, conversations = self.counts['messages'], self.counts['conversations']
+        target = total * stop // conversations - total * start // conversations
+        # 通过对话产生的对话至少有一问一答
+        minimum = 2 if total >= 2 * conversations else 0
+        weights = [self.random.lognormvariate(0, MESSAGE_SIGMA) for _ in range(stop - start)]
+        scale = (target - minimum * len(weights)) / sum(weights)
+        counts, carried, assigned = [], 0.0, 0
+        for weight in weights:
+            carried += weight * scale
+            count = int(carried) - assigned
+            assigned += count
+            counts.append(minimum + count)
+        counts[-1] += target - minimum * len(weights) - assigned
+        return counts
+
+    def _messages(self, conversation_pk, created_at, count):
+        """一段对话的消息，user和assistant交替，回复在几秒内，下一个问题在几分钟内"""
+        timestamp = created_at
+        for i in range(count):
+            if i % 2 == 0:
+                role, length = 'user', self.random.randint(self.message_length // 4, self.message_length)
+                gap = self.random.uniform(10, 600) if i else 0
+            else:
+                role, length = 'assistant', self.random.randint(self.message_length // 2, self.message_length * 2)
+                gap = self.random.uniform(1, 20)
+            timestamp = min(timestamp + timedelta(seconds=gap), self.end)
+            yield {'conversation_id': conversation_pk, 'role': role, 'content': self._text(length),
+                   'timestamp': timestamp}
+
+    def conversations(self):
+        """对话和它们的消息按批交替写入，每批对话先写入，再写入这批对话的消息"""
+        total = self.counts['conversations']
+        if not total:
+            return
+        conversation_first = self._next_id(Conversation.id)
+        message_id = self._next_id(Message.id)
+        # 每批对话的消息数约为batch_size
+        chunk = max(1, min(self.batch_size, self.batch_size * total // max(self.counts['messages'], 1)))
+        started = time.perf_counter()
+        for start in range(0, total, chunk):
+            stop = min(start + chunk, total)
+            counts = self._message_counts(start, stop)
+            conversations, messages = [], defaultdict(list)
+            for offset, (agent_id, count) in enumerate(zip(self._pick_agents(stop - start), counts)):
+                pk = conversation_first + start + offset
+                created_at = self._time(start + offset, total)
+                last_message_at = None
+                for message in self._messages(pk, created_at, count):
+                    message['id'] = message_id
+                    message_id += 1
+                    last_message_at = message['timestamp']
+                    messages[self.agent_shards.get(agent_id)].append(message)
+                conversations.append({
+                    'id': pk, 'agent_id': agent_id, 'conversation_id': str(uuid.UUID(
+                        int=self.random.getrandbits(128), version=4)),
+                    'message_count': count, 'last_message_at': last_message_at,
+                    'created_at': created_at, 'updated_at': last_message_at or created_at,
+                })
+                stats = self.agent_stats[agent_id]
+                stats['conversation_count'] += 1
+                stats['message_count'] += count
+                self._keep_latest(agent_id, last_message_at)
+            self._insert_by_shard(Conversation, conversations)
+            for shard, shard_messages in messages.items():
+                for index in range(0, len(shard_messages), self.batch_size):
+                    self._insert(Message, shard_messages[index:index + self.batch_size], shard)
+            self._progress('message', self.inserted['message'], self.counts['messages'], started)
+
+    def logs(self):
+        total = self.counts['logs']
+        first = self._next_id(AgentLog.id)
+        levels, weights = zip(*LOG_LEVEL_WEIGHTS)
+        cum_weights = list(accumulate(weights))
+        started = time.perf_counter()
+        for start in range(0, total, self.batch_size):
+            stop = min(start + self.batch_size, total)
+            rows = []
+            for offset, (agent_id, level) in enumerate(zip(
+                    self._pick_agents(stop - start),
+                    self.random.choices(levels, cum_weights=cum_weights, k=stop - start))):
+                timestamp = self._time(start + offset, total)
+                rows.append({'id': first + start + offset, 'agent_id': agent_id, 'level': level,
+                             'message': self.random.choice(_LOG_TEMPLATES[level]).format(
+                                 self.random.randrange(100_000)),
+                             'timestamp': timestamp})
+                stats = self.agent_stats[agent_id]
+                stats['log_count'] += 1
+                stats[f'{level}_log_count'] += 1
+                self._keep_latest(agent_id, timestamp)
+            self._insert_by_shard(AgentLog, rows)
+            self._progress('log', stop, total, started)
+
+    def _keep_latest(self, agent_id, timestamp):
+        if timestamp is not None and (self.agent_activity.get(agent_id) is None
+                                      or self.agent_activity[agent_id] < timestamp):
+            self.agent_activity[agent_id] = timestamp
+
+    def stats(self, agent_ids):
+        """为生成的智能体写入统计，与stats维护的计数一致"""
+        columns = ('conversation_count', 'message_count', 'log_count') + tuple(
+            f'{level}_log_count' for level, _ in LOG_LEVEL_WEIGHTS)
+        self._insert_by_shard(AgentStats, [
+            dict({column: self.agent_stats[agent_id][column] for column in columns},
+                 agent_id=agent_id, last_activity_at=self.agent_activity.get(agent_id))
+            for agent_id in agent_ids])
+
+    def roles_and_users(self):
+        role_first = self._next_id(Role.id)
+        role_ids = list(range(role_first, role_first + self.counts['roles']))
+        self._insert(Role, [{
+            'id': role_id, 'name': f'seed-role-{role_id}', 'description': self._text(40), 'status': 'active',
+            'created_at': self.start, 'updated_at': self.start,
+        } for role_id in role_ids])
+        user_first = self._next_id(User.id)
+
+        def rows():
+            for i in range(self.counts['users']):
+                user_id = user_first + i
+                created_at = self._time(i, self.counts['users'])
+                # 约十分之一的用户没有角色
+                role_id = self.random.choice(role_ids) if role_ids and self.random.random() >= 0.1 else None
+                yield {'id': user_id, 'username': f'seed-user-{user_id}', 'email': f'seed-user-{user_id}@example.com',
+                       'password': 'seed', 'role_id': role_id, 'status': 'active',
+                       'created_at': created_at, 'updated_at': created_at}
+
+        self._batches(User, rows())
+
+    def run(self):
+        """生成全部数据，返回各表插入的行数"""
+        if not self.counts['agents'] and (self.counts['conversations'] or self.counts['logs']):
+            raise ValueError('Conversations and logs need at least one agent')
+        agent_ids = []
+        if self.counts['agents']:
+            agent_ids = self.agents(self.models())
+            self.echo(f'agent: {len(agent_ids)}')
+        self.roles_and_users()
+        self.echo(f'role: {self.counts["roles"]}, user: {self.counts["users"]}')
+        self.conversations()
+        self.logs()
+        self.stats(agent_ids)
+        return dict(self.inserted)
+
+
+def generate(counts, batch_size=10_000, days=90, message_length=200, seed=None, echo=None):
+    """按counts（各表的行数，键同SCALES中的规模）生成数据，需要在应用上下文中调用，返回各表插入的行数"""
+    return Generator(counts, batch_size=batch_size, days=days, message_length=message_length,
+                     seed=seed, echo=echo).run()
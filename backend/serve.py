@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+
+import deletion
+import jobs
+from models import db
+
+# 多进程服务的默认配置，均可通过环境变量覆盖
+SERVE_DEFAULTS = {
+    'SERVE_BIND': '0.0.0.0:5003',
+    'SERVE_WORKERS': str(multiprocessing.cpu_count() * 2 + 1),
+    'SERVE_THREADS': '4',                 # 每个工作进程的线程数
+    'SERVE_MAX_REQUESTS': '1000',         # 工作进程处理多少请求后回收，0表示不回收
+    'SERVE_MAX_REQUESTS_JITTER': '100',   # 随机抖动，避免所有进程同时回收
+    'SERVE_TIMEOUT': '300',               # 单个请求的最长处理时间，需大于模型响应时间
+    'SERVE_GRACEFUL_TIMEOUT': '120',      # 优雅退出时等待进行中对话完成的秒数
+    'SERVE_KEEPALIVE': '5',
+}
+
+
+def load_serve_options(environ, overrides=None):
+    """根据环境变量和命令行参数（overrides，键同环境变量）生成gunicorn配置"""
+    settings = {key: environ.get(key, default) for key, default in SERVE_DEFAULTS.items()}
+    settings.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    threads = int(settings['SERVE_THREADS'])
+    return {
+        'bind': settings['SERVE_BIND'],
+        'workers': int(settings['SERVE_WORKERS']),
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'max_requests': int(settings['SERVE_MAX_REQUESTS']),
+        'max_requests_jitter': int(settings['SERVE_MAX_REQUESTS_JITTER']),
+        'timeout': int(settings['SERVE_TIMEOUT']),
+        'graceful_timeout': int(settings['SERVE_GRACEFUL_TIMEOUT']),
+        'keepalive': int(settings['SERVE_KEEPALIVE']),
+        # 主进程中预先加载应用，工作进程fork后直接复用，启动更快
+        'preload_app': True,
+    }
+
+
+def dispose_engines(app, close=True):
+    """丢弃连接池中的连接
+
+    fork之后子进程不能复用父进程的数据库连接，close=False时只丢弃连接而不关闭，
+    避免影响父进程仍在使用的连接。
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
+def stop_embedded_executors(app, timeout):
+    """停止工作进程中的内嵌异步任务和删除执行器，各自最多等待timeout秒"""
+    jobs.stop_embedded_executor(app, min(timeout, app.config['CHAT_JOBS_SHUTDOWN_SECONDS']))
+    deletion.stop_embedded_executor(app, min(timeout, app.config['DELETION_SHUTDOWN_SECONDS']))
+
+
+def run(app, options):
+    """以预fork多进程模式运行应用（基于gunicorn，仅支持Linux/macOS）"""
+    from gunicorn.app.base import BaseApplication
+
+    class StandaloneApplication(BaseApplication):
+        def __init__(self, application, settings):
+            self.application = application
+            self.settings = settings
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.settings.items():
+                self.cfg.set(key, value)
+            self.cfg.set('when_ready', self.when_ready)
+            self.cfg.set('post_fork', self.post_fork)
+            self.cfg.set('worker_exit', self.worker_exit)
+
+        def load(self):
+            return self.application
+
+        def when_ready(self, server):
+            # 主进程加载应用时可能已建立连接，fork前全部关闭
+            dispose_engines(self.application)
+            server.log.info('Serving with %s workers x %s threads',
+                            self.settings['workers'], self.settings['threads'])
+
+        def post_fork(self, server, worker):
+            dispose_engines(self.application, close=False)
+
+        def worker_exit(self, server, worker):
+            # 工作进程退出（回收或优雅关闭）时，进行中的请求已处理完毕；停止内嵌执行器，
+            # 剩余的优雅退出时间内未完成的任务交还队列，而不是随线程中断后等租约过期
+            stop_embedded_executors(self.application, self.settings['graceful_timeout'] / 2)
+            dispose_engines(self.application)
+
+    StandaloneApplication(app, options).run()
+
+
+if __name__ == '__main__':
+    from app import create_app
+    run(create_app(), load_serve_options(os.environ))
@@ -0,0 +1,299 @@
+import bisect
+import hashlib
+import heapq
+import itertools
+import math
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import MetaData
+from sqlalchemy.orm.attributes import set_committed_value
+
+from db_routing import SHARD_INFO_KEY, SHARDED_TABLES
+from models import db, Agent
+from query_budget import exempt_from_query_budget
+from turns import ConversationBusy
+
+# 分片在SQLALCHEMY_BINDS中的键前缀，键按DB_SHARD_URIS中的顺序编号
+SHARD_BIND_PREFIX = 'shard_'
+# 迁移中的智能体建议的重试等待秒数
+MOVING_RETRY_AFTER = 5
+# 进程内记住的对话所在分片的最大条目数，超过后清空
+LOCATE_CACHE_SIZE = 10000
+
+_located = {}
+_missing = object()
+
+
+class ShardMoving(ConversationBusy):
+    """智能体的数据正在迁移到其他分片，迁移结束前不能开始新的对话轮次"""
+
+    def __init__(self, agent_id):
+        super().__init__(f'Data of agent {agent_id} is being moved to another shard, try again later',
+                         retry_after=MOVING_RETRY_AFTER)
+
+
+def shard_binds(uris):
+    """分片URI列表对应的{bind键: URI}"""
+    return {f'{SHARD_BIND_PREFIX}{index}': uri for index, uri in enumerate(uris)}
+
+
+def load_shard_config(app, environ):
+    """从环境变量读取分片配置，分片以bind的形式注册到Flask-SQLAlchemy"""
+    uris = [uri.strip() for uri in environ.get('DB_SHARD_URIS', '').split(',') if uri.strip()]
+    binds = shard_binds(uris)
+    app.config.setdefault('SQLALCHEMY_BINDS', {}).update(binds)
+    app.config['DB_SHARD_KEYS'] = list(binds)
+    # 每个分片在哈希环上的虚拟节点数，越多智能体分布越均匀
+    app.config['DB_SHARD_VNODES'] = int(environ.get('DB_SHARD_VNODES', '64'))
+
+
+def _hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class ShardRing:
+    """一致性哈希环：每个分片在环上占vnodes个虚拟节点，智能体落在其哈希值之后的第一个节点所属的分片
+
+    增加一个分片时只有约1/N的智能体改变位置，其余智能体的数据不需要迁移。
+    """
+
+    def __init__(self, keys, vnodes):
+        points = sorted((_hash(f'{key}#{index}'), key) for key in keys for index in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._keys = [key for _, key in points]
+
+    def shard_for(self, agent_id):
+        """智能体应在的分片，没有分片时为None（主库）"""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._hashes, _hash(f'agent:{agent_id}')) % len(self._hashes)
+        return self._keys[index]
+
+
+def configure_shards(app):
+    """按配置的分片构建哈希环"""
+    app.extensions['shard_ring'] = ShardRing(app.config.get('DB_SHARD_KEYS') or [],
+                                             app.config.get('DB_SHARD_VNODES', 64))
+
+
+def shards_enabled():
+    return bool(current_app.config.get('DB_SHARD_KEYS'))
+
+
+def data_binds():
+    """保存分片表数据的数据库：主库（未分片前的数据和分片前创建的智能体）和各分片"""
+    return [None] + list(current_app.config.get('DB_SHARD_KEYS') or [])
+
+
+def shard_label(key):
+    return key or 'primary'
+
+
+def shard_for(agent_id):
+    """按一致性哈希计算智能体应在的分片"""
+    return current_app.extensions['shard_ring'].shard_for(agent_id)
+
+
+def current_shard():
+    """当前会话的分片，None为主库"""
+    return db.session.info.get(SHARD_INFO_KEY)
+
+
+def _is_sharded(obj):
+    return getattr(type(obj), '__tablename__', None) in SHARDED_TABLES
+
+
+def use_shard(key):
+    """让当前会话余下的分片表读写都在key对应的数据库中执行（None为主库）
+
+    不同分片的主键会重复，切换时把已加载的分片表对象移出会话；有未flush的分片表修改时不能切换。
+    """
+    session = db.session()
+    if session.info.get(SHARD_INFO_KEY) == key:
+        return
+    if any(_is_sharded(obj) for obj in itertools.chain(session.new, session.dirty, session.deleted)):
+        raise RuntimeError('Commit changes to sharded tables before switching shards')
+    for obj in list(session.identity_map.values()):
+        if _is_sharded(obj):
+            session.expunge(obj)
+    session.info[SHARD_INFO_KEY] = key
+
+
+@exempt_from_query_budget
+def _get_agent(agent_id):
+    # 启用分片时才需要先查智能体所在的分片，不计入请求的查询预算
+    return db.session.get(Agent, agent_id)
+
+
+def use_agent_shard(agent, write=False):
+    """当前会话切换到智能体数据所在的分片，agent为智能体或其ID
+
+    write为True时，数据正在迁移的智能体抛出ShardMoving。未启用分片时不做任何事。
+    """
+    if not shards_enabled():
+        return
+    if not isinstance(agent, Agent):
+        agent = _get_agent(agent)
+        if agent is None:
+            use_shard(None)
+            return
+    if write and agent.shard_moving_to is not None:
+        raise ShardMoving(agent.id)
+    use_shard(agent.shard)
+
+
+@exempt_from_query_budget
+def place_new_agents(session, agents):
+    """为刚插入的智能体按一致性哈希分配分片（在flush中调用），返回{bind键: [agent_id]}
+
+    记录分片的UPDATE只在启用分片时执行，不计入请求的查询预算。
+    """
+    placed = defaultdict(list)
+    ring = current_app.extensions.get('shard_ring')
+    for agent in agents:
+        key = ring.shard_for(agent.id) if ring is not None else None
+        placed[key].append(agent.id)
+        set_committed_value(agent, 'shard', key)
+    table = Agent.__table__
+    for key, ids in placed.items():
+        if key is not None:
+            session.connection().execute(table.update().where(table.c.id.in_(ids)).values(shard=key))
+    return placed
+
+
+def shard_connection(session, key):
+    """会话在key对应的数据库上的连接（与会话的其他写入在同一事务中提交）"""
+    return session.connection(bind_arguments={'bind': db.engines[key]})
+
+
+def scatter(function):
+    """在主库和每个分片上依次调用function（调用时会话已切换到对应的数据库），返回[(bind键, 结果)]
+
+    只有在主库上执行的语句计入请求的查询预算，其余语句数随分片数增长。
+    """
+    results = []
+    for index, key in enumerate(data_binds()):
+        use_shard(key)
+        results.append((key, function() if index == 0 else exempt_from_query_budget(function)()))
+    return results
+
+
+@exempt_from_query_budget
+def _placements(agent_ids):
+    """{agent_id: (所在分片, 名称)}"""
+    if not agent_ids:
+        return {}
+    return {agent_id: (shard, name) for agent_id, shard, name in
+            db.session.query(Agent.id, Agent.shard, Agent.name).filter(Agent.id.in_(agent_ids))}
+
+
+def _owned_rows(results):
+    """从scatter的结果[(bind键, 行列表)]中去掉不在智能体当前分片上的行（迁移过程中新旧分片上都有），
+    返回(各数据库的行列表, {agent_id: 名称})"""
+    placements = _placements({row.agent_id for _, rows in results for row in rows})
+    owned = [[row for row in rows if placements.get(row.agent_id, (key,))[0] == key] for key, rows in results]
+    return owned, {agent_id: name for agent_id, (_, name) in placements.items()}
+
+
+def _probe(model, filters, key):
+    use_shard(key)
+    obj = model.query.filter_by(**filters).first()
+    if obj is None:
+        return None
+    owner = db.session.get(Agent, obj.agent_id)
+    if owner is not None and owner.shard != key:
+        return None
+    return obj
+
+
+def locate(model, **filters):
+    """在主库和各分片中查找满足filters的第一个对象（对话或归档），找到时会话停留在其所在的分片
+
+    对象的所在分片记在进程内，之后先查该分片；未启用分片时只查一次主库。
+    """
+    if not shards_enabled():
+        return model.query.filter_by(**filters).first()
+    cache_key = (model.__tablename__, tuple(sorted(filters.items())))
+    binds = data_binds()
+    hint = _located.get(cache_key, _missing)
+    if hint in binds:
+        binds.remove(hint)
+        binds.insert(0, hint)
+    for index, key in enumerate(binds):
+        probe = _probe if index == 0 else exempt_from_query_budget(_probe)
+        obj = probe(model, filters, key)
+        if obj is not None:
+            if len(_located) >= LOCATE_CACHE_SIZE:
+                _located.clear()
+            _located[cache_key] = key
+            return obj
+    return None
+
+
+class MergedPage:
+    """跨分片合并后的一页，属性与Flask-SQLAlchemy的分页结果相同"""
+
+    def __init__(self, items, page, per_page, total):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def pages(self):
+        return math.ceil(self.total / self.per_page) if self.total else 0
+
+
+def paginate_shards(query_factory, sort_key, page, per_page, count_factory):
+    """跨分片分页：每个数据库取前page*per_page行，按sort_key降序归并后取出第page页
+
+    count_factory在每个数据库上返回维护的计数，为None时回退到COUNT(*)；深分页的代价随页码增长。
+    计数在每个数据库上都不计入请求的查询预算，预算只包括主库上的分页查询，与不分片时一致。
+    """
+    page = max(page, 1)
+    per_page = per_page if per_page > 0 else 20
+
+    @exempt_from_query_budget
+    def count(query):
+        total = count_factory()
+        if total is None:
+            total = query.order_by(None).count()
+        return total
+
+    def gather():
+        query = query_factory()
+        return query.limit(page * per_page).all(), count(query)
+
+    results = scatter(gather)
+    rows, _ = _owned_rows([(key, items) for key, (items, _) in results])
+    merged = heapq.merge(*rows, key=sort_key, reverse=True)
+    items = list(itertools.islice(merged, (page - 1) * per_page, page * per_page))
+    return MergedPage(items, page, per_page, sum(total or 0 for _, (_, total) in results))
+
+
+def merge_recent(query_factory, sort_key, limit):
+    """在主库和各分片上各取前limit行，按sort_key降序归并，返回最新的limit行及其智能体名称[(行, 名称)]"""
+    results = scatter(lambda: query_factory().limit(limit).all())
+    rows, names = _owned_rows(results)
+    return [(row, names.get(row.agent_id))
+            for row in itertools.islice(heapq.merge(*rows, key=sort_key, reverse=True), limit)]
+
+
+def create_shard_tables():
+    """在每个分片上创建缺失的分片表，去掉指向主库中的表的外键"""
+    keys = current_app.config.get('DB_SHARD_KEYS') or []
+    if not keys:
+        return
+    metadata = MetaData()
+    for table in db.metadata.sorted_tables:
+        if table.name in SHARDED_TABLES:
+            table.to_metadata(metadata)
+    for table in metadata.tables.values():
+        for foreign_key in list(table.foreign_keys):
+            if foreign_key.target_fullname.split('.')[0] not in SHARDED_TABLES:
+                foreign_key.parent.foreign_keys.discard(foreign_key)
+                table.foreign_keys.discard(foreign_key)
+                table.constraints.discard(foreign_key.constraint)
+    for key in keys:
+        metadata.create_all(db.engines[key])
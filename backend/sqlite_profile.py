@@ -0,0 +1,89 @@
+import threading
+from contextlib import contextmanager
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+# 只读的HTTP方法，这类请求中的事务以普通BEGIN（延迟加锁）开启
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# SQLite生产配置的默认值，均可通过同名环境变量覆盖
+SQLITE_PROFILE_DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',       # 预写日志，读写互不阻塞
+    'SQLITE_SYNCHRONOUS': 'NORMAL',     # WAL模式下NORMAL即可保证一致性
+    'SQLITE_CACHE_SIZE': '-64000',      # 负数表示KiB，约64MB页缓存
+    'SQLITE_MMAP_SIZE': '268435456',    # 256MB内存映射读
+    'SQLITE_TEMP_STORE': 'MEMORY',      # 临时表和索引放在内存中
+    'SQLITE_BUSY_TIMEOUT': '5000',      # 遇到锁时最多等待的毫秒数
+    'SQLITE_BEGIN_MODE': 'auto',        # auto, immediate, deferred
+}
+
+
+def load_sqlite_profile(app, environ):
+    """从环境变量读取SQLite配置写入app.config"""
+    app.config['SQLITE_PROFILE'] = environ.get('SQLITE_PROFILE', 'production')
+    for key, default in SQLITE_PROFILE_DEFAULTS.items():
+        app.config[key] = environ.get(key, default)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def deferred_reads():
+    """在其中开启的事务使用普通BEGIN（延迟加锁），用于后台执行器轮询时的只读查询
+
+    没有请求上下文的线程默认以BEGIN IMMEDIATE开启事务，空闲轮询也会拿写锁、与请求的写入竞争。
+    调用方需要在离开前提交或回滚只读事务，之后的写入照常以BEGIN IMMEDIATE开启。
+    """
+    previous = getattr(_local, 'deferred', False)
+    _local.deferred = True
+    try:
+        yield
+    finally:
+        _local.deferred = previous
+
+
+def _begin_statement(begin_mode):
+    """根据配置决定事务的BEGIN语句"""
+    if begin_mode == 'deferred' or getattr(_local, 'deferred', False):
+        return 'BEGIN'
+    if begin_mode == 'auto' and has_request_context() and request.method in READ_ONLY_METHODS:
+        return 'BEGIN'
+    # 写事务一开始就拿到RESERVED锁，避免延迟事务升级锁时直接报"database is locked"
+    return 'BEGIN IMMEDIATE'
+
+
+def apply_sqlite_profile(engine, config):
+    """为SQLite引擎注册连接参数和事务开启方式"""
+    if engine.dialect.name != 'sqlite' or config.get('SQLITE_PROFILE') != 'production':
+        return
+
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA cache_size = {int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA temp_store = {config['SQLITE_TEMP_STORE']}",
+    ]
+    begin_mode = config['SQLITE_BEGIN_MODE']
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        # 关闭pysqlite自带的事务管理，由下面的begin事件负责发出BEGIN
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def on_begin(conn):
+        conn.exec_driver_sql(_begin_statement(begin_mode))
+
+
+def configure_sqlite_engines(app, db):
+    """对当前应用的所有SQLite引擎应用生产配置，需要在应用上下文中调用"""
+    for engine in db.engines.values():
+        apply_sqlite_profile(engine, app.config)
@@ -0,0 +1,309 @@
+from collections import Counter, defaultdict
+
+from sqlalchemy import bindparam, case, event, inspect, select
+
+from db_routing import RoutingSession
+from models import db, Agent, AgentLog, AgentStats, ArchivedConversation, Conversation, Message
+from shards import data_binds, place_new_agents, shard_connection, use_shard
+
+# 单独计数的日志级别，其他级别只计入log_count
+LOG_LEVELS = ('info', 'warning', 'error', 'debug')
+
+
+def _later(column, value):
+    """column与value中较晚的时间，最后活动时间只前进不后退"""
+    return case((column.is_(None) | (column < value), value), else_=column)
+
+
+def _count_log(counts, level, delta):
+    counts['log_count'] += delta
+    if level in LOG_LEVELS:
+        counts[f'{level}_log_count'] += delta
+
+
+def _keep_latest(latest, key, timestamp):
+    if timestamp is not None and (latest.get(key) is None or latest[key] < timestamp):
+        latest[key] = timestamp
+
+
+def _stats_connection(session):
+    # 统计与对话、日志在同一个数据库中（启用分片时为会话当前的分片）
+    return session.connection(bind_arguments={'mapper': AgentStats})
+
+
+def _apply_agent_deltas(connection, deltas, activity):
+    """累加智能体计数：deltas为{agent_id: Counter(列名 -> 增量)}，activity为{agent_id: 最后活动时间}"""
+    table = AgentStats.__table__
+    for agent_id in set(deltas) | set(activity):
+        values = {name: table.c[name] + delta for name, delta in deltas.get(agent_id, {}).items() if delta}
+        if agent_id in activity:
+            values['last_activity_at'] = _later(table.c.last_activity_at, activity[agent_id])
+        if values:
+            connection.execute(table.update().where(table.c.agent_id == agent_id).values(**values))
+
+
+def _apply_message_deltas(connection, counts, latest):
+    """累加对话及其智能体的消息数，新消息同时更新对话的updated_at"""
+    conversations = Conversation.__table__
+    agent_stats = AgentStats.__table__
+    for conversation_pk, delta in counts.items():
+        timestamp = latest.get(conversation_pk)
+        # 显式设置updated_at，删除消息时不触发onupdate
+        values = {'message_count': conversations.c.message_count + delta, 'updated_at': conversations.c.updated_at}
+        agent_values = {'message_count': agent_stats.c.message_count + delta}
+        if timestamp is not None:
+            values.update(last_message_at=_later(conversations.c.last_message_at, timestamp),
+                          updated_at=_later(conversations.c.updated_at, timestamp))
+            agent_values['last_activity_at'] = _later(agent_stats.c.last_activity_at, timestamp)
+        connection.execute(conversations.update().where(conversations.c.id == conversation_pk).values(**values))
+        # 已软删除的对话不计入智能体
+        owner = (select(conversations.c.agent_id)
+                 .where(conversations.c.id == conversation_pk, conversations.c.deleted_at.is_(None))
+                 .scalar_subquery())
+        connection.execute(agent_stats.update().where(agent_stats.c.agent_id == owner).values(**agent_values))
+
+
+def _remove_conversations(connection, conversation_pks):
+    """对话被删除、软删除或归档时，从智能体的计数中减去该对话及其消息"""
+    conversations = Conversation.__table__
+    agent_stats = AgentStats.__table__
+    for conversation_pk in conversation_pks:
+        agent_id, message_count = (select(column).where(conversations.c.id == conversation_pk).scalar_subquery()
+                                   for column in (conversations.c.agent_id, conversations.c.message_count))
+        connection.execute(
+            agent_stats.update().where(agent_stats.c.agent_id == agent_id)
+            .values(conversation_count=agent_stats.c.conversation_count - 1,
+                    message_count=agent_stats.c.message_count - message_count))
+
+
+def _before_flush(session, flush_context, instances):
+    """对话和日志的删除在flush前计入（此时行还在，可以读取所属智能体和消息数）"""
+    deltas = defaultdict(Counter)
+    message_counts = Counter()
+    removed = []
+    for obj in session.deleted:
+        if isinstance(obj, AgentLog):
+            _count_log(deltas[obj.agent_id], obj.level, -1)
+        elif isinstance(obj, Message):
+            message_counts[obj.conversation_id] -= 1
+        elif isinstance(obj, Conversation) and obj.deleted_at is None:
+            removed.append(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Conversation):
+            history = inspect(obj).attrs.deleted_at.history
+            if history.added and history.added[0] is not None and not any(history.deleted):
+                removed.append(obj.id)
+    if not (deltas or message_counts or removed):
+        return
+    connection = _stats_connection(session)
+    _apply_agent_deltas(connection, deltas, {})
+    _apply_message_deltas(connection, message_counts, {})
+    _remove_conversations(connection, removed)
+
+
+def _after_flush(session, flush_context):
+    """新的智能体、对话、消息和日志在flush后计入（此时已分配ID），与写入在同一事务中"""
+    deltas = defaultdict(Counter)
+    activity = {}
+    message_counts = Counter()
+    latest = {}
+    agents = []
+    for obj in session.new:
+        if isinstance(obj, Message):
+            message_counts[obj.conversation_id] += 1
+            _keep_latest(latest, obj.conversation_id, obj.timestamp)
+        elif isinstance(obj, AgentLog):
+            _count_log(deltas[obj.agent_id], obj.level, 1)
+            _keep_latest(activity, obj.agent_id, obj.timestamp)
+        elif isinstance(obj, Conversation) and obj.deleted_at is None:
+            deltas[obj.agent_id]['conversation_count'] += 1
+        elif isinstance(obj, Agent):
+            agents.append(obj)
+    if agents:
+        # 新智能体的统计行建在分配给它的分片上
+        for key, ids in place_new_agents(session, agents).items():
+            shard_connection(session, key).execute(AgentStats.__table__.insert(),
+                                                   [{'agent_id': agent_id} for agent_id in ids])
+    if not (deltas or message_counts):
+        return
+    connection = _stats_connection(session)
+    _apply_agent_deltas(connection, deltas, activity)
+    _apply_message_deltas(connection, message_counts, latest)
+
+
+def release_log_counts(log_ids):
+    """批量删除日志前调用，从智能体的计数中减去这些日志（不提交事务）"""
+    rows = (
+        db.session.query(AgentLog.agent_id, AgentLog.level, db.func.count())
+        .filter(AgentLog.id.in_(log_ids))
+        .group_by(AgentLog.agent_id, AgentLog.level)
+        .all()
+    )
+    deltas = defaultdict(Counter)
+    for agent_id, level, count in rows:
+        _count_log(deltas[agent_id], level, -count)
+    _apply_agent_deltas(_stats_connection(db.session), deltas, {})
+
+
+def paginate(query, page, per_page, total):
+    """分页查询，total为维护的计数；为None（没有对应的计数）时回退到COUNT(*)"""
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False, count=total is None)
+    if total is not None:
+        pagination.total = total
+    return pagination
+
+
+def conversation_total(agent_id):
+    """智能体未删除的对话数，没有统计行时为0"""
+    return db.session.query(AgentStats.conversation_count).filter_by(agent_id=agent_id).scalar() or 0
+
+
+def log_total(agent_id=None, level=None):
+    """日志数，可按智能体和级别；没有统计行时为0
+
+    只有不单独计数的日志级别返回None（不执行查询），由调用方回退到COUNT(*)，语句数不变。
+    """
+    if level and level not in LOG_LEVELS:
+        return None
+    column = getattr(AgentStats, f'{level}_log_count' if level else 'log_count')
+    if agent_id is not None:
+        return db.session.query(column).filter(AgentStats.agent_id == agent_id).scalar() or 0
+    # 没有任何统计行时SUM为NULL
+    return db.session.query(db.func.coalesce(db.func.sum(column), 0)).scalar()
+
+
+def _chunks(column, batch_size, *criteria):
+    """按主键顺序分批产出满足criteria的ID列表"""
+    last = None
+    while True:
+        query = select(column).where(*criteria).order_by(column).limit(batch_size)
+        if last is not None:
+            query = query.where(column > last)
+        ids = list(db.session.execute(query).scalars())
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def _repair_conversations(ids, dry_run):
+    """按消息重算一批对话的消息数和最后消息时间，返回计数有误的对话数"""
+    actual = {
+        conversation_pk: (count, latest)
+        for conversation_pk, count, latest in db.session.execute(
+            select(Message.conversation_id, db.func.count(), db.func.max(Message.timestamp))
+            .where(Message.conversation_id.in_(ids))
+            .group_by(Message.conversation_id))
+    }
+    fixes = []
+    for conversation_pk, count, last_message_at, updated_at in db.session.execute(
+            select(Conversation.id, Conversation.message_count, Conversation.last_message_at, Conversation.updated_at)
+            .where(Conversation.id.in_(ids))):
+        expected_count, latest = actual.get(conversation_pk, (0, None))
+        expected_updated = max(updated_at, latest) if updated_at and latest else updated_at or latest
+        if (count, last_message_at, updated_at) != (expected_count, latest, expected_updated):
+            fixes.append({'pk': conversation_pk, 'count': expected_count, 'latest': latest,
+                          'updated': expected_updated})
+    if fixes and not dry_run:
+        table = Conversation.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('pk'))
+            .values(message_count=bindparam('count'), last_message_at=bindparam('latest'),
+                    updated_at=bindparam('updated')), fixes)
+    return len(fixes)
+
+
+def _repair_agents(ids, dry_run):
+    """按对话和日志重算一批智能体的统计，返回统计有误或缺失的智能体数"""
+    expected = {agent_id: Counter() for agent_id in ids}
+    activity = {}
+    for agent_id, count, messages, latest in db.session.execute(
+            select(Conversation.agent_id, db.func.count(), db.func.sum(Conversation.message_count),
+                   db.func.max(Conversation.last_message_at))
+            .where(Conversation.agent_id.in_(ids), Conversation.deleted_at.is_(None))
+            .group_by(Conversation.agent_id)):
+        expected[agent_id].update(conversation_count=count, message_count=messages or 0)
+        _keep_latest(activity, agent_id, latest)
+    for agent_id, level, count, latest in db.session.execute(
+            select(AgentLog.agent_id, AgentLog.level, db.func.count(), db.func.max(AgentLog.timestamp))
+            .where(AgentLog.agent_id.in_(ids))
+            .group_by(AgentLog.agent_id, AgentLog.level)):
+        _count_log(expected[agent_id], level, count)
+        _keep_latest(activity, agent_id, latest)
+    for agent_id, latest in db.session.execute(
+            select(ArchivedConversation.agent_id, db.func.max(ArchivedConversation.last_activity_at))
+            .where(ArchivedConversation.agent_id.in_(ids))
+            .group_by(ArchivedConversation.agent_id)):
+        _keep_latest(activity, agent_id, latest)
+
+    current = {stats.agent_id: stats for stats in AgentStats.query.filter(AgentStats.agent_id.in_(ids))}
+    columns = ('conversation_count', 'message_count', 'log_count') + tuple(f'{level}_log_count'
+                                                                          for level in LOG_LEVELS)
+    fixed = 0
+    for agent_id in ids:
+        stats = current.get(agent_id)
+        # 对话和日志删除后最后活动时间不回退
+        if stats is not None:
+            _keep_latest(activity, agent_id, stats.last_activity_at)
+        values = {column: expected[agent_id][column] for column in columns}
+        values['last_activity_at'] = activity.get(agent_id)
+        if stats is not None and all(getattr(stats, name) == value for name, value in values.items()):
+            continue
+        fixed += 1
+        if dry_run:
+            continue
+        if stats is None:
+            db.session.add(AgentStats(agent_id=agent_id, **values))
+        else:
+            for name, value in values.items():
+                setattr(stats, name, value)
+    return fixed
+
+
+def _remove_orphans(key, batch_size, dry_run):
+    """删除已删除的智能体或数据不在这个数据库中的智能体留下的统计"""
+    for ids in _chunks(AgentStats.agent_id, batch_size):
+        placements = db.session.query(Agent.id, Agent.shard, Agent.shard_moving_to).filter(Agent.id.in_(ids))
+        # 迁移中的智能体在目标分片上已有统计
+        kept = {agent_id for agent_id, shard, moving_to in placements
+                if shard == key or (moving_to is not None and moving_to == key)}
+        orphans = [agent_id for agent_id in ids if agent_id not in kept]
+        if orphans and not dry_run:
+            AgentStats.query.filter(AgentStats.agent_id.in_(orphans)).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def repair(batch_size=500, dry_run=False):
+    """按现有数据重建对话和智能体的统计，每批单独提交，返回(修正的对话数, 修正的智能体数)
+
+    在主库和每个分片上，先重算对话的消息数，再由对话和日志重算数据在该处的智能体的统计；
+    已删除的智能体留下的统计一并清理。
+    """
+    conversations = agents = 0
+    for key in data_binds():
+        use_shard(key)
+        for ids in _chunks(Conversation.id, batch_size):
+            conversations += _repair_conversations(ids, dry_run)
+            db.session.commit()
+        placed = Agent.shard.is_(None) if key is None else Agent.shard == key
+        for ids in _chunks(Agent.id, batch_size, placed):
+            agents += _repair_agents(ids, dry_run)
+            db.session.commit()
+        _remove_orphans(key, batch_size, dry_run)
+    return conversations, agents
+
+
+def repair_agent(agent_id, batch_size=500):
+    """在会话当前的数据库中重算一个智能体的对话计数和统计，每批单独提交（分片迁移后使用）"""
+    for ids in _chunks(Conversation.id, batch_size, Conversation.agent_id == agent_id):
+        _repair_conversations(ids, False)
+        db.session.commit()
+    _repair_agents([agent_id], False)
+    db.session.commit()
+
+
+def configure_stats():
+    """注册会话事件，只需注册一次"""
+    for name, listener in (('before_flush', _before_flush), ('after_flush', _after_flush)):
+        if not event.contains(RoutingSession, name, listener):
+            event.listen(RoutingSession, name, listener)
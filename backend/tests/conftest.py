@@ -0,0 +1,59 @@
+"""测试夹具：每个测试使用临时目录中的SQLite主库（可选若干分片），查询预算为raise模式，模型调用被替换为固定回复
+
+在backend目录下执行：python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_service  # noqa: E402
+from app import create_app  # noqa: E402
+from commands import init_db  # noqa: E402
+from shards import shard_binds  # noqa: E402
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'app_config(**config): 覆盖测试应用的配置项')
+
+
+@pytest.fixture(params=[0, 2], ids=['primary', 'shards'])
+def app(request, tmp_path, monkeypatch):
+    """不分片和两个分片两种配置各运行一次，测试可以用app_config标记覆盖配置"""
+    marker = request.node.get_closest_marker('app_config')
+    monkeypatch.setattr(chat_service, 'call_model', lambda endpoint, payload, headers: ('reply', 5))
+    binds = shard_binds([f'sqlite:///{tmp_path}/shard{index}.db' for index in range(request.param)])
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/primary.db',
+        'SQLALCHEMY_BINDS': binds,
+        'DB_SHARD_KEYS': list(binds),
+        'QUERY_BUDGET_MODE': 'raise',
+        'CHAT_JOBS_EXECUTOR': 'external',
+        'DELETION_EXECUTOR': 'external',
+        **(marker.kwargs if marker else {}),
+    })
+    with app.app_context():
+        init_db()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def agent_id(client):
+    model = client.post('/api/models/', json={'name': 'model', 'api_endpoint': 'http://model', 'model_name': 'x'})
+    agent = client.post('/api/agents/', json={'name': 'agent', 'model_id': model.json['model']['id']})
+    return agent.json['agent']['id']
+
+
+@pytest.fixture
+def conversation_id(client, agent_id):
+    response = client.post(f'/api/chat/agents/{agent_id}/chat', json={'message': 'hello'})
+    assert response.status_code == 200
+    return response.json['conversation_id']
@@ -0,0 +1,29 @@
+from archive import archive_idle_conversations
+
+
+def _archive(app):
+    with app.app_context():
+        return archive_idle_conversations(0)
+
+
+def test_deleted_conversation_is_not_archived_or_restored(app, client, agent_id, conversation_id):
+    kept = client.post(f'/api/chat/agents/{agent_id}/chat', json={'message': 'keep'}).json['conversation_id']
+    assert client.delete(f'/api/chat/conversations/{conversation_id}').status_code == 202
+
+    assert _archive(app) == 1
+    assert client.get(f'/api/chat/conversations/{conversation_id}/messages').status_code == 404
+    # 未删除的对话照常归档并在读取时恢复
+    restored = client.get(f'/api/chat/conversations/{kept}/messages')
+    assert restored.status_code == 200
+    assert [message['content'] for message in restored.json['messages']] == ['keep', 'reply']
+
+
+def test_archive_of_deleted_agent_is_not_restored(app, client, agent_id, conversation_id):
+    assert _archive(app) == 1
+    assert client.delete(f'/api/agents/{agent_id}').status_code == 202
+    assert client.get(f'/api/chat/conversations/{conversation_id}/messages').status_code == 404
+
+
+def test_conversations_of_deleted_agent_are_not_archived(app, client, agent_id, conversation_id):
+    assert client.delete(f'/api/agents/{agent_id}').status_code == 202
+    assert _archive(app) == 0
@@ -0,0 +1,26 @@
+import pytest
+
+
+def test_delete_conversation_within_query_budget(client, conversation_id):
+    response = client.delete(f'/api/chat/conversations/{conversation_id}')
+    assert response.status_code == 202
+    assert client.get(f'/api/chat/conversations/{conversation_id}/messages').status_code == 404
+
+
+def test_delete_forked_conversation_is_rejected(client, conversation_id):
+    fork = client.post(f'/api/chat/conversations/{conversation_id}/fork', json={})
+    assert fork.status_code == 201
+    assert client.delete(f'/api/chat/conversations/{conversation_id}').status_code == 409
+    assert client.delete(f'/api/chat/conversations/{fork.json["conversation"]["conversation_id"]}').status_code == 202
+
+
+@pytest.mark.app_config(MESSAGE_DEDUP=True)
+def test_chat_with_dedup_within_query_budget(client, agent_id, conversation_id):
+    reply = client.post(f'/api/chat/agents/{agent_id}/chat', json={'message': 'hello', 'conversation_id': conversation_id})
+    assert reply.status_code == 200
+    fork = client.post(f'/api/chat/conversations/{conversation_id}/fork', json={}).json['conversation']
+    reply = client.post(f'/api/chat/agents/{agent_id}/chat',
+                        json={'message': 'hello', 'conversation_id': fork['conversation_id']})
+    assert reply.status_code == 200
+    messages = client.get(f'/api/chat/conversations/{fork["conversation_id"]}/messages').json['messages']
+    assert [message['content'] for message in messages] == ['hello', 'reply'] * 3
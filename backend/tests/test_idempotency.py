@@ -0,0 +1,23 @@
+def _chat(client, agent_id, message, remote_addr='10.0.0.1', **headers):
+    return client.post(f'/api/chat/agents/{agent_id}/chat', json={'message': message},
+                       headers={'Idempotency-Key': 'retry-1', **headers}, environ_base={'REMOTE_ADDR': remote_addr})
+
+
+def test_replay_is_scoped_to_client_address_not_user_header(client, agent_id):
+    first = _chat(client, agent_id, 'secret', **{'X-User-Id': 'alice'})
+    # 伪造别人的X-User-Id不能取回别人的响应
+    other = _chat(client, agent_id, 'secret', remote_addr='10.0.0.2', **{'X-User-Id': 'alice'})
+    assert other.headers.get('Idempotent-Replayed') is None
+    assert other.json['conversation_id'] != first.json['conversation_id']
+    retry = _chat(client, agent_id, 'secret')
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert retry.json['conversation_id'] == first.json['conversation_id']
+
+
+def test_replay_is_scoped_to_gateway_user_header(app, client, agent_id):
+    app.config['RATE_LIMIT_USER_HEADER'] = 'X-Auth-User'
+    first = _chat(client, agent_id, 'secret', **{'X-Auth-User': 'alice'})
+    other = _chat(client, agent_id, 'secret', **{'X-Auth-User': 'bob', 'X-User-Id': 'alice'})
+    assert other.headers.get('Idempotent-Replayed') is None
+    retry = _chat(client, agent_id, 'secret', remote_addr='10.0.0.2', **{'X-Auth-User': 'alice'})
+    assert retry.json['conversation_id'] == first.json['conversation_id']
@@ -0,0 +1,23 @@
+import pytest
+
+import ratelimit
+
+
+@pytest.mark.app_config(RATE_LIMIT_ENABLED=True, RATE_LIMIT_USER_RPS=1.0)
+def test_user_header_does_not_bypass_user_limit(client):
+    statuses = [client.get('/api/logs/', headers={'X-User-Id': f'user-{index}'}).status_code for index in range(3)]
+    assert statuses == [200, 429, 429]
+
+
+@pytest.mark.app_config(RATE_LIMIT_ENABLED=True, RATE_LIMIT_AGENT_RPS=1000.0)
+def test_agent_model_cache_is_bounded(app, client, agent_id, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'AGENT_MODEL_CACHE_SIZE', 2)
+    model_id = client.get(f'/api/agents/{agent_id}').json['agent']['model_id']
+    others = [client.post('/api/agents/', json={'name': f'agent-{index}', 'model_id': model_id}).json['agent']['id']
+              for index in range(2)]
+    for other in others:
+        client.get(f'/api/agents/{other}')
+    # 不存在的智能体不缓存，超过上限时丢弃最久未使用的条目
+    client.get(f'/api/agents/{others[-1] + 100}')
+    cache, _ = app.extensions['rate_limit_agent_models']
+    assert list(cache) == others
@@ -0,0 +1,223 @@
+import os
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, select, update
+
+from models import db, ConversationTurn
+from query_budget import exempt_from_query_budget
+
+# 对话轮次排队的默认配置，均可通过同名环境变量覆盖
+TURN_QUEUE_DEFAULTS = {
+    'TURN_QUEUE_MODE': 'database',       # database：在数据库中排队，跨工作进程有序；local：只在进程内有序；off：不排队
+    'TURN_QUEUE_MAX_DEPTH': '10',        # 同一对话最多排队的轮次（含执行中的），超出时直接拒绝
+    'TURN_QUEUE_WAIT_SECONDS': '120',    # 排队的最长等待时间，超时拒绝
+    'TURN_QUEUE_LEASE_SECONDS': '60',    # 排队记录的租约，所属进程定期续期，进程退出后过期的记录被跳过
+    'TURN_QUEUE_POLL_SECONDS': '0.2',    # 等待其他进程中的轮次结束时的轮询间隔
+}
+
+
+class ConversationBusy(Exception):
+    """对话的排队已满或等待超时，retry_after为建议的重试等待秒数"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def load_turn_queue_config(app, environ):
+    """从环境变量读取对话轮次排队配置"""
+    for key, default in TURN_QUEUE_DEFAULTS.items():
+        value = environ.get(key, default)
+        if key == 'TURN_QUEUE_MODE':
+            app.config[key] = value
+        else:
+            app.config[key] = float(value) if key.endswith('_SECONDS') else int(value)
+
+
+class LocalTurnQueue:
+    """进程内的轮次排队：每个对话一个先进先出队列，队首的轮次执行"""
+
+    def __init__(self, max_depth):
+        self.max_depth = max_depth
+        self._changed = threading.Condition()
+        self._queues = {}
+
+    def enter(self, conversation_id, timeout):
+        """排队直到轮到本轮次，返回排队凭据"""
+        ticket = object()
+        with self._changed:
+            queue = self._queues.setdefault(conversation_id, deque())
+            if len(queue) >= self.max_depth:
+                raise ConversationBusy(f'Conversation {conversation_id} has too many queued turns')
+            queue.append(ticket)
+            deadline = time.monotonic() + timeout
+            while queue[0] is not ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(ticket)
+                    raise ConversationBusy(f'Timed out waiting for conversation {conversation_id}')
+                self._changed.wait(remaining)
+        return ticket
+
+    def leave(self, conversation_id, ticket):
+        with self._changed:
+            queue = self._queues[conversation_id]
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[conversation_id]
+            self._changed.notify_all()
+
+    def depth(self, conversation_id):
+        """排队中的轮次数（含执行中的）"""
+        with self._changed:
+            return len(self._queues.get(conversation_id, ()))
+
+
+class DatabaseTurnQueue:
+    """跨工作进程的轮次排队：每个轮次在conversation_turn表中插入一行，同一对话按ID顺序逐个执行
+
+    所属进程的续期线程每1/3租约为本进程的记录续期一次；进程退出后记录过期，排在后面的轮次跳过它继续执行。
+    同一进程内的轮次结束时立即唤醒等待者，其他进程中的轮次结束通过轮询发现。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self.max_depth = app.config['TURN_QUEUE_MAX_DEPTH']
+        self._changed = threading.Condition()
+        self._tickets = set()  # 本进程排队中和执行中的记录
+        self._pid = None
+        self.owner = None
+
+    def _live(self, conversation_id, now):
+        return ConversationTurn.conversation_id == conversation_id, ConversationTurn.expires_at > now
+
+    def _ahead(self, conversation_id, ticket):
+        """排在ticket前面且未过期的记录数"""
+        with db.engine.begin() as connection:
+            return connection.execute(
+                select(func.count()).select_from(ConversationTurn)
+                .where(*self._live(conversation_id, datetime.utcnow()), ConversationTurn.id < ticket)
+            ).scalar()
+
+    @exempt_from_query_budget
+    def _poll(self, conversation_id, ticket):
+        # 等待期间的轮询次数取决于前面轮次的耗时，不计入请求的查询预算
+        return self._ahead(conversation_id, ticket)
+
+    def _start_renewer(self):
+        # 预fork部署时每个工作进程各自续期
+        with self._changed:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.owner = f'{socket.gethostname()}:{self._pid}'
+            self._tickets = set()
+        threading.Thread(target=self._renew, name='turn-queue', daemon=True).start()
+
+    def _renew(self):
+        interval = self.config['TURN_QUEUE_LEASE_SECONDS'] / 3
+        while True:
+            time.sleep(interval)
+            try:
+                with self.app.app_context(), db.engine.begin() as connection:
+                    now = datetime.utcnow()
+                    with self._changed:
+                        tickets = list(self._tickets)
+                    if tickets:
+                        expires_at = now + timedelta(seconds=self.config['TURN_QUEUE_LEASE_SECONDS'])
+                        connection.execute(update(ConversationTurn).where(ConversationTurn.id.in_(tickets))
+                                           .values(expires_at=expires_at))
+                    # 清理退出的进程留下的记录
+                    connection.execute(delete(ConversationTurn).where(ConversationTurn.expires_at <= now))
+            except Exception:
+                self.app.logger.exception('Failed to renew conversation turns')
+
+    def enter(self, conversation_id, timeout):
+        """排队直到排在前面的轮次都已结束，返回排队记录的ID"""
+        self._start_renewer()
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            ticket = connection.execute(insert(ConversationTurn).values(
+                conversation_id=conversation_id, owner=self.owner, created_at=now,
+                expires_at=now + timedelta(seconds=self.config['TURN_QUEUE_LEASE_SECONDS'])
+            )).inserted_primary_key[0]
+        with self._changed:
+            self._tickets.add(ticket)
+
+        deadline = time.monotonic() + timeout
+        try:
+            ahead = self._ahead(conversation_id, ticket)
+            if ahead >= self.max_depth:
+                raise ConversationBusy(f'Conversation {conversation_id} has too many queued turns')
+            while ahead:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConversationBusy(f'Timed out waiting for conversation {conversation_id}')
+                with self._changed:
+                    self._changed.wait(min(self.config['TURN_QUEUE_POLL_SECONDS'], remaining))
+                ahead = self._poll(conversation_id, ticket)
+            return ticket
+        except BaseException:
+            self.leave(conversation_id, ticket)
+            raise
+
+    def leave(self, conversation_id, ticket):
+        with self._changed:
+            self._tickets.discard(ticket)
+        with db.engine.begin() as connection:
+            connection.execute(delete(ConversationTurn).where(ConversationTurn.id == ticket))
+        with self._changed:
+            self._changed.notify_all()
+
+    def depth(self, conversation_id):
+        """排队中的轮次数（含执行中的），包括所有工作进程"""
+        with db.engine.connect() as connection:
+            return connection.execute(
+                select(func.count()).select_from(ConversationTurn)
+                .where(*self._live(conversation_id, datetime.utcnow()))
+            ).scalar()
+
+
+@contextmanager
+def conversation_turn(conversation_id):
+    """在with块中独占执行对话的一轮：同一对话的轮次按到达顺序逐个执行，不同对话互不影响
+
+    排队已满或等待超过TURN_QUEUE_WAIT_SECONDS时抛出ConversationBusy。
+    """
+    queue = current_app.extensions.get('turn_queue')
+    if queue is None or not conversation_id:
+        yield
+        return
+    # 排队期间不持有数据库事务（SQLite写事务会阻塞执行中的轮次）
+    db.session.commit()
+    ticket = queue.enter(conversation_id, current_app.config['TURN_QUEUE_WAIT_SECONDS'])
+    try:
+        yield
+    except BaseException:
+        # 先结束会话的事务（释放SQLite写锁），再删除排队记录
+        db.session.rollback()
+        raise
+    finally:
+        queue.leave(conversation_id, ticket)
+
+
+def queue_depth(conversation_id):
+    """对话排队中的轮次数（含执行中的），未启用排队时为None"""
+    queue = current_app.extensions.get('turn_queue')
+    return None if queue is None else queue.depth(conversation_id)
+
+
+def configure_turn_queue(app):
+    """创建对话轮次排队"""
+    mode = app.config['TURN_QUEUE_MODE']
+    if mode == 'database':
+        app.extensions['turn_queue'] = DatabaseTurnQueue(app)
+    elif mode == 'local':
+        app.extensions['turn_queue'] = LocalTurnQueue(app.config['TURN_QUEUE_MAX_DEPTH'])
@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from flask import current_app
+from sqlalchemy import case, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Agent, Model, ModelWarmState
+
+_start_lock = threading.Lock()
+
+
+def load_warmup_config(app, environ):
+    """从环境变量读取模型预热配置"""
+    app.config['WARMUP_ENABLED'] = environ.get('WARMUP_ENABLED', 'false').lower() == 'true'
+    # 检查运行中的智能体引用了哪些模型的间隔；智能体状态变化时会立即检查
+    app.config['WARMUP_CHECK_SECONDS'] = float(environ.get('WARMUP_CHECK_SECONDS', '15'))
+    # keep-alive间隔，应小于WARMUP_KEEP_ALIVE，否则模型会在两次ping之间被卸载
+    app.config['WARMUP_PING_SECONDS'] = float(environ.get('WARMUP_PING_SECONDS', '240'))
+    # 每次加载或ping时请求模型驻留的时长（Ollama的keep_alive参数）
+    app.config['WARMUP_KEEP_ALIVE'] = environ.get('WARMUP_KEEP_ALIVE', '10m')
+    # 没有运行中的智能体引用时主动卸载；false时等待keep_alive到期由Ollama卸载
+    app.config['WARMUP_UNLOAD'] = environ.get('WARMUP_UNLOAD', 'true').lower() == 'true'
+    # 加载请求的超时时间，大模型首次加载可能需要几分钟
+    app.config['WARMUP_TIMEOUT_SECONDS'] = float(environ.get('WARMUP_TIMEOUT_SECONDS', '300'))
+
+
+def ollama_base_url(api_endpoint):
+    """由模型的OpenAI兼容端点推出Ollama服务地址，例如 http://host:11434/v1/chat/completions -> http://host:11434"""
+    parts = urlsplit(api_endpoint)
+    path = parts.path
+    for marker in ('/v1/', '/api/'):
+        index = (path + '/').find(marker)
+        if index >= 0:
+            path = path[:index]
+            break
+    else:
+        path = ''
+    return f'{parts.scheme}://{parts.netloc}{path}'
+
+
+def send_keep_alive(base_url, model_name, api_key, keep_alive, timeout):
+    """请求Ollama加载模型并驻留keep_alive时长（为0时卸载），返回耗时（秒）
+
+    不带prompt的/api/generate请求只加载模型，不做推理。出错时抛出requests.exceptions.RequestException。
+    """
+    # requests导入较慢，只在真正发送请求时加载
+    import requests
+
+    headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
+    started = time.perf_counter()
+    response = requests.post(f'{base_url}/api/generate', json={'model': model_name, 'keep_alive': keep_alive},
+                             headers=headers, timeout=timeout)
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+def _target(model):
+    """发送预热请求所需的模型信息：(模型ID, Ollama服务地址, Ollama模型名称, API密钥)"""
+    return model.id, ollama_base_url(model.api_endpoint), model.model_name, model.api_key
+
+
+class WarmupManager:
+    """模型预热管理器：让运行中的智能体引用的模型保持驻留内存
+
+    智能体进入running时预加载其模型，之后定期发送keep-alive；引用某个模型的智能体全部
+    paused/stopped后卸载该模型。多个进程可以同时运行管理器，加载和ping通过
+    model_warm_state.next_ping_at上的条件更新保证同一时间只有一个进程发送。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self.pid = os.getpid()
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def wake(self):
+        """智能体状态变化时立即检查"""
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='model-warmup', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    self.sync()
+            except Exception:
+                self.app.logger.exception('Model warm-up manager error')
+            self._wake.wait(self.config['WARMUP_CHECK_SECONDS'])
+            self._wake.clear()
+
+    def sync(self):
+        """预加载或ping运行中的智能体引用的模型，卸载不再被引用的模型"""
+        now = datetime.utcnow()
+        referenced = {
+            model.id: _target(model)
+            for model in Model.query.join(Agent).filter(Agent.status == 'running', Model.status == 'active')
+        }
+        rows = {row.model_id: row.state for row in ModelWarmState.query}
+        db.session.commit()
+
+        for model_id in referenced.keys() - rows.keys():
+            db.session.add(ModelWarmState(model_id=model_id, state='cold'))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # 其他进程已创建
+                db.session.rollback()
+            rows[model_id] = 'cold'
+
+        for model_id, target in referenced.items():
+            self._keep_warm(target, rows[model_id], now)
+
+        # 同一Ollama模型可能登记为多个模型，仍被引用时不卸载
+        in_use = {(base_url, model_name) for _, base_url, model_name, _ in referenced.values()}
+        idle = [model_id for model_id, state in rows.items() if model_id not in referenced and state != 'cold']
+        if idle:
+            models = {model.id: _target(model) for model in Model.query.filter(Model.id.in_(idle))}
+            db.session.commit()
+            for model_id in idle:
+                target = models.get(model_id)
+                self._release(model_id, target, rows[model_id], target is not None and target[1:3] in in_use)
+
+    def _keep_warm(self, target, state, now):
+        """到期时加载或ping一个模型"""
+        model_id, base_url, model_name, api_key = target
+        due = or_(ModelWarmState.state == 'cold', ModelWarmState.next_ping_at.is_(None),
+                  ModelWarmState.next_ping_at <= now)
+        # 推迟下次ping时间作为租约，其他进程不会同时加载
+        claimed = db.session.execute(
+            update(ModelWarmState).where(ModelWarmState.model_id == model_id, due).values(
+                state=case((ModelWarmState.state == 'warm', 'warm'), else_='warming'),
+                next_ping_at=now + timedelta(seconds=self.config['WARMUP_TIMEOUT_SECONDS']),
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            return
+
+        import requests
+
+        try:
+            duration = send_keep_alive(base_url, model_name, api_key, self.config['WARMUP_KEEP_ALIVE'],
+                                       self.config['WARMUP_TIMEOUT_SECONDS'])
+        except requests.exceptions.RequestException as e:
+            finished = datetime.utcnow()
+            values = {'state': 'error', 'error': str(e),
+                      'next_ping_at': finished + timedelta(seconds=self.config['WARMUP_PING_SECONDS'])}
+            self.app.logger.warning('Failed to warm up model %s: %s', model_id, e)
+        else:
+            finished = datetime.utcnow()
+            values = {'state': 'warm', 'error': None, 'last_ping_at': finished,
+                      'next_ping_at': finished + timedelta(seconds=self.config['WARMUP_PING_SECONDS'])}
+            if state != 'warm':
+                values.update(last_loaded_at=finished, load_seconds=round(duration, 3))
+        db.session.execute(update(ModelWarmState).where(ModelWarmState.model_id == model_id).values(**values)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+
+    def _release(self, model_id, target, state, shared):
+        """模型不再被运行中的智能体引用：标记为cold，并按配置卸载"""
+        if target is None:
+            # 模型已删除
+            ModelWarmState.query.filter_by(model_id=model_id).delete(synchronize_session=False)
+            db.session.commit()
+            return
+        # 加载中的模型由正在加载的进程完成后再处理
+        released = db.session.execute(
+            update(ModelWarmState).where(ModelWarmState.model_id == model_id,
+                                         ModelWarmState.state.in_(('warm', 'error')))
+            .values(state='cold', next_ping_at=None).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if not released or shared or state != 'warm' or not self.config['WARMUP_UNLOAD']:
+            return
+
+        import requests
+
+        _, base_url, model_name, api_key = target
+        try:
+            send_keep_alive(base_url, model_name, api_key, 0, self.config['WARMUP_TIMEOUT_SECONDS'])
+        except requests.exceptions.RequestException as e:
+            # 卸载失败时模型在keep_alive到期后由Ollama卸载
+            self.app.logger.warning('Failed to unload model %s: %s', model_id, e)
+
+
+def warm_states(model_ids=None):
+    """各模型的预热状态和引用它的运行中智能体数，没有记录的模型为cold"""
+    running = db.session.query(Agent.model_id, db.func.count(Agent.id)).filter(Agent.status == 'running')
+    states = ModelWarmState.query
+    if model_ids is not None:
+        running = running.filter(Agent.model_id.in_(model_ids))
+        states = states.filter(ModelWarmState.model_id.in_(model_ids))
+    running = dict(running.group_by(Agent.model_id).all())
+    states = {row.model_id: row for row in states}
+    result = {}
+    for model_id in (model_ids if model_ids is not None else states.keys() | running.keys()):
+        row = states.get(model_id)
+        status = row.to_dict() if row else ModelWarmState(model_id=model_id, state='cold').to_dict()
+        status['running_agents'] = running.get(model_id, 0)
+        result[model_id] = status
+    return result
+
+
+def agent_status_changed():
+    """智能体状态变化后调用：唤醒当前进程中的预热管理器，不必等到下次定期检查"""
+    manager = current_app.extensions.get('warmup')
+    if manager is not None:
+        manager.wake()
+
+
+def start_manager(app):
+    """在当前进程中启动预热管理器（每个进程一个），未启用时不做任何事"""
+    if not app.config.get('WARMUP_ENABLED'):
+        return
+    manager = app.extensions.get('warmup')
+    if manager is not None and manager.pid == os.getpid():
+        return
+    with _start_lock:
+        manager = app.extensions.get('warmup')
+        if manager is not None and manager.pid == os.getpid():
+            return
+        manager = WarmupManager(app)
+        manager.start()
+        app.extensions['warmup'] = manager
+
+
+def configure_warmup(app):
+    """启用时在首个请求时启动预热管理器（预fork部署时每个工作进程各自启动）"""
+    if app.config.get('WARMUP_ENABLED'):
+        app.before_request(lambda: start_manager(app))
@@ -0,0 +1,12 @@
+import axios from 'axios'
+
+// 在一次HTTP调用中按顺序执行多个请求（POST /api/batch），返回各子请求的响应体
+// 任一子请求失败时抛出错误；transactional为true时所有修改在同一事务中提交，失败时全部回滚
+export async function batch(requests, { transactional = false } = {}) {
+  const response = await axios.post('/batch', { requests, transactional })
+  const failed = response.data.responses.find(result => result.status >= 400)
+  if (failed) {
+    throw new Error(failed.body?.error || failed.body?.message || `HTTP ${failed.status}`)
+  }
+  return response.data.responses.map(result => result.body)
+}
@@ -0,0 +1,8 @@
+import axios from 'axios'
+
+// 按名称前缀和子串查找（GET /api/search），types为 agents、models、users、roles 中的一个或多个
+// 返回 { agents: [...], models: [...], ... }，前缀匹配的结果在前
+export async function search(q, types, { limit = 10 } = {}) {
+  const response = await axios.get('/search', { params: { q, types: types.join(','), limit } })
+  return response.data
+}